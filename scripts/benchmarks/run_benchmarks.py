@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+训练与推理吞吐基准测试
+可在仅有CPU的Linux机器上运行，默认使用合成的jet色图时频图数据集（也可指定真实数据集）。
+测量项目：
+  - DataLoader在不同worker数下的图像吞吐
+  - 标准/对比学习模式的训练step耗时
+  - 验证(eval)吞吐
+  - ONNX模型在batch 1-5下的推理延迟
+
+用法:
+  python run_benchmarks.py run --output results/baseline.json
+  python run_benchmarks.py compare results/baseline.json results/current.json --threshold 0.1
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import shutil
+import tempfile
+import subprocess
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+
+from spectrogram_preprocessing import INPUT_MODES, NATIVE_SIZE, jet_colormap, get_input_shape
+
+
+def get_machine_info():
+    """记录运行环境，用于判断两次结果是否可比"""
+    import torch
+
+    cpu_model = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu_model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+
+    return {
+        'hostname': socket.gethostname(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'cpu_model': cpu_model,
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+        'cuda': torch.cuda.is_available(),
+        'git_commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds')
+    }
+
+
+def create_synthetic_dataset(root, num_classes=4, images_per_class=16, seed=0):
+    """生成jet色图渲染的合成时频图(256x256 JPEG)，目录结构与真实数据集相同"""
+    rng = np.random.default_rng(seed)
+    colormap = (jet_colormap(256) * 255).astype(np.uint8)
+    time_axis = np.linspace(0, 4 * np.pi, NATIVE_SIZE)
+
+    for class_idx in range(num_classes):
+        class_dir = os.path.join(root, f'ID_{class_idx + 1}')
+        os.makedirs(class_dir, exist_ok=True)
+        for i in range(images_per_class):
+            # 每个类别的微多普勒正弦频率不同，叠加噪声
+            rows = NATIVE_SIZE / 2 + NATIVE_SIZE / 4 * np.sin((class_idx + 1) * time_axis + rng.uniform(0, np.pi))
+            grid = np.arange(NATIVE_SIZE)[:, None]
+            intensity = np.exp(-((grid - rows[None, :]) ** 2) / 200.0) + 0.2 * rng.random((NATIVE_SIZE, NATIVE_SIZE))
+            index = np.clip(intensity / intensity.max() * 255, 0, 255).astype(np.uint8)
+            Image.fromarray(colormap[index]).save(os.path.join(class_dir, f'{i:04d}.jpg'), quality=90)
+    return root
+
+
+def timed_percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95))
+    }
+
+
+def bench_loader(dataset, batch_size, worker_counts, max_batches):
+    """DataLoader吞吐：每个worker数迭代max_batches个批次（首批单独计时，包含worker启动）"""
+    from torch.utils.data import DataLoader
+
+    results = {}
+    for num_workers in worker_counts:
+        loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+        start = time.perf_counter()
+        iterator = iter(loader)
+        next(iterator)
+        first_batch_s = time.perf_counter() - start
+
+        images = 0
+        start = time.perf_counter()
+        for _ in range(max_batches):
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                iterator = iter(loader)
+                batch = next(iterator)
+            images += batch[1].size(0)
+        elapsed = time.perf_counter() - start
+        del iterator
+
+        results[f'workers_{num_workers}'] = {
+            'images_per_sec': images / elapsed,
+            'first_batch_s': first_batch_s
+        }
+        print(f"  num_workers={num_workers}: {images / elapsed:.1f} 图像/秒 (首批 {first_batch_s:.2f}s)")
+    return results
+
+
+def collect_batches(dataset, batch_size, num_batches):
+    """预先读取若干批次到内存，使训练/验证计时不受数据加载影响"""
+    from torch.utils.data import DataLoader
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=0)
+    batches = []
+    for batch in loader:
+        batches.append(batch)
+        if len(batches) >= num_batches:
+            break
+    return batches
+
+
+def bench_train_steps(model, batches, contrastive, warmup, steps):
+    """训练step耗时：前向、损失、反向、优化器更新，与train_model中的单步一致"""
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+    from train_resnet18 import ContrastiveLoss
+
+    criterion = nn.CrossEntropyLoss()
+    contrastive_criterion = ContrastiveLoss(margin=1.0)
+    optimizer = optim.Adam(model.parameters(), lr=1e-4, weight_decay=1e-5)
+    model.train()
+
+    samples = []
+    for step in range(warmup + steps):
+        batch = batches[step % len(batches)]
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        if contrastive:
+            (anchor_images, pair_images), (anchor_labels, _, similarities) = batch
+            anchor_embeddings, anchor_outputs = model(anchor_images)
+            pair_embeddings, _ = model(pair_images)
+            loss = 0.5 * criterion(anchor_outputs, anchor_labels) + \
+                0.5 * contrastive_criterion(anchor_embeddings, pair_embeddings, similarities)
+        else:
+            images, labels = batch
+            loss = criterion(model(images), labels)
+        loss.backward()
+        optimizer.step()
+        loss.item()
+        if step >= warmup:
+            samples.append((time.perf_counter() - start) * 1000)
+    return timed_percentiles(samples)
+
+
+def bench_eval(model, batches, warmup, repeats):
+    """验证吞吐（图像/秒）"""
+    import torch
+
+    model.eval()
+    images = 0
+    with torch.no_grad():
+        for batch in batches[:warmup]:
+            model(batch[0])
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for batch_images, _ in batches:
+                model(batch_images)
+                images += batch_images.size(0)
+        elapsed = time.perf_counter() - start
+    return {'images_per_sec': images / elapsed}
+
+
+def bench_onnx(model, preprocessing, batch_sizes, runs, work_dir):
+    """导出ONNX并用onnxruntime测量不同batch大小的推理延迟"""
+    import torch
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        print("  未安装onnxruntime，跳过ONNX延迟测试")
+        return {}
+
+    model.eval()
+    onnx_path = os.path.join(work_dir, 'benchmark_model.onnx')
+    torch.onnx.export(
+        model, torch.randn(get_input_shape(preprocessing)), onnx_path,
+        export_params=True, opset_version=11, do_constant_folding=True,
+        input_names=['input'], output_names=['output'],
+        dynamic_axes={'input': {0: 'batch_size'}, 'output': {0: 'batch_size'}}
+    )
+    session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+
+    results = {}
+    for batch_size in batch_sizes:
+        inputs = np.random.randn(*get_input_shape(preprocessing, batch_size)).astype(np.float32)
+        for _ in range(3):
+            session.run(None, {'input': inputs})
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            session.run(None, {'input': inputs})
+            samples.append((time.perf_counter() - start) * 1000)
+        results[f'batch_{batch_size}'] = timed_percentiles(samples)
+        print(f"  batch={batch_size}: p50 {results[f'batch_{batch_size}']['p50_ms']:.2f}ms, "
+              f"p95 {results[f'batch_{batch_size}']['p95_ms']:.2f}ms")
+    return results
+
+
+# 各指标的方向：True表示越大越好
+METRIC_DIRECTIONS = {
+    'images_per_sec': True,
+    'first_batch_s': False,
+    'mean_ms': False,
+    'p50_ms': False,
+    'p95_ms': False
+}
+
+
+def flatten_results(results, prefix=''):
+    """嵌套结果 → {'train.standard.p50_ms': value}"""
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten_results(value, name))
+        else:
+            flat[name] = value
+    return flat
+
+
+def run(args):
+    import torch
+    from train_resnet18 import GaitDataset, load_dataset, create_data_transforms, create_model, get_image_mode
+    from spectrogram_preprocessing import get_preprocessing_config
+
+    torch.manual_seed(0)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    work_dir = tempfile.mkdtemp(prefix='gait_benchmark_')
+    dataset_path = args.dataset_path
+    if dataset_path is None:
+        dataset_path = create_synthetic_dataset(os.path.join(work_dir, 'dataset'), args.synthetic_classes,
+                                                args.synthetic_images)
+        print(f"使用合成数据集: {dataset_path}")
+
+    image_paths, labels, class_names = load_dataset(dataset_path)
+    preprocessing = get_preprocessing_config(args.input_mode, args.input_size)
+    train_transform, val_transform = create_data_transforms(args.input_mode, args.input_size)
+    image_mode = get_image_mode(args.input_mode)
+    train_dataset = GaitDataset(image_paths, labels, train_transform, image_mode=image_mode)
+    contrastive_dataset = GaitDataset(image_paths, labels, train_transform, contrastive_mode=True, image_mode=image_mode)
+    val_dataset = GaitDataset(image_paths, labels, val_transform, image_mode=image_mode)
+
+    results = {}
+    worker_counts = [int(w) for w in args.workers.split(',')]
+    print("\n[1/4] DataLoader吞吐")
+    results['loader'] = bench_loader(train_dataset, args.batch_size, worker_counts, args.loader_batches)
+
+    print("\n[2/4] 训练step耗时")
+    results['train'] = {}
+    for mode, dataset in (('standard', train_dataset), ('contrastive', contrastive_dataset)):
+        contrastive = mode == 'contrastive'
+        model = create_model(len(class_names), contrastive_learning=contrastive, input_mode=args.input_mode,
+                             input_size=args.input_size, pretrained=False)
+        batches = collect_batches(dataset, args.batch_size, min(args.train_steps, 4))
+        results['train'][mode] = bench_train_steps(model, batches, contrastive, args.warmup, args.train_steps)
+        print(f"  {mode}: p50 {results['train'][mode]['p50_ms']:.1f}ms/step "
+              f"(batch={args.batch_size})")
+
+    print("\n[3/4] 验证吞吐")
+    model = create_model(len(class_names), input_mode=args.input_mode, input_size=args.input_size, pretrained=False)
+    batches = collect_batches(val_dataset, args.batch_size, 4)
+    results['eval'] = bench_eval(model, batches, warmup=1, repeats=args.eval_repeats)
+    print(f"  {results['eval']['images_per_sec']:.1f} 图像/秒")
+
+    print("\n[4/4] ONNX推理延迟")
+    batch_sizes = [int(b) for b in args.onnx_batch_sizes.split(',')]
+    results['onnx'] = bench_onnx(model, preprocessing, batch_sizes, args.onnx_runs, work_dir)
+
+    report = {
+        'machine': get_machine_info(),
+        'config': {
+            'dataset': 'synthetic' if args.dataset_path is None else os.path.abspath(args.dataset_path),
+            'num_images': len(image_paths),
+            'num_classes': len(class_names),
+            'batch_size': args.batch_size,
+            'preprocessing': preprocessing
+        },
+        'results': results
+    }
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n基准测试结果已保存到: {args.output}")
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(args):
+    """对比两次结果，任一指标劣化超过阈值时返回非零退出码"""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+
+    for key in ('cpu_model', 'cpu_count', 'torch'):
+        if baseline['machine'].get(key) != current['machine'].get(key):
+            print(f"警告: 运行环境不同 ({key}: {baseline['machine'].get(key)} → {current['machine'].get(key)})，结果可能不可比")
+
+    base_flat = flatten_results(baseline['results'])
+    current_flat = flatten_results(current['results'])
+    regressions = []
+
+    print(f"\n{'指标':<40}{'基线':>12}{'当前':>12}{'变化':>10}")
+    print("-" * 74)
+    for name in sorted(set(base_flat) & set(current_flat)):
+        higher_is_better = METRIC_DIRECTIONS.get(name.rsplit('.', 1)[-1])
+        if higher_is_better is None or not base_flat[name]:
+            continue
+        change = (current_flat[name] - base_flat[name]) / base_flat[name]
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > args.threshold:
+            flag = '  ⚠ 回退'
+            regressions.append(name)
+        print(f"{name:<40}{base_flat[name]:>12.2f}{current_flat[name]:>12.2f}{change:>+10.1%}{flag}")
+
+    for name in sorted(set(base_flat) ^ set(current_flat)):
+        print(f"{name:<40} 仅存在于{'基线' if name in base_flat else '当前'}结果中")
+
+    if regressions:
+        print(f"\n发现 {len(regressions)} 项性能回退（阈值 {args.threshold:.0%}）")
+        sys.exit(1)
+    print(f"\n未发现超过 {args.threshold:.0%} 的性能回退")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='训练与推理吞吐基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='运行基准测试')
+    run_parser.add_argument('--dataset_path', type=str, default=None,
+                            help='真实数据集路径（默认生成合成数据集）')
+    run_parser.add_argument('--synthetic_classes', type=int, default=4,
+                            help='合成数据集的类别数')
+    run_parser.add_argument('--synthetic_images', type=int, default=16,
+                            help='合成数据集每类图像数')
+    run_parser.add_argument('--input_mode', type=str, default='rgb', choices=INPUT_MODES,
+                            help='输入模式')
+    run_parser.add_argument('--input_size', type=int, default=224,
+                            help='输入分辨率')
+    run_parser.add_argument('--batch_size', type=int, default=8,
+                            help='批次大小（与训练默认值一致）')
+    run_parser.add_argument('--workers', type=str, default='0,1,2,4',
+                            help='测试的DataLoader worker数，逗号分隔')
+    run_parser.add_argument('--loader_batches', type=int, default=20,
+                            help='每个worker配置测量的批次数')
+    run_parser.add_argument('--train_steps', type=int, default=10,
+                            help='训练step计时次数')
+    run_parser.add_argument('--warmup', type=int, default=2,
+                            help='预热step数（不计时）')
+    run_parser.add_argument('--eval_repeats', type=int, default=3,
+                            help='验证吞吐测试的重复轮数')
+    run_parser.add_argument('--onnx_batch_sizes', type=str, default='1,2,3,4,5',
+                            help='ONNX延迟测试的batch大小')
+    run_parser.add_argument('--onnx_runs', type=int, default=30,
+                            help='每个batch大小的ONNX推理次数')
+    run_parser.add_argument('--threads', type=int, default=0,
+                            help='torch.set_num_threads，0表示使用默认值')
+    run_parser.add_argument('--output', type=str,
+                            default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'latest.json'),
+                            help='结果JSON输出路径')
+
+    compare_parser = subparsers.add_parser('compare', help='对比两次基准测试结果')
+    compare_parser.add_argument('baseline', type=str, help='基线结果JSON')
+    compare_parser.add_argument('current', type=str, help='当前结果JSON')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='劣化超过该比例时判定为回退（默认10%%）')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+批量离线打分
+对整个目录、glob匹配的文件或zip/tar归档中的时频图批量识别，用于审计和数据漂移检查：
+  - 图像解码和预处理在进程池中完成，主进程用onnxruntime按批推理
+  - 结果（top-k类别和分数、logits、可选嵌入向量）按分片流式写入.npz，内存占用与数据总量无关
+  - 每个分片写完后更新progress.json，中断后重新运行同一命令即从上次完成的分片继续
+只依赖NumPy、Pillow和onnxruntime（导出嵌入向量时额外需要onnx包）。
+"""
+
+import io
+import os
+import glob
+import json
+import time
+import tarfile
+import zipfile
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import onnxruntime as ort
+
+from gait_inference import (DEFAULT_MODEL_DIR, create_session_options, load_metadata, model_fingerprint,
+                            preprocess_image, resolve_model_source, tuned_runtime_config)
+from prediction_cache import DEFAULT_CACHE_SIZE, PredictionCache, cached_run
+from sequential_verification import log_softmax
+from spectrogram_preprocessing import get_input_shape
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+PROGRESS_NAME = 'progress.json'
+EMBEDDING_OUTPUT = 'embedding'
+
+
+def is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_source(source):
+    """按确定的顺序产生(键, 读取函数)，读取函数返回图像字节
+
+    跳过已完成的部分时不调用读取函数，zip和目录不会读取这些文件的内容。
+    tar按流式模式读取，读取函数必须在迭代到下一项之前调用。
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files if is_image_name(name))
+        for path in sorted(paths):
+            yield os.path.relpath(path, source), lambda path=path: open(path, 'rb').read()
+    elif os.path.isfile(source) and zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_image_name(info.filename):
+                    yield info.filename, lambda info=info: archive.read(info)
+    elif os.path.isfile(source) and tarfile.is_tarfile(source):
+        with tarfile.open(source, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and is_image_name(member.name):
+                    yield member.name, lambda member=member: archive.extractfile(member).read()
+    else:
+        paths = sorted(path for path in glob.glob(source, recursive=True) if is_image_name(path))
+        if not paths:
+            raise FileNotFoundError(f"输入既不是目录或归档，也没有匹配的图像: {source}")
+        for path in paths:
+            yield path, lambda path=path: open(path, 'rb').read()
+
+
+_WORKER_PREPROCESSING = None
+
+
+def _init_worker(preprocessing):
+    global _WORKER_PREPROCESSING
+    _WORKER_PREPROCESSING = preprocessing
+
+
+def _decode_batch(payloads, preprocessing=None):
+    """解码并预处理一批图像字节，损坏的图像用零输入占位并标记为无效"""
+    preprocessing = preprocessing or _WORKER_PREPROCESSING
+    arrays = []
+    valid = np.ones(len(payloads), dtype=bool)
+    for i, data in enumerate(payloads):
+        try:
+            arrays.append(preprocess_image(io.BytesIO(data), preprocessing))
+        except Exception:
+            arrays.append(np.zeros(get_input_shape(preprocessing)[1:], dtype=np.float32))
+            valid[i] = False
+    return np.stack(arrays), valid
+
+
+def find_embedding_tensor(graph):
+    """自动选择嵌入向量张量：对比学习模型取L2标准化后的嵌入，否则取全局池化后的主干特征"""
+    for node in graph.node:
+        if node.op_type == 'ReduceL2':
+            for consumer in graph.node:
+                if consumer.op_type == 'Div' and consumer.input[0] == node.input[0]:
+                    return consumer.output[0]
+    pooled = [node.output[0] for node in graph.node if node.op_type in ('GlobalAveragePool', 'ReduceMean')]
+    if pooled:
+        for node in graph.node:
+            if node.op_type in ('Flatten', 'Reshape', 'Squeeze') and node.input[0] == pooled[-1]:
+                return node.output[0]
+        return pooled[-1]
+    raise ValueError('无法自动确定嵌入向量张量，请用 --embedding_tensor 指定')
+
+
+def add_embedding_output(model_source, tensor_name=None):
+    """在ONNX图中把中间张量暴露为额外输出'embedding'，返回模型字节"""
+    import onnx
+    from onnx import helper, TensorProto
+
+    if isinstance(model_source, bytes):
+        model = onnx.load_from_string(model_source)
+    else:
+        model = onnx.load(model_source)
+    graph = model.graph
+    tensor_name = tensor_name or find_embedding_tensor(graph)
+    graph.node.append(helper.make_node('Identity', [tensor_name], [EMBEDDING_OUTPUT], name='embedding_output'))
+    graph.output.append(helper.make_tensor_value_info(EMBEDDING_OUTPUT, TensorProto.FLOAT, None))
+    print(f"嵌入向量张量: {tensor_name}")
+    return model.SerializeToString(), tensor_name
+
+
+def load_progress(output_dir):
+    path = os.path.join(output_dir, PROGRESS_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_progress(output_dir, progress):
+    path = os.path.join(output_dir, PROGRESS_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(progress, f, indent=2, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def write_shard(output_dir, index, arrays):
+    """先写临时文件再原子重命名，中断时不会留下不完整的分片"""
+    path = os.path.join(output_dir, f'shard-{index:05d}.npz')
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(path + '.tmp', path)
+    return os.path.basename(path)
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def score_source(source, output_dir, model_dir=DEFAULT_MODEL_DIR, model_file=None, batch_size=64,
+                 shard_size=4096, top_k=5, workers=None, threads=0, save_logits=True,
+                 embeddings=False, embedding_tensor=None, overwrite=False, cache_path=None,
+                 cache_size=DEFAULT_CACHE_SIZE):
+    """对输入中的全部图像打分，结果写入output_dir，返回progress字典
+
+    cache_path: 预测缓存文件(SQLite)，与推理服务共用时重复出现的图像不再推理；cache_size: 缓存条目数上限
+    """
+    metadata = load_metadata(model_dir)
+    class_names = metadata['class_names']
+    preprocessing = metadata['preprocessing']
+    top_k = min(top_k, len(class_names))
+    # 分片大小取批次大小的整数倍，恢复时按分片边界跳过
+    shard_size = max(batch_size, shard_size // batch_size * batch_size)
+    workers = os.cpu_count() // 2 if workers is None else workers
+
+    model_source = resolve_model_source(model_dir, model_file)
+    config = {
+        'source': os.path.abspath(source),
+        'model_sha256': model_fingerprint(model_source),
+        'batch_size': batch_size,
+        'shard_size': shard_size,
+        'top_k': top_k,
+        'save_logits': save_logits,
+        'embeddings': embeddings,
+        'embedding_tensor': embedding_tensor
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    progress = load_progress(output_dir)
+    if progress is not None and not overwrite:
+        if progress['config'] != config:
+            raise ValueError(f"{output_dir} 中已有不同配置（输入、模型或参数）的打分结果，"
+                             f"请更换输出目录或使用 --overwrite")
+        if progress['complete']:
+            print(f"打分已完成: {progress['processed']} 张图像, {len(progress['shards'])} 个分片")
+            return progress
+        print(f"从第 {len(progress['shards'])} 个分片继续（已处理 {progress['processed']} 张）")
+    else:
+        for name in os.listdir(output_dir):
+            if name.startswith('shard-'):
+                os.remove(os.path.join(output_dir, name))
+        progress = {'config': config, 'class_names': class_names, 'shards': [], 'processed': 0,
+                    'failed': 0, 'complete': False}
+
+    output_names = ['output']
+    if embeddings:
+        model_source, progress['embedding_tensor'] = add_embedding_output(model_source, embedding_tensor)
+        output_names.append(EMBEDDING_OUTPUT)
+    tuned = tuned_runtime_config(metadata)
+    options = create_session_options(tuned['session_options'] if tuned else None, threads)
+    session = ort.InferenceSession(model_source, options, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    # 导出嵌入向量时图已修改，条目键加上嵌入张量名；模型哈希与推理服务相同，共用缓存文件时不会互相清空
+    cache_variant = progress['embedding_tensor'] if embeddings else ''
+    cache = PredictionCache(config['model_sha256'], cache_size, path=cache_path) if cache_path else None
+
+    skip = progress['processed']
+    # 主进程按顺序读取字节（tar流式读取不能回退），解码交给进程池
+    pending_items = ((key, read()) for index, (key, read) in enumerate(iter_source(source)) if index >= skip)
+    batches = (tuple(zip(*batch)) for batch in iter_batches(pending_items, batch_size))
+
+    pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(preprocessing,)) if workers > 0 else None
+    # 同时在途的批次数有上限，内存占用不随数据量增长
+    max_in_flight = max(2, workers * 2)
+    in_flight = deque()
+    shard = {'keys': [], 'valid': [], 'topk_indices': [], 'topk_scores': [], 'logits': [], 'embeddings': []}
+    start = time.perf_counter()
+    scored = 0
+
+    def flush():
+        if not shard['keys']:
+            return
+        arrays = {
+            'keys': np.asarray(shard['keys']),
+            'valid': np.concatenate(shard['valid']),
+            'topk_indices': np.concatenate(shard['topk_indices']).astype(np.int32),
+            'topk_scores': np.concatenate(shard['topk_scores']).astype(np.float32)
+        }
+        if save_logits:
+            arrays['logits'] = np.concatenate(shard['logits']).astype(np.float32)
+        if embeddings:
+            arrays['embeddings'] = np.concatenate(shard['embeddings']).astype(np.float32)
+        name = write_shard(output_dir, len(progress['shards']), arrays)
+        progress['shards'].append(name)
+        progress['processed'] += len(arrays['keys'])
+        progress['failed'] += int((~arrays['valid']).sum())
+        save_progress(output_dir, progress)
+        elapsed = time.perf_counter() - start
+        print(f"  {name}: 累计 {progress['processed']} 张, {scored / elapsed:.1f} 张/秒")
+        for values in shard.values():
+            values.clear()
+
+    def consume(keys, decoded):
+        nonlocal scored
+        inputs, valid = decoded
+        outputs = cached_run(session, input_name, output_names, inputs, cache, cache_variant)
+        logits = outputs[0]
+        probabilities = np.exp(log_softmax(logits, axis=1))
+        topk_indices = np.argsort(-probabilities, axis=1)[:, :top_k]
+        shard['keys'].extend(keys)
+        shard['valid'].append(valid)
+        shard['topk_indices'].append(topk_indices)
+        shard['topk_scores'].append(np.take_along_axis(probabilities, topk_indices, axis=1))
+        shard['logits'].append(logits)
+        if embeddings:
+            shard['embeddings'].append(outputs[1].reshape(len(keys), -1))
+        scored += len(keys)
+        if len(shard['keys']) >= shard_size:
+            flush()
+
+    try:
+        for keys, payloads in batches:
+            if pool is None:
+                consume(keys, _decode_batch(payloads, preprocessing))
+                continue
+            in_flight.append((keys, pool.submit(_decode_batch, payloads)))
+            if len(in_flight) >= max_in_flight:
+                keys, future = in_flight.popleft()
+                consume(keys, future.result())
+        while in_flight:
+            keys, future = in_flight.popleft()
+            consume(keys, future.result())
+        flush()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if cache is not None:
+            cache.close()
+
+    progress['complete'] = True
+    save_progress(output_dir, progress)
+    elapsed = time.perf_counter() - start
+    print(f"打分完成: 共 {progress['processed']} 张图像（本次 {scored} 张, {elapsed:.1f}秒），"
+          f"解码失败 {progress['failed']} 张")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"预测缓存: 命中 {stats['hits']} 次, 命中率 {stats['hit_rate'] * 100:.1f}%, {stats['entries']} 条")
+    return progress
+
+
+def load_scores(output_dir, fields=('keys', 'topk_indices', 'topk_scores')):
+    """逐个分片读取打分结果，产生{字段: 数组}，供审计和漂移检查脚本使用"""
+    progress = load_progress(output_dir)
+    for name in progress['shards']:
+        with np.load(os.path.join(output_dir, name)) as shard:
+            yield {field: shard[field] for field in fields if field in shard}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量离线打分（目录/glob/zip/tar，结果分片写入.npz，可断点续跑）')
+    parser.add_argument('source', type=str,
+                       help='输入：目录、glob模式（加引号）或zip/tar归档')
+    parser.add_argument('--output_dir', type=str, required=True,
+                       help='结果输出目录')
+    parser.add_argument('--model_dir', type=str, default=DEFAULT_MODEL_DIR,
+                       help='模型目录（包含metadata.json和ONNX模型）')
+    parser.add_argument('--model_file', type=str, default=None,
+                       help='ONNX模型文件名（默认resnet18_identity.onnx）')
+    parser.add_argument('--batch_size', type=int, default=64,
+                       help='推理批次大小')
+    parser.add_argument('--shard_size', type=int, default=4096,
+                       help='每个结果分片的图像数（取批次大小的整数倍）')
+    parser.add_argument('--top_k', type=int, default=5,
+                       help='保存的top-k类别数')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='解码进程数，0表示在主进程解码（默认CPU核心数的一半）')
+    parser.add_argument('--threads', type=int, default=0,
+                       help='onnxruntime算子内线程数，0表示使用metadata.json中的调优配置（未调优时为默认）')
+    parser.add_argument('--no_logits', action='store_true',
+                       help='不保存完整logits，只保存top-k')
+    parser.add_argument('--embeddings', action='store_true',
+                       help='同时保存嵌入向量（需要onnx包）')
+    parser.add_argument('--embedding_tensor', type=str, default=None,
+                       help='作为嵌入向量输出的ONNX张量名（默认自动选择）')
+    parser.add_argument('--overwrite', action='store_true',
+                       help='忽略已有结果重新打分')
+    parser.add_argument('--cache_path', type=str, default=None,
+                       help='预测缓存文件(SQLite)，重复图像直接使用缓存结果；模型更新后自动失效')
+    parser.add_argument('--cache_size', type=int, default=DEFAULT_CACHE_SIZE,
+                       help='预测缓存最大条目数（内存和缓存文件中都按最近使用淘汰）')
+
+    args = parser.parse_args()
+    score_source(args.source, args.output_dir, args.model_dir, args.model_file, args.batch_size,
+                 args.shard_size, args.top_k, args.workers, args.threads, not args.no_logits,
+                 args.embeddings, args.embedding_tensor, args.overwrite, args.cache_path, args.cache_size)
+
+
+if __name__ == '__main__':
+    main()
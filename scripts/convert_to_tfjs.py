@@ -6,6 +6,8 @@
 
 import os
 import sys
+import pickle
+import inspect
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -15,6 +17,17 @@ import subprocess
 import argparse
 from pathlib import Path
 
+from model_layers import adapt_conv_input_channels
+from student_models import StudentModel, STUDENT_ARCHITECTURES
+from spectrogram_preprocessing import get_preprocessing_config, get_input_shape
+from prune_resnet18 import apply_channel_config
+from early_exit import EXIT_LAYERS, build_exit_heads, forward_with_exits
+from large_identity import CosineClassifier
+from multi_task import build_task_heads, forward_task_heads, task_head_config, export_output_names, export_wrapper
+
+# torch>=2.1：在meta设备上构建模型（不分配、不初始化权重），再用load_state_dict(assign=True)直接采用检查点中的张量
+META_INIT_SUPPORTED = 'assign' in inspect.signature(nn.Module.load_state_dict).parameters
+
 class L2Norm(nn.Module):
     """L2标准化层"""
     def __init__(self, dim=1):
@@ -27,11 +40,13 @@ class L2Norm(nn.Module):
 class ResNet18Contrastive(nn.Module):
     """支持对比学习的ResNet18模型"""
     
-    def __init__(self, num_classes, embedding_dim=128):
+    def __init__(self, num_classes, embedding_dim=128, in_channels=3, exit_layers=(), pretrained=True,
+                 tasks=None, classifier_type='mlp'):
         super(ResNet18Contrastive, self).__init__()
         
-        # 加载预训练的ResNet18
-        self.backbone = models.resnet18(pretrained=True)
+        # 加载预训练的ResNet18（从检查点加载时不需要ImageNet权重）
+        self.backbone = models.resnet18(pretrained=pretrained)
+        self.backbone.conv1 = adapt_conv_input_channels(self.backbone.conv1, in_channels)
         
         # 更激进的解冻策略：解冻更多层以提高学习能力
         for param in self.backbone.parameters():
@@ -58,17 +73,37 @@ class ResNet18Contrastive(nn.Module):
         )
         
         # 分类头 - 完全匹配训练脚本架构
-        self.classifier = nn.Sequential(
-            nn.Linear(embedding_dim, 256),
-            nn.ReLU(),
-            nn.Dropout(0.5),
-            nn.Linear(256, num_classes)
-        )
+        if classifier_type == 'cosine':
+            # 大规模身份模式：余弦分类头，权重行即各身份的类别中心（见large_identity.py）
+            self.classifier = CosineClassifier(embedding_dim, num_classes)
+        else:
+            self.classifier = nn.Sequential(
+                nn.Linear(embedding_dim, 256),
+                nn.ReLU(),
+                nn.Dropout(0.5),
+                nn.Linear(256, num_classes)
+            )
+        
+        # 提前退出分支（为空时不增加任何参数，与旧检查点兼容）
+        self.exit_heads = build_exit_heads(self.backbone, exit_layers, num_classes)
+        
+        # 多任务输出头（人员类型、步态质量等），接在主干池化特征上，与身份分类共用一次前向
+        self.task_config = task_head_config(tasks) if tasks else {}
+        self.task_heads = build_task_heads(num_features, self.task_config)
         
         # L2标准化
         self.l2_norm = lambda x: F.normalize(x, p=2, dim=1)
     
-    def forward(self, x):
+    def forward(self, x, return_exits=False, return_tasks=False):
+        if return_exits or return_tasks:
+            # 联合训练：同时返回各退出分支的logits；return_tasks时追加各任务头的输出
+            features, exit_logits = forward_with_exits(self.backbone, self.exit_heads if return_exits else {}, x)
+            embeddings = self.embedding(features)
+            outputs = (embeddings, self.classifier(embeddings), exit_logits)
+            if return_tasks:
+                outputs += (forward_task_heads(self.task_heads, self.task_config, features),)
+            return outputs
+        
         features = self.backbone(x)
         embeddings = self.embedding(features)
         
@@ -80,32 +115,91 @@ class ResNet18Contrastive(nn.Module):
             # 推理时只返回分类结果
             return self.classifier(embeddings)
 
-def load_pytorch_model(model_path, num_classes=10):
-    """加载PyTorch模型 - 自动检测模型类型和参数"""
-    
-    # 加载检查点
-    checkpoint = torch.load(model_path, map_location='cpu')
+def load_checkpoint(model_path, trust_checkpoint=False):
+    """以内存映射方式只加载张量和基本类型（不执行检查点中的任意Python对象），权重在用到时才从磁盘读入
+
+    旧版本torch不支持mmap，旧格式（非zip）检查点不能内存映射，均回退到不映射的安全加载。
+    检查点包含其他Python对象时拒绝加载；trust_checkpoint=True（--trust_checkpoint）时才完整反序列化。
+    """
+    if trust_checkpoint:
+        print(f"警告: 按可信来源完整反序列化检查点: {model_path}")
+        return torch.load(model_path, map_location='cpu', weights_only=False)
+    try:
+        try:
+            return torch.load(model_path, map_location='cpu', mmap=True, weights_only=True)
+        except TypeError:
+            # torch<2.1不支持mmap
+            return torch.load(model_path, map_location='cpu', weights_only=True)
+        except RuntimeError as e:
+            print(f"检查点不支持内存映射，按普通方式加载: {e}")
+            return torch.load(model_path, map_location='cpu', weights_only=True)
+    except TypeError as e:
+        raise RuntimeError(f"当前torch版本不支持安全加载(weights_only)，请升级torch；"
+                           f"确认检查点来源可信时可使用 --trust_checkpoint: {model_path}") from e
+    except pickle.UnpicklingError as e:
+        raise pickle.UnpicklingError(f"检查点 {model_path} 包含权重以外的Python对象，为避免执行其中的代码已拒绝加载；"
+                                     f"确认来源可信时使用 --trust_checkpoint 重试。原始错误: {e}") from e
+
+def build_model_from_checkpoint(checkpoint, num_classes=10):
+    """按检查点记录的结构信息构建模型（不加载权重），返回(model, preprocessing, num_classes)
+
+    结构、embedding_dim和类别数优先读取检查点元数据，旧检查点没有记录时从权重名和形状推断。
+    """
     state_dict = checkpoint['model_state_dict']
+    num_classes = checkpoint.get('num_classes', num_classes)
+    architecture = checkpoint.get('architecture')
+    # 旧检查点没有记录预处理配置，默认为RGB 224x224
+    preprocessing = checkpoint.get('preprocessing') or get_preprocessing_config()
+    in_channels = preprocessing['channels']
     
-    # 检测模型类型：是否包含对比学习结构
-    is_contrastive = any('backbone.' in key or 'embedding.' in key for key in state_dict.keys())
+    if architecture is None:
+        # 检测模型类型：是否包含对比学习结构
+        is_contrastive = any('backbone.' in key or 'embedding.' in key for key in state_dict.keys())
+        architecture = 'resnet18_contrastive' if is_contrastive else 'resnet18'
     
-    if is_contrastive:
+    if architecture in STUDENT_ARCHITECTURES:
+        print(f"检测到蒸馏学生模型，加载{architecture}...")
+        config = dict(checkpoint.get('model_config', {}))
+        config.pop('arch', None)
+        config.setdefault('in_channels', in_channels)
+        model = StudentModel(num_classes, arch=architecture, pretrained=False, **config)
+    elif architecture == 'resnet18_contrastive':
         print("检测到对比学习模型，加载ResNet18Contrastive...")
         
-        # 从权重自动检测embedding_dim
-        embedding_dim = 128  # 默认值
-        for key in state_dict.keys():
-            if 'embedding.3.weight' in key:  # embedding最后一层的权重
-                embedding_dim = state_dict[key].shape[0]
-                print(f"检测到embedding_dim: {embedding_dim}")
-                break
+        embedding_dim = checkpoint.get('embedding_dim')
+        if embedding_dim is None:
+            # 从权重自动检测embedding_dim
+            embedding_dim = 128  # 默认值
+            for key in state_dict.keys():
+                if 'embedding.3.weight' in key:  # embedding最后一层的权重
+                    embedding_dim = state_dict[key].shape[0]
+                    break
+        print(f"embedding_dim: {embedding_dim}")
         
-        model = ResNet18Contrastive(num_classes, embedding_dim=embedding_dim)
-    else:
+        # 提前退出分支：优先读取检查点记录，否则从权重名推断
+        exit_layers = checkpoint.get('exit_layers') or [
+            name for name in EXIT_LAYERS if any(key.startswith(f'exit_heads.{name}.') for key in state_dict)
+        ]
+        if exit_layers:
+            print(f"检测到提前退出分支: {exit_layers}")
+        
+        tasks = checkpoint.get('tasks')
+        if tasks:
+            print(f"检测到多任务输出头: {list(tasks.keys())}")
+        
+        # 余弦分类头（大规模身份模式）只有一个权重矩阵classifier.weight
+        classifier_type = checkpoint.get('classifier_type') or ('cosine' if 'classifier.weight' in state_dict else 'mlp')
+        if classifier_type == 'cosine':
+            print("检测到余弦分类头（大规模身份模式）")
+        
+        model = ResNet18Contrastive(num_classes, embedding_dim=embedding_dim, in_channels=in_channels,
+                                    exit_layers=exit_layers, pretrained=False, tasks=tasks,
+                                    classifier_type=classifier_type)
+    elif architecture == 'resnet18':
         print("检测到标准分类模型，加载标准ResNet18...")
         # 创建标准模型结构
         model = models.resnet18(pretrained=False)
+        model.conv1 = adapt_conv_input_channels(model.conv1, in_channels)
         num_features = model.fc.in_features
         model.fc = nn.Sequential(
             nn.Dropout(0.5),
@@ -114,10 +208,37 @@ def load_pytorch_model(model_path, num_classes=10):
             nn.Dropout(0.3),
             nn.Linear(256, num_classes)
         )
+    else:
+        raise ValueError(f"不支持的模型结构: {architecture}")
+    
+    if checkpoint.get('pruned_channels'):
+        print("检测到剪枝模型，按检查点中的通道配置重建结构...")
+        apply_channel_config(model, checkpoint['pruned_channels'])
     
-    # 加载权重
-    model.load_state_dict(state_dict)
+    return model, preprocessing, num_classes
+
+def load_pytorch_model(model_path, num_classes=10, trust_checkpoint=False):
+    """加载PyTorch模型 - 按检查点元数据重建结构
+
+    不访问网络、不读取ImageNet预训练权重：模型在meta设备上构建（不分配内存），
+    再直接采用内存映射的检查点张量作为参数，权重不会被复制一份。
+    trust_checkpoint: 见load_checkpoint
+    """
+    checkpoint = load_checkpoint(model_path, trust_checkpoint)
+    
+    if META_INIT_SUPPORTED:
+        with torch.device('meta'):
+            model, preprocessing, num_classes = build_model_from_checkpoint(checkpoint, num_classes)
+        model.load_state_dict(checkpoint['model_state_dict'], assign=True)
+        uninitialized = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers())
+                         if tensor.is_meta]
+        if uninitialized:
+            raise RuntimeError(f"检查点缺少以下参数: {uninitialized}")
+    else:
+        model, preprocessing, num_classes = build_model_from_checkpoint(checkpoint, num_classes)
+        model.load_state_dict(checkpoint['model_state_dict'])
     model.eval()
+    model.preprocessing = preprocessing
     
     return model, checkpoint.get('class_names', [f'ID_{i+1}' for i in range(num_classes)])
 
@@ -126,23 +247,22 @@ def convert_to_onnx(model, onnx_path):
     
     print("正在转换为ONNX格式...")
     
-    # 创建虚拟输入
-    dummy_input = torch.randn(1, 3, 224, 224)
+    # 创建虚拟输入（形状由模型的输入预处理配置决定）
+    dummy_input = torch.randn(get_input_shape(getattr(model, 'preprocessing', None)))
     
-    # 导出ONNX
+    # 导出ONNX（带任务头时为多输出：身份logits在前，其后为各任务）
+    output_names = export_output_names(model)
+    dynamic_axes = {name: {0: 'batch_size'} for name in ['input'] + output_names}
     torch.onnx.export(
-        model,
+        export_wrapper(model),
         dummy_input,
         onnx_path,
         export_params=True,
         opset_version=11,
         do_constant_folding=True,
         input_names=['input'],
-        output_names=['output'],
-        dynamic_axes={
-            'input': {0: 'batch_size'},
-            'output': {0: 'batch_size'}
-        }
+        output_names=output_names,
+        dynamic_axes=dynamic_axes
     )
     
     print(f"ONNX模型已保存到: {onnx_path}")
@@ -199,25 +319,28 @@ def convert_to_tfjs(tf_path, tfjs_path):
         print(f"转换失败: {e}")
         return False
 
-def create_model_metadata(class_names, tfjs_path):
-    """创建模型元数据"""
+def create_model_metadata(class_names, tfjs_path, preprocessing=None, sequential_policy=None, tasks=None):
+    """创建模型元数据
+    
+    preprocessing: 输入预处理配置（输入模式、通道数、分辨率、归一化参数），默认为RGB 224x224
+    sequential_policy: 可选的序贯提前终止策略（见sequential_verification.py），
+                       指定后required_images表示最多使用的帧数
+    tasks: 可选的多任务输出头配置（见multi_task.py），模型按任务名输出对应结果
+    """
+    
+    preprocessing = preprocessing or get_preprocessing_config()
+    height, width = preprocessing['resize']
     
     metadata = {
         "model_name": "ResNet18 Identity Classifier",
         "model_version": "1.0.0",
         "description": "基于ResNet18的养老院身份识别分类器",
-        "input_shape": [1, 224, 224, 3],
+        "input_shape": [1, height, width, preprocessing['channels']],
         "output_shape": [1, len(class_names)],
         "num_classes": len(class_names),
         "class_names": class_names,
         "class_mapping": {i: name for i, name in enumerate(class_names)},
-        "preprocessing": {
-            "resize": [224, 224],
-            "normalize": {
-                "mean": [0.485, 0.456, 0.406],
-                "std": [0.229, 0.224, 0.225]
-            }
-        },
+        "preprocessing": preprocessing,
         "usage": {
             "strict_consistency_check": True,
             "required_images": 3,
@@ -228,6 +351,14 @@ def create_model_metadata(class_names, tfjs_path):
             }
         }
     }
+    if sequential_policy is not None:
+        metadata["usage"]["sequential_policy"] = sequential_policy
+        metadata["usage"]["required_images"] = sequential_policy["max_frames"]
+    if tasks:
+        # 每个任务对应ONNX模型中同名的输出：分类任务输出logits，回归任务输出标量
+        metadata["tasks"] = {
+            name: {"type": task["type"], "classes": task["classes"], "output": name} for name, task in tasks.items()
+        }
     
     # 保存元数据
     metadata_path = os.path.join(tfjs_path, 'metadata.json')
@@ -283,6 +414,8 @@ def main():
     parser.add_argument('--temp_dir', type=str, 
                        default='./temp_conversion',
                        help='临时文件目录')
+    parser.add_argument('--trust_checkpoint', action='store_true',
+                       help='允许加载包含权重以外Python对象的检查点（会执行其中的代码，仅用于可信来源）')
     
     args = parser.parse_args()
     
@@ -302,7 +435,7 @@ def main():
     try:
         # 1. 加载PyTorch模型
         print("\n步骤1: 加载PyTorch模型")
-        model, class_names = load_pytorch_model(args.model_path)
+        model, class_names = load_pytorch_model(args.model_path, trust_checkpoint=args.trust_checkpoint)
         print(f"加载成功! 类别数: {len(class_names)}")
         print(f"类别: {class_names}")
         
@@ -326,7 +459,7 @@ def main():
         
         # 5. 创建元数据
         print("\n步骤5: 创建模型元数据")
-        create_model_metadata(class_names, args.output_path)
+        create_model_metadata(class_names, args.output_path, model.preprocessing, tasks=getattr(model, 'task_config', None))
         
         # 6. 验证模型
         print("\n步骤6: 验证转换结果")
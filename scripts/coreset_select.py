@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+训练集核心子集（coreset）选择
+数据集中的文件是少数几次行走的连续帧（ID1_case1_1_Doppler1..N），大量帧几乎重复。本工具：
+  1. 用训练好的模型（或ImageNet预训练ResNet18）对每一帧提取一次嵌入向量
+  2. 在训练部分（与train_resnet18.py相同的划分，验证帧不参与）的每个身份内按预算选出多样的子集：k-center贪心（每次加入离已选样本最远的帧）或k-means聚类中心最近的帧
+  3. 输出与dataset_index.json格式相同的清单（{身份: [文件名]}），train_resnet18.py --manifest 直接使用
+  4. 可选：在固定的验证集上比较全量训练集和不同大小coreset的训练耗时与验证准确率
+
+用法:
+  python coreset_select.py --dataset_path ../dataset --model_path ../public/models/resnet18_identity/resnet18_identity.pth \\
+      --budget 0.3 --output coreset_30.json
+  python coreset_select.py --dataset_path ../dataset --budget 0.3 --evaluate 0.1,0.25,0.5 --eval_epochs 10
+"""
+
+import os
+import json
+import time
+import argparse
+from collections import defaultdict
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from torchvision import models
+from sklearn.model_selection import train_test_split
+
+from spectrogram_preprocessing import INPUT_MODES, get_preprocessing_config
+from model_layers import adapt_conv_input_channels
+from train_resnet18 import (GaitDataset, create_data_transforms, create_model, get_image_mode, load_dataset,
+                            teacher_forward, train_model)
+
+SELECTION_METHODS = ('kcenter', 'kmeans', 'random')
+
+
+def load_embedding_model(model_path=None, input_mode='rgb', input_size=224, trust_checkpoint=False):
+    """训练好的检查点，或ImageNet预训练ResNet18（取fc之前的池化特征）"""
+    if model_path:
+        from convert_to_tfjs import load_pytorch_model
+        model, _ = load_pytorch_model(model_path, trust_checkpoint=trust_checkpoint)
+        return model, model.preprocessing
+    preprocessing = get_preprocessing_config(input_mode, input_size)
+    model = models.resnet18(pretrained=True)
+    model.conv1 = adapt_conv_input_channels(model.conv1, preprocessing['channels'])
+    return model.eval(), preprocessing
+
+
+def embed_images(model, image_paths, preprocessing, device='cpu', batch_size=64, num_workers=2):
+    """每张图像提取一次L2归一化的嵌入向量，返回(N, D)"""
+    _, transform = create_data_transforms(preprocessing['input_mode'], preprocessing['resize'][0])
+    dataset = GaitDataset(image_paths, [0] * len(image_paths), transform,
+                          image_mode=get_image_mode(preprocessing['input_mode']))
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    model = model.to(device).eval()
+    features = []
+    with torch.no_grad():
+        for images, _ in loader:
+            embeddings, _ = teacher_forward(model, images.to(device))
+            features.append(F.normalize(embeddings.float(), dim=1).cpu())
+    return torch.cat(features).numpy()
+
+
+def k_center_greedy(features, k):
+    """k-center贪心：从最接近类中心的帧开始，每次加入与已选集合距离最远的帧"""
+    center = features.mean(axis=0)
+    selected = [int(np.argmin(((features - center) ** 2).sum(axis=1)))]
+    distances = ((features - features[selected[0]]) ** 2).sum(axis=1)
+    while len(selected) < k:
+        index = int(np.argmax(distances))
+        selected.append(index)
+        distances = np.minimum(distances, ((features - features[index]) ** 2).sum(axis=1))
+    return selected
+
+
+def kmeans_medoids(features, k, seed=0):
+    """k-means聚类，每个簇取离聚类中心最近的帧"""
+    from sklearn.cluster import KMeans
+    kmeans = KMeans(n_clusters=k, n_init=4, random_state=seed).fit(features)
+    selected = []
+    for cluster in range(k):
+        members = np.flatnonzero(kmeans.labels_ == cluster)
+        distances = ((features[members] - kmeans.cluster_centers_[cluster]) ** 2).sum(axis=1)
+        selected.append(int(members[np.argmin(distances)]))
+    return selected
+
+
+def budget_size(budget, count):
+    """budget小于1时为比例，否则为每个身份的帧数；每个身份至少保留1帧"""
+    size = int(round(budget * count)) if budget < 1 else int(budget)
+    return max(1, min(count, size))
+
+
+def select_coreset(features, labels, budget, method='kcenter', seed=0):
+    """在每个身份内按预算选择子集，返回按原顺序排列的样本下标"""
+    rng = np.random.default_rng(seed)
+    by_label = defaultdict(list)
+    for index, label in enumerate(labels):
+        by_label[label].append(index)
+
+    selected = []
+    for label, indices in by_label.items():
+        indices = np.asarray(indices)
+        k = budget_size(budget, len(indices))
+        if k == len(indices):
+            chosen = range(len(indices))
+        elif method == 'kcenter':
+            chosen = k_center_greedy(features[indices], k)
+        elif method == 'kmeans':
+            chosen = kmeans_medoids(features[indices], k, seed)
+        elif method == 'random':
+            chosen = rng.choice(len(indices), k, replace=False)
+        else:
+            raise ValueError(f"不支持的选择方法: {method}，可选: {SELECTION_METHODS}")
+        selected.extend(int(indices[i]) for i in chosen)
+    return sorted(selected)
+
+
+def write_manifest(output_path, image_paths, labels, class_names, indices):
+    """写出{身份: [文件名]}清单（与dataset_index.json格式相同）"""
+    manifest = {name: [] for name in class_names}
+    for index in indices:
+        manifest[class_names[labels[index]]].append(os.path.basename(image_paths[index]))
+    for names in manifest.values():
+        names.sort()
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    print(f"coreset清单已保存到: {output_path} ({len(indices)}/{len(image_paths)} 帧)")
+    return manifest
+
+
+def train_and_validate(train_paths, train_labels, val_dataset, num_classes, preprocessing, args, device):
+    """在给定训练样本上训练，返回训练耗时和最佳验证准确率"""
+    train_transform, _ = create_data_transforms(preprocessing['input_mode'], preprocessing['resize'][0])
+    train_dataset = GaitDataset(train_paths, train_labels, train_transform,
+                                image_mode=get_image_mode(preprocessing['input_mode']))
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.workers)
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.workers)
+    torch.manual_seed(args.seed)
+    model = create_model(num_classes, input_mode=preprocessing['input_mode'], input_size=preprocessing['resize'][0],
+                         pretrained=not args.no_pretrained)
+    start = time.perf_counter()
+    _, history = train_model(model, train_loader, val_loader, num_epochs=args.eval_epochs,
+                             learning_rate=args.learning_rate, device=device)
+    return time.perf_counter() - start, history['best_val_accuracy']
+
+
+def split_train_val(labels):
+    """与train_resnet18.py相同的训练/验证划分，返回两部分的样本下标"""
+    return train_test_split(np.arange(len(labels)), test_size=0.15, random_state=42, stratify=labels)
+
+
+def evaluate_coresets(image_paths, labels, class_names, features, budgets, preprocessing, args, device):
+    """全量训练集与各预算coreset对比：验证集固定（与train_resnet18.py相同的划分），coreset只从训练部分选择"""
+    train_indices, val_indices = split_train_val(labels)
+    _, val_transform = create_data_transforms(preprocessing['input_mode'], preprocessing['resize'][0])
+    val_dataset = GaitDataset([image_paths[i] for i in val_indices], [labels[i] for i in val_indices], val_transform,
+                              image_mode=get_image_mode(preprocessing['input_mode']))
+    train_labels = [labels[i] for i in train_indices]
+
+    runs = [('full', None)] + [(args.method, budget) for budget in budgets]
+    if args.compare_random:
+        runs += [('random', budget) for budget in budgets]
+
+    rows = []
+    for method, budget in runs:
+        if budget is None:
+            subset = train_indices
+        else:
+            subset = train_indices[select_coreset(features[train_indices], train_labels, budget, method, args.seed)]
+        print(f"\n=== {method}{'' if budget is None else f' (预算 {budget})'}: {len(subset)} 个训练样本 ===")
+        seconds, accuracy = train_and_validate([image_paths[i] for i in subset], [labels[i] for i in subset],
+                                               val_dataset, len(class_names), preprocessing, args, device)
+        rows.append({'method': method, 'budget': budget, 'train_samples': int(len(subset)),
+                     'train_seconds': seconds, 'best_val_accuracy': accuracy})
+
+    full = rows[0]
+    print(f"\n{'方法':<10}{'预算':>8}{'训练样本':>10}{'训练耗时(s)':>14}{'相对耗时':>10}{'验证准确率':>12}")
+    for row in rows:
+        budget = '-' if row['budget'] is None else f"{row['budget']:g}"
+        print(f"{row['method']:<10}{budget:>10}{row['train_samples']:>12}{row['train_seconds']:>14.1f}"
+              f"{row['train_seconds'] / full['train_seconds']:>12.2f}{row['best_val_accuracy']:>13.2f}%")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按嵌入向量多样性选择训练集coreset，输出可供训练使用的清单')
+    parser.add_argument('--dataset_path', type=str, default='../dataset',
+                       help='数据集路径')
+    parser.add_argument('--model_path', type=str, default=None,
+                       help='提取嵌入向量的检查点（默认使用ImageNet预训练ResNet18）')
+    parser.add_argument('--input_mode', type=str, default='rgb', choices=INPUT_MODES,
+                       help='未指定检查点时的输入模式')
+    parser.add_argument('--input_size', type=int, default=224,
+                       help='未指定检查点时的输入分辨率')
+    parser.add_argument('--budget', type=float, default=0.3,
+                       help='每个身份保留的帧数，小于1时为比例')
+    parser.add_argument('--method', type=str, default='kcenter', choices=SELECTION_METHODS,
+                       help='选择方法：kcenter（最远点贪心）、kmeans（聚类中心最近帧）、random')
+    parser.add_argument('--output', type=str, default=None,
+                       help='清单输出路径（默认 coreset_<预算>.json）')
+    parser.add_argument('--evaluate', type=str, default=None,
+                       help="比较全量训练集与这些预算的coreset，如 '0.1,0.25,0.5'")
+    parser.add_argument('--compare_random', action='store_true',
+                       help='比较时同时训练相同预算的随机子集')
+    parser.add_argument('--eval_epochs', type=int, default=10,
+                       help='比较时每次训练的epoch数')
+    parser.add_argument('--batch_size', type=int, default=8,
+                       help='比较时的训练批次大小')
+    parser.add_argument('--learning_rate', type=float, default=0.0002,
+                       help='比较时的学习率')
+    parser.add_argument('--no_pretrained', action='store_true',
+                       help='比较时不加载ImageNet预训练权重（离线环境）')
+    parser.add_argument('--workers', type=int, default=2,
+                       help='DataLoader worker数')
+    parser.add_argument('--report', type=str, default='coreset_report.json',
+                       help='比较报告保存路径')
+    parser.add_argument('--seed', type=int, default=0,
+                       help='随机种子')
+    parser.add_argument('--trust_checkpoint', action='store_true',
+                       help='允许加载包含权重以外Python对象的检查点（会执行其中的代码，仅用于可信来源）')
+
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    image_paths, labels, class_names = load_dataset(args.dataset_path)
+    if not image_paths:
+        return
+    model, preprocessing = load_embedding_model(args.model_path, args.input_mode, args.input_size,
+                                              args.trust_checkpoint)
+    start = time.perf_counter()
+    features = embed_images(model, image_paths, preprocessing, device, num_workers=args.workers)
+    print(f"已提取 {len(features)} 帧的嵌入向量 ({features.shape[1]}维), {time.perf_counter() - start:.1f}秒")
+
+    # 只从训练部分选择：train_resnet18.py --manifest 用清单筛选训练集，验证集保持全量数据集上的固定划分
+    train_indices, _ = split_train_val(labels)
+    indices = train_indices[select_coreset(features[train_indices], [labels[i] for i in train_indices],
+                                           args.budget, args.method, args.seed)]
+    output = args.output or f"coreset_{args.budget:g}.json"
+    write_manifest(output, image_paths, labels, class_names, indices)
+
+    if args.evaluate:
+        budgets = [float(b) for b in args.evaluate.split(',')]
+        rows = evaluate_coresets(image_paths, labels, class_names, features, budgets, preprocessing, args, device)
+        report = {'dataset_path': args.dataset_path, 'embedding_model': args.model_path or 'imagenet_resnet18',
+                  'method': args.method, 'eval_epochs': args.eval_epochs, 'runs': rows}
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"比较报告已保存到: {args.report}")
+
+
+if __name__ == '__main__':
+    main()
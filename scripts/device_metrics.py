@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+设备端训练指标累加器
+每个batch调用loss.item()或(predicted == labels).sum().item()都会强制GPU与主机同步，打断异步执行。
+这里把损失和正确数作为设备张量累加，只在进度显示到期（且距上次同步至少N步）或epoch结束时同步一次。
+"""
+
+import time
+
+import torch
+
+
+class MetricAccumulator:
+    """累加损失均值和分类准确率
+
+    用法:
+        metrics = MetricAccumulator(device, ('loss', 'contrastive_loss'))
+        metrics.update(outputs, labels, loss=total_loss, contrastive_loss=contrastive_loss)
+        metrics.show_progress(pbar, {'Loss': 'loss', 'ContLoss': 'contrastive_loss'})
+        epoch_values = metrics.compute()  # {'loss': ..., 'contrastive_loss': ..., 'accuracy': ...}
+    """
+
+    def __init__(self, device, names=('loss',), sync_every=20, display_interval=1.0):
+        self.device = torch.device(device)
+        self.names = tuple(names)
+        self.sync_every = max(1, sync_every)
+        self.display_interval = display_interval
+        self.reset()
+
+    def reset(self):
+        self.sums = {name: torch.zeros((), device=self.device) for name in self.names}
+        self.correct = torch.zeros((), dtype=torch.long, device=self.device)
+        # 样本数由张量形状得到，不需要同步
+        self.total = 0
+        self.steps = 0
+        self._synced_step = 0
+        self._synced = None
+        self._last_display = 0.0
+
+    def update(self, outputs=None, labels=None, **values):
+        """累加一个batch；values为标量损失张量，outputs/labels用于统计正确数"""
+        with torch.no_grad():
+            for name, value in values.items():
+                self.sums[name] += value.detach().float()
+            if outputs is not None:
+                self.correct += (outputs.detach().argmax(dim=1) == labels).sum()
+                self.total += labels.size(0)
+        self.steps += 1
+
+    def compute(self):
+        """同步到主机，返回各损失的均值和准确率(%)"""
+        values = {name: self.sums[name].item() / max(1, self.steps) for name in self.names}
+        values['accuracy'] = 100.0 * self.correct.item() / self.total if self.total else 0.0
+        self._synced = values
+        self._synced_step = self.steps
+        return values
+
+    def show_progress(self, pbar, fields):
+        """按时间间隔节流更新tqdm后缀；距上次同步不足sync_every步时沿用上次同步的值
+
+        fields: {显示名: 指标名}，指标名可以是'accuracy'
+        """
+        now = time.perf_counter()
+        if now - self._last_display < self.display_interval:
+            return
+        if self._synced is None or self.steps - self._synced_step >= self.sync_every:
+            self.compute()
+        self._last_display = now
+
+        postfix = {}
+        for label, name in fields.items():
+            value = self._synced[name]
+            postfix[label] = f'{value:.2f}%' if name == 'accuracy' else f'{value:.4f}'
+        pbar.set_postfix(postfix, refresh=False)
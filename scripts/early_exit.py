@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+ResNet18Contrastive提前退出分支
+在layer2/layer3之后增加轻量分类头，与主分类头联合训练；推理时置信度达到阈值即在该分支返回，
+跳过后续残差阶段。导出时把网络切分为多段ONNX模型（默认在模型目录的early_exit/下），
+Python运行时（gait_inference.py --early_exit）按段执行、以推荐阈值逐段判断是否退出；Web端仍使用完整模型。
+"""
+
+import os
+import json
+import argparse
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# 主干网络的执行顺序
+BACKBONE_STAGES = ('stem', 'layer1', 'layer2', 'layer3', 'layer4')
+# 支持添加退出分支的位置
+EXIT_LAYERS = ('layer2', 'layer3')
+
+
+class ExitHead(nn.Module):
+    """轻量退出分支：全局平均池化 + 全连接"""
+
+    def __init__(self, in_channels, num_classes):
+        super(ExitHead, self).__init__()
+        self.pool = nn.AdaptiveAvgPool2d((1, 1))
+        self.dropout = nn.Dropout(0.3)
+        self.fc = nn.Linear(in_channels, num_classes)
+
+    def forward(self, x):
+        return self.fc(self.dropout(torch.flatten(self.pool(x), 1)))
+
+
+def stage_channels(backbone, layer_name):
+    """残差阶段的输出通道数"""
+    return getattr(backbone, layer_name)[-1].bn2.num_features
+
+
+def build_exit_heads(backbone, exit_layers, num_classes):
+    """为指定的残差阶段创建退出分支"""
+    for name in exit_layers:
+        if name not in EXIT_LAYERS:
+            raise ValueError(f"不支持在{name}之后添加退出分支，可选: {EXIT_LAYERS}")
+    return nn.ModuleDict({
+        name: ExitHead(stage_channels(backbone, name), num_classes) for name in exit_layers
+    })
+
+
+def run_stage(backbone, name, x):
+    if name == 'stem':
+        return backbone.maxpool(backbone.relu(backbone.bn1(backbone.conv1(x))))
+    return getattr(backbone, name)(x)
+
+
+def pool_features(backbone, x):
+    """layer4输出 → 池化特征（与backbone(x)的结果一致）"""
+    return backbone.fc(torch.flatten(backbone.avgpool(x), 1))
+
+
+def forward_with_exits(backbone, exit_heads, x):
+    """执行完整主干并收集所有退出分支的logits，返回(池化特征, {阶段名: logits})"""
+    exit_logits = {}
+    for name in BACKBONE_STAGES:
+        x = run_stage(backbone, name, x)
+        if name in exit_heads:
+            exit_logits[name] = exit_heads[name](x)
+    return pool_features(backbone, x), exit_logits
+
+
+def early_exit_predict(model, x, threshold=0.9):
+    """提前退出推理：每个样本在第一个softmax置信度不低于threshold的分支返回
+
+    返回(logits, exit_index)，exit_index为样本退出的分支序号，len(exit_heads)表示主分类头。
+    已退出的样本不再参与后续阶段的计算。
+    """
+    backbone = model.backbone
+    exit_names = list(model.exit_heads.keys())
+    # 类别数取自第一个给出结果的分类头（主分类头可能是nn.Sequential或CosineClassifier）
+    logits = None
+    exit_index = torch.full((x.size(0),), len(exit_names), dtype=torch.long, device=x.device)
+    active = torch.arange(x.size(0), device=x.device)
+
+    features = x
+    for name in BACKBONE_STAGES:
+        features = run_stage(backbone, name, features)
+        if name not in model.exit_heads:
+            continue
+        exit_logits = model.exit_heads[name](features)
+        if logits is None:
+            logits = exit_logits.new_zeros(x.size(0), exit_logits.size(1))
+        confident = F.softmax(exit_logits, dim=1).max(dim=1).values >= threshold
+        if confident.any():
+            logits[active[confident]] = exit_logits[confident]
+            exit_index[active[confident]] = exit_names.index(name)
+            active = active[~confident]
+            features = features[~confident]
+        if active.numel() == 0:
+            return logits, exit_index
+
+    embeddings = model.embedding(pool_features(backbone, features))
+    final_logits = model.classifier(embeddings)
+    if logits is None:
+        return final_logits, exit_index
+    logits[active] = final_logits
+    return logits, exit_index
+
+
+class _Segment(nn.Module):
+    """导出用的网络分段：执行若干主干阶段，末尾接退出分支或主分类头"""
+
+    def __init__(self, model, stages, exit_name=None):
+        super(_Segment, self).__init__()
+        self.model = model
+        self.stages = stages
+        self.exit_name = exit_name
+
+    def forward(self, x):
+        for name in self.stages:
+            x = run_stage(self.model.backbone, name, x)
+        if self.exit_name is not None:
+            return x, self.model.exit_heads[self.exit_name](x)
+        embeddings = self.model.embedding(pool_features(self.model.backbone, x))
+        return self.model.classifier(embeddings)
+
+
+def build_segments(model):
+    """按退出分支位置切分网络，返回[(段名, 模块, 输出名列表)]"""
+    segments = []
+    stages = []
+    for name in BACKBONE_STAGES:
+        stages.append(name)
+        if name in model.exit_heads:
+            segments.append((f'to_{name}', _Segment(model, stages, name), ['features', f'exit_{name}']))
+            stages = []
+    segments.append(('final', _Segment(model, stages), ['output']))
+    # 包装模块默认处于训练模式，导出时会让BatchNorm使用批统计量
+    for _, segment, _ in segments:
+        segment.train(model.training)
+    return segments
+
+
+def segment_flops(model, input_shape):
+    """各分段的乘加次数，返回[(段名, MACs)]"""
+    from prune_resnet18 import count_flops
+
+    results = []
+    x = torch.zeros(input_shape)
+    model.eval()
+    with torch.no_grad():
+        for name, segment, _ in build_segments(model):
+            results.append((name, count_flops(segment, tuple(x.shape))))
+            if name != 'final':
+                x = segment(x)[0]
+    return results
+
+
+def export_early_exit_onnx(model, output_dir, input_shape, thresholds=None):
+    """将提前退出模型导出为多段ONNX，并写入early_exit.json描述执行顺序"""
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.to('cpu')
+    model.eval()
+
+    manifest = {'input_shape': list(input_shape), 'segments': [], 'thresholds': thresholds or {}}
+    flops = dict(segment_flops(model, input_shape))
+    x = torch.randn(input_shape)
+    for name, segment, output_names in build_segments(model):
+        onnx_path = os.path.join(output_dir, f'{name}.onnx')
+        torch.onnx.export(
+            segment, x, onnx_path,
+            export_params=True, opset_version=11, do_constant_folding=True,
+            input_names=['input'], output_names=output_names,
+            dynamic_axes={key: {0: 'batch_size'} for key in ['input'] + output_names}
+        )
+        manifest['segments'].append({
+            'name': name,
+            'file': f'{name}.onnx',
+            'outputs': output_names,
+            'exit': output_names[-1] if name != 'final' else 'output',
+            'gmacs': flops[name] / 1e9
+        })
+        if name != 'final':
+            with torch.no_grad():
+                x = segment(x)[0]
+
+    with open(os.path.join(output_dir, 'early_exit.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    print(f"提前退出分段模型已导出到: {output_dir}")
+    return manifest
+
+
+def evaluate_thresholds(model, data_loader, thresholds, input_shape, device='cpu'):
+    """统计不同阈值下的准确率、各分支退出比例和平均每帧FLOPs"""
+    flops = [macs for _, macs in segment_flops(model.to('cpu'), input_shape)]
+    cumulative_flops = [sum(flops[:i + 1]) for i in range(len(flops))]
+    exit_names = list(model.exit_heads.keys()) + ['final']
+
+    model = model.to(device)
+    model.eval()
+    rows = []
+    for threshold in thresholds:
+        correct = total = 0
+        exit_counts = [0] * len(exit_names)
+        total_flops = 0
+        with torch.no_grad():
+            for images, labels in data_loader:
+                images, labels = images.to(device), labels.to(device)
+                logits, exit_index = early_exit_predict(model, images, threshold)
+                correct += (logits.argmax(dim=1) == labels).sum().item()
+                total += labels.size(0)
+                for index in exit_index.tolist():
+                    exit_counts[index] += 1
+                    total_flops += cumulative_flops[index]
+        rows.append({
+            'threshold': threshold,
+            'accuracy': 100.0 * correct / total,
+            'mean_gmacs_per_frame': total_flops / total / 1e9,
+            'flops_ratio': total_flops / total / cumulative_flops[-1],
+            'exit_rates': {name: count / total for name, count in zip(exit_names, exit_counts)}
+        })
+    return rows
+
+
+def main():
+    from torch.utils.data import DataLoader
+    from sklearn.model_selection import train_test_split
+    from train_resnet18 import GaitDataset, load_dataset, create_data_transforms, get_image_mode
+    from convert_to_tfjs import load_pytorch_model
+    from spectrogram_preprocessing import get_input_shape
+
+    parser = argparse.ArgumentParser(description='提前退出分支评估与分段ONNX导出')
+    parser.add_argument('--model_path', type=str,
+                       default='../public/models/resnet18_identity/resnet18_identity.pth',
+                       help='带退出分支的模型检查点（训练时使用 --early_exit）')
+    parser.add_argument('--dataset_path', type=str, default='../dataset',
+                       help='数据集路径（使用与训练相同划分的验证集评估）')
+    parser.add_argument('--thresholds', type=str, default='0.5,0.7,0.8,0.9,0.95,0.99,1.01',
+                       help='置信度阈值候选，逗号分隔（>1表示从不提前退出）')
+    parser.add_argument('--output_dir', type=str, default='../public/models/resnet18_identity/early_exit',
+                       help='分段ONNX模型和报告输出目录')
+    parser.add_argument('--batch_size', type=int, default=32,
+                       help='评估批次大小')
+    parser.add_argument('--trust_checkpoint', action='store_true',
+                       help='允许加载包含权重以外Python对象的检查点（会执行其中的代码，仅用于可信来源）')
+
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    model, class_names = load_pytorch_model(args.model_path, trust_checkpoint=args.trust_checkpoint)
+    if len(getattr(model, 'exit_heads', {})) == 0:
+        print("错误: 该模型没有提前退出分支，请使用 --contrastive --early_exit 重新训练")
+        return
+    input_shape = get_input_shape(model.preprocessing)
+
+    image_paths, labels, _ = load_dataset(args.dataset_path)
+    _, val_paths, _, val_labels = train_test_split(
+        image_paths, labels, test_size=0.15, random_state=42, stratify=labels
+    )
+    preprocessing = model.preprocessing
+    _, val_transform = create_data_transforms(preprocessing['input_mode'], preprocessing['resize'][0])
+    val_dataset = GaitDataset(val_paths, val_labels, val_transform,
+                              image_mode=get_image_mode(preprocessing['input_mode']))
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=4)
+
+    thresholds = [float(t) for t in args.thresholds.split(',')]
+    rows = evaluate_thresholds(model, val_loader, thresholds, input_shape, device)
+
+    print(f"\n{'阈值':>8}{'准确率':>10}{'GMACs/帧':>12}{'FLOPs比例':>12}  退出分布")
+    for row in rows:
+        distribution = ', '.join(f"{name}: {rate:.0%}" for name, rate in row['exit_rates'].items())
+        print(f"{row['threshold']:>8.2f}{row['accuracy']:>9.2f}%{row['mean_gmacs_per_frame']:>12.3f}"
+              f"{row['flops_ratio']:>11.0%}  {distribution}")
+
+    # 推荐：准确率不低于不退出时的最小FLOPs阈值
+    full_accuracy = max(row['accuracy'] for row in rows if row['threshold'] > 1.0) \
+        if any(row['threshold'] > 1.0 for row in rows) else max(row['accuracy'] for row in rows)
+    eligible = [row for row in rows if row['accuracy'] >= full_accuracy]
+    recommended = min(eligible, key=lambda row: row['mean_gmacs_per_frame'])
+
+    manifest = export_early_exit_onnx(model, args.output_dir, input_shape,
+                                      thresholds={'recommended': recommended['threshold']})
+    report = {'class_names': class_names, 'segments': manifest['segments'], 'thresholds': rows,
+              'recommended_threshold': recommended['threshold']}
+    report_path = os.path.join(args.output_dir, 'early_exit_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n推荐阈值: {recommended['threshold']} (平均FLOPs为完整模型的 {recommended['flops_ratio']:.0%})")
+    print(f"提前退出报告已保存到: {report_path}")
+
+
+if __name__ == '__main__':
+    main()
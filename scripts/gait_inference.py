@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+"""
+轻量推理模块（不依赖PyTorch）
+只依赖NumPy、Pillow和onnxruntime：读取导出目录中的metadata.json（预处理配置、类别名、验证策略）
+和ONNX模型，提供predict（单张/批量识别）和verify（多帧身份验证）接口。
+导入train_resnet18.py会同时加载torch、torchvision、sklearn和matplotlib，启动需要数秒；
+本模块从导入到首次预测的耗时可用 --check_startup 在全新子进程中测量，并与固定预算比较。
+"""
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+import subprocess
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+import onnxruntime as ort
+
+from spectrogram_preprocessing import NATIVE_SIZE, get_preprocessing_config, invert_colormap
+from sequential_verification import SequentialVerifier, log_softmax
+from prediction_cache import DEFAULT_CACHE_SIZE, PredictionCache, cached_run
+from inference_metrics import NULL_METRICS
+
+DEFAULT_MODEL_DIR = '../public/models/resnet18_identity'
+DEFAULT_MODEL_FILE = 'resnet18_identity.onnx'
+BUNDLE_MANIFEST = os.path.join('web_bundle', 'model_manifest.json')
+# early_exit.py默认把分段模型导出到模型目录下的该子目录
+EARLY_EXIT_MANIFEST = os.path.join('early_exit', 'early_exit.json')
+
+# 导入到首次预测的默认预算（毫秒）
+DEFAULT_STARTUP_BUDGET_MS = 1500
+
+# 与Web端verifyIdentity一致：一次验证1-5张图像
+MAX_VERIFY_IMAGES = 5
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disabled': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+}
+EXECUTION_MODES = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL
+}
+
+
+def load_metadata(model_dir):
+    """读取metadata.json，缺少预处理配置的旧版元数据按默认RGB 224x224处理"""
+    with open(os.path.join(model_dir, 'metadata.json'), 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    metadata.setdefault('preprocessing', get_preprocessing_config())
+    metadata.setdefault('usage', {})
+    return metadata
+
+
+def tuned_runtime_config(metadata):
+    """metadata.json中ort_autotune.py写入的会话调优结果，未调优时返回None"""
+    return metadata.get('runtime', {}).get('onnxruntime')
+
+
+def create_session_options(settings=None, intra_op_threads=0):
+    """由会话配置字典（runtime.onnxruntime.session_options）创建SessionOptions
+
+    intra_op_threads非0时覆盖配置中的线程数；线程数不超过本机核心数（调优机器与部署机器可能不同）。
+    """
+    settings = settings or {}
+    options = ort.SessionOptions()
+    threads = intra_op_threads or settings.get('intra_op_num_threads', 0)
+    if threads:
+        options.intra_op_num_threads = min(threads, os.cpu_count() or threads)
+    if settings.get('inter_op_num_threads'):
+        options.inter_op_num_threads = settings['inter_op_num_threads']
+    if 'execution_mode' in settings:
+        options.execution_mode = EXECUTION_MODES[settings['execution_mode']]
+    if 'graph_optimization_level' in settings:
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[settings['graph_optimization_level']]
+    if 'enable_cpu_mem_arena' in settings:
+        options.enable_cpu_mem_arena = settings['enable_cpu_mem_arena']
+    if 'enable_mem_pattern' in settings:
+        options.enable_mem_pattern = settings['enable_mem_pattern']
+    return options
+
+
+def load_bundle_bytes(bundle_dir):
+    """从分块Web模型包(web_bundle.py生成)拼接ONNX模型字节，逐块校验SHA-256"""
+    with open(os.path.join(bundle_dir, 'model_manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    data = bytearray(manifest['total_size'])
+    for chunk in manifest['chunks']:
+        with open(os.path.join(bundle_dir, chunk['file']), 'rb') as f:
+            payload = f.read()
+        if hashlib.sha256(payload).hexdigest() != chunk['sha256']:
+            raise ValueError(f"数据块校验失败: {chunk['file']}")
+        data[chunk['offset']:chunk['offset'] + chunk['size']] = payload
+    return bytes(data)
+
+
+def resolve_model_source(model_dir, model_file=None):
+    """返回ONNX模型路径；目录中只有Web模型包时返回拼接后的模型字节
+
+    外部权重文件(.onnx.data)由onnxruntime按相对路径自动读取。
+    """
+    if model_file:
+        return model_file if os.path.isabs(model_file) else os.path.join(model_dir, model_file)
+    default_path = os.path.join(model_dir, DEFAULT_MODEL_FILE)
+    if os.path.exists(default_path):
+        return default_path
+    candidates = sorted(glob.glob(os.path.join(model_dir, '*.onnx')))
+    if candidates:
+        return candidates[0]
+    if os.path.exists(os.path.join(model_dir, BUNDLE_MANIFEST)):
+        return load_bundle_bytes(os.path.dirname(os.path.join(model_dir, BUNDLE_MANIFEST)))
+    raise FileNotFoundError(f"在 {model_dir} 中未找到ONNX模型或Web模型包")
+
+
+def model_fingerprint(model_source):
+    """模型内容哈希（含外部权重文件），用于断点续跑和预测缓存判断是否为同一模型"""
+    digest = hashlib.sha256()
+    if isinstance(model_source, bytes):
+        digest.update(model_source)
+        return digest.hexdigest()
+    for path in (model_source, model_source + '.data'):
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+class EarlyExitSession:
+    """提前退出分段模型（early_exit.py导出）的执行器，run()与ort.InferenceSession.run接口相同
+
+    按early_exit.json中的顺序逐段执行，每个样本在第一个softmax置信度不低于threshold的退出分支返回，
+    已退出的样本不再进入后续分段。只输出身份logits。
+    """
+
+    def __init__(self, manifest_path, options=None, providers=None, threshold=None):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.threshold = manifest['thresholds'].get('recommended') if threshold is None else threshold
+        if self.threshold is None:
+            raise ValueError(f"{manifest_path} 中没有推荐阈值，请重新运行early_exit.py")
+        exit_dir = os.path.dirname(manifest_path)
+        self.segments = [(segment['name'], ort.InferenceSession(os.path.join(exit_dir, segment['file']), options,
+                                                                providers=providers))
+                         for segment in manifest['segments']]
+        # 各分段退出的样本数
+        self.exit_counts = {name: 0 for name, _ in self.segments}
+
+    def get_inputs(self):
+        return self.segments[0][1].get_inputs()
+
+    def get_outputs(self):
+        return self.segments[-1][1].get_outputs()
+
+    def run(self, output_names, feed):
+        """逐段执行；非最后一段的输出为(特征, 退出分支logits)"""
+        features = next(iter(feed.values()))
+        logits = None
+        active = np.arange(len(features))
+        for name, session in self.segments:
+            outputs = session.run(None, {session.get_inputs()[0].name: features})
+            exit_logits = outputs[-1]
+            if logits is None:
+                logits = np.zeros((len(active), exit_logits.shape[1]), dtype=exit_logits.dtype)
+            if name == self.segments[-1][0]:
+                confident = np.ones(len(active), dtype=bool)
+            else:
+                confident = np.exp(log_softmax(exit_logits, axis=1)).max(axis=1) >= self.threshold
+            logits[active[confident]] = exit_logits[confident]
+            self.exit_counts[name] += int(confident.sum())
+            active, features = active[~confident], outputs[0][~confident]
+            if active.size == 0:
+                break
+        return [logits]
+
+
+def parse_time_window(window):
+    """'06:30-20:30' → (390, 1230)分钟；'24h'返回None表示不限时"""
+    if window == '24h':
+        return None
+    start, end = window.split('-')
+    to_minutes = lambda text: int(text.split(':')[0]) * 60 + int(text.split(':')[1])
+    return to_minutes(start), to_minutes(end)
+
+
+def check_time_permission(person_type, current_time=None, time_permissions=None):
+    """检查时间权限，与Web端checkTimePermission规则一致
+
+    time_permissions: metadata.json中usage.time_permissions，默认职工24小时、住户06:30-20:30
+    """
+    time_permissions = time_permissions or {'staff': '24h', 'resident': '06:30-20:30'}
+    current_time = current_time or datetime.now()
+    time_in_minutes = current_time.hour * 60 + current_time.minute
+
+    if person_type not in time_permissions:
+        return {'allowed': False, 'reason': '未知人员类型'}
+
+    window = parse_time_window(time_permissions[person_type])
+    if window is None:
+        return {'allowed': True, 'reason': '职工可24小时进出' if person_type == 'staff' else '可24小时进出'}
+    start, end = window
+    if start <= time_in_minutes <= end:
+        return {'allowed': True, 'reason': '在允许时间内'}
+    label = '住户' if person_type == 'resident' else person_type
+    return {'allowed': False, 'reason': f"{label}仅可在{time_permissions[person_type]}期间进出"}
+
+
+def load_image(image, input_mode='rgb'):
+    """路径、文件对象、PIL图像或uint8数组 → 预处理所需模式的PIL图像"""
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    elif not isinstance(image, Image.Image):
+        image = Image.open(image)
+        if input_mode == 'gray':
+            # JPEG只解码亮度通道
+            image.draft('L', image.size)
+    mode = 'L' if input_mode == 'gray' else 'RGB'
+    return image if image.mode == mode else image.convert(mode)
+
+
+def preprocess_image(image, preprocessing):
+    """单张图像 → (C, H, W) float32，与训练时的变换一致（不需要推理会话，可在解码子进程中调用）"""
+    input_mode = preprocessing['input_mode']
+    image = load_image(image, input_mode)
+    if input_mode == 'colormap':
+        image = Image.fromarray(invert_colormap(np.asarray(image), preprocessing['colormap']['lut_bits']), mode='L')
+    height, width = preprocessing['resize']
+    if image.size != (width, height):
+        image = image.resize((width, height), Image.BILINEAR)
+    array = np.asarray(image, dtype=np.float32) / 255.0
+    array = array[None] if array.ndim == 2 else array.transpose(2, 0, 1)
+    normalize = preprocessing['normalize']
+    mean = np.asarray(normalize['mean'], dtype=np.float32).reshape(-1, 1, 1)
+    std = np.asarray(normalize['std'], dtype=np.float32).reshape(-1, 1, 1)
+    return (array - mean) / std
+
+
+class GaitInference:
+    """基于onnxruntime的身份识别器
+
+    用法:
+        model = GaitInference('../public/models/resnet18_identity')
+        result = model.predict('frame.jpg')        # {'class_id': 'ID_3', 'confidence': 0.97, ...}
+        decision = model.verify(['f1.jpg', 'f2.jpg', 'f3.jpg'])
+    """
+
+    def __init__(self, model_dir=DEFAULT_MODEL_DIR, model_file=None, providers=None, intra_op_threads=0,
+                 use_tuned=True, cache_size=0, cache_path=None, cache=None, metrics=None, early_exit=False):
+        """use_tuned: metadata.json中有会话调优结果(ort_autotune.py)时按调优配置创建会话
+        early_exit: 使用early_exit.py导出到模型目录early_exit/下的分段模型，按推荐阈值逐段提前退出
+            （只输出身份logits，不能与多任务输出或时序融合同时使用）
+        cache_size: 预测缓存条目数，0表示不缓存；cache_path: 缓存持久化文件(SQLite)，需要正的cache_size
+        cache: 共享已有的PredictionCache（同一模型的多个会话共用一份缓存）
+        metrics: inference_metrics.InferenceMetrics，分阶段记录延迟；None表示不观测（空操作）
+        """
+        self.model_dir = model_dir
+        self.metadata = load_metadata(model_dir)
+        self.class_names = self.metadata['class_names']
+        self.preprocessing = self.metadata['preprocessing']
+        self.usage = self.metadata['usage']
+        self.metrics = metrics or NULL_METRICS
+
+        tuned = tuned_runtime_config(self.metadata) if use_tuned else None
+        options = create_session_options(tuned['session_options'] if tuned else None, intra_op_threads)
+        model_source = resolve_model_source(model_dir, model_file)
+        fingerprint_source = model_source
+        # 时序融合(usage.temporal_fusion)：verify()需要逐帧嵌入向量，把图中L2标准化后的嵌入暴露为额外输出
+        self.fusion = None
+        self.cache_variant = ''
+        if self.usage.get('temporal_fusion') is not None:
+            from temporal_fusion import TemporalFusion
+            from bulk_score import EMBEDDING_OUTPUT, add_embedding_output
+            self.fusion = TemporalFusion.from_policy(model_dir, self.usage['temporal_fusion'])
+            self.embedding_output = EMBEDDING_OUTPUT
+            model_source, self.cache_variant = add_embedding_output(model_source, self.fusion.embedding_tensor)
+        if early_exit:
+            if self.fusion is not None or self.metadata.get('tasks'):
+                raise ValueError("提前退出分段模型只输出身份logits，不能与多任务输出或时序融合同时使用")
+            self.session = EarlyExitSession(os.path.join(model_dir, EARLY_EXIT_MANIFEST), options,
+                                            providers or ['CPUExecutionProvider'])
+            # 退出分支的logits与完整模型不同，缓存条目按阈值区分
+            self.cache_variant = f'early_exit@{self.session.threshold:g}'
+        else:
+            self.session = ort.InferenceSession(model_source, options, providers=providers or ['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+        # 多任务模型：与身份logits在同一次推理中输出的其他任务（人员类型、步态质量等）
+        outputs = {output.name for output in self.session.get_outputs()}
+        self.tasks = {name: task for name, task in self.metadata.get('tasks', {}).items()
+                      if task.get('output', name) in outputs}
+        self.output_names = [self.output_name] + [task.get('output', name) for name, task in self.tasks.items()]
+        if cache_path and cache_size <= 0:
+            raise ValueError("cache_path 需要正的 cache_size")
+        if cache is None and cache_size > 0:
+            cache = PredictionCache(model_fingerprint(fingerprint_source), cache_size, path=cache_path)
+        self.cache = cache
+
+    def preprocess(self, image):
+        """单张图像 → (C, H, W) float32，与训练时的变换一致"""
+        with self.metrics.stage('decode'):
+            image = load_image(image, self.preprocessing['input_mode'])
+        with self.metrics.stage('preprocess'):
+            return preprocess_image(image, self.preprocessing)
+
+    def predict_outputs(self, images, batch_size=32):
+        """批量推理，返回模型全部输出 [(N, 类别数)的logits, 各任务输出...]（单任务模型只有logits）"""
+        batches = []
+        for start in range(0, len(images), batch_size):
+            batch = np.stack([self.preprocess(image) for image in images[start:start + batch_size]])
+            with self.metrics.stage('session_run'):
+                batches.append(cached_run(self.session, self.input_name, self.output_names, batch, self.cache,
+                                          self.cache_variant))
+        if not batches:
+            return [np.zeros((0, len(self.class_names)), np.float32)] + [np.zeros(0, np.float32) for _ in self.tasks]
+        return [np.concatenate(outputs) for outputs in zip(*batches)]
+
+    def predict_logits(self, images, batch_size=32):
+        """批量推理，返回(N, 类别数)的logits"""
+        return self.predict_outputs(images, batch_size)[0]
+
+    def _format_tasks(self, task_outputs):
+        results = {}
+        for (name, task), output in zip(self.tasks.items(), task_outputs):
+            if task['type'] == 'classification':
+                probabilities = np.exp(log_softmax(output))
+                index = int(np.argmax(probabilities))
+                results[name] = {'class': task['classes'][index], 'confidence': float(probabilities[index])}
+            else:
+                results[name] = {'value': float(output)}
+        return results
+
+    def _format_prediction(self, logits, task_outputs=()):
+        probabilities = np.exp(log_softmax(logits))
+        class_index = int(np.argmax(probabilities))
+        prediction = {
+            'class_id': self.class_names[class_index],
+            'class_index': class_index,
+            'confidence': float(probabilities[class_index]),
+            'probabilities': probabilities.astype(np.float32)
+        }
+        if self.tasks:
+            prediction['tasks'] = self._format_tasks(task_outputs)
+        return prediction
+
+    def predict(self, image):
+        """识别单张图像，置信度为softmax概率；多任务模型同时返回各任务结果(tasks)"""
+        return self.predict_batch([image])[0]
+
+    def predict_batch(self, images, batch_size=32):
+        with self.metrics.request('predict'):
+            logits, *task_outputs = self.predict_outputs(images, batch_size)
+            return [self._format_prediction(logits[i], [output[i] for output in task_outputs])
+                    for i in range(len(logits))]
+
+    def verify(self, images, claimed_id=None):
+        """多帧身份验证
+
+        metadata中配置了时序融合(usage.temporal_fusion)时逐帧更新融合模型的序列级后验，达到接受阈值即停止；
+        配置了序贯策略(usage.sequential_policy)时逐帧累积证据，达到接受/拒绝边界即停止；
+        否则使用固定一致性策略：所有帧识别结果一致且平均置信度不低于confidence_threshold才通过。
+        claimed_id: 可选的声明身份（类别名），指定时检验该身份
+        """
+        if len(images) == 0:
+            raise ValueError('至少需要提供1张图像')
+        if len(images) > MAX_VERIFY_IMAGES:
+            raise ValueError(f'最多支持{MAX_VERIFY_IMAGES}张图像')
+        claimed_index = self.class_names.index(claimed_id) if claimed_id is not None else None
+
+        with self.metrics.request('verify') as request:
+            success, confidence, class_index, individual_results = self._decide(images, claimed_index)
+            request.annotate(frames=len(individual_results), success=success)
+
+        return {
+            'success': success,
+            'identified_id': self.class_names[class_index] if success else None,
+            'confidence': confidence,
+            'frames_used': len(individual_results),
+            'individual_results': individual_results,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    def _decide(self, images, claimed_index):
+        """verify()的决策部分，返回(是否通过, 置信度, 类别下标, 逐帧结果)"""
+        policy = self.usage.get('sequential_policy')
+        if self.fusion is not None or policy is not None:
+            if self.fusion is not None:
+                verifier = self.fusion.stream(claimed_id=claimed_index)
+                output_names = self.output_names + [self.embedding_output]
+            else:
+                verifier = SequentialVerifier.from_policy(policy, claimed_id=claimed_index)
+                output_names = self.output_names
+            individual_results = []
+            step = None
+            for image in images:
+                batch = self.preprocess(image)[np.newaxis]
+                with self.metrics.stage('session_run'):
+                    outputs = [output[0] for output in
+                               cached_run(self.session, self.input_name, output_names, batch, self.cache,
+                                          self.cache_variant)]
+                logits, task_outputs = outputs[0], outputs[1:len(self.output_names)]
+                individual_results.append(self._format_prediction(logits, task_outputs))
+                with self.metrics.stage('fusion'):
+                    step = verifier.update(outputs[-1] if self.fusion is not None else logits)
+                if step['decision'] != 'continue':
+                    break
+            success = step['decision'] == 'accept'
+            confidence = step['posterior']
+            class_index = step['class_index']
+        else:
+            individual_results = self.predict_batch(images)
+            indices = [result['class_index'] for result in individual_results]
+            confidence = float(np.mean([result['confidence'] for result in individual_results]))
+            class_index = indices[0]
+            consistent = all(index == class_index for index in indices)
+            if claimed_index is not None:
+                consistent = consistent and class_index == claimed_index
+            success = consistent and confidence >= self.usage.get('confidence_threshold', 0.0)
+        return success, confidence, class_index, individual_results
+
+    def check_time_permission(self, person_type, current_time=None):
+        with self.metrics.stage('permission'):
+            return check_time_permission(person_type, current_time, self.usage.get('time_permissions'))
+
+
+_STARTUP_PROBE = """
+import time, sys, json
+start = time.perf_counter()
+sys.path.insert(0, {script_dir!r})
+import gait_inference
+imported = time.perf_counter()
+model = gait_inference.GaitInference({model_dir!r}, {model_file!r})
+loaded = time.perf_counter()
+image = {image!r}
+if image is None:
+    from PIL import Image
+    image = Image.new('RGB', (gait_inference.NATIVE_SIZE, gait_inference.NATIVE_SIZE))
+model.predict(image)
+predicted = time.perf_counter()
+try:
+    import resource  # 仅类Unix系统可用
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+except ImportError:
+    peak_rss_mb = None
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'load_ms': (loaded - imported) * 1000,
+    'first_predict_ms': (predicted - loaded) * 1000,
+    'total_ms': (predicted - start) * 1000,
+    'peak_rss_mb': peak_rss_mb,
+    'torch_imported': 'torch' in sys.modules
+}}))
+"""
+
+
+def measure_startup(model_dir, model_file=None, image=None, repeats=3):
+    """在全新的Python子进程中测量导入到首次预测的耗时，取多次中的最小值（排除磁盘缓存冷启动）"""
+    code = _STARTUP_PROBE.format(script_dir=os.path.dirname(os.path.abspath(__file__)),
+                                 model_dir=os.path.abspath(model_dir), model_file=model_file,
+                                 image=os.path.abspath(image) if image else None)
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return min(runs, key=lambda run: run['total_ms'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='不依赖PyTorch的轻量身份识别推理')
+    parser.add_argument('images', nargs='*',
+                       help='待识别的时频图路径')
+    parser.add_argument('--model_dir', type=str, default=DEFAULT_MODEL_DIR,
+                       help='模型目录（包含metadata.json和ONNX模型或web_bundle）')
+    parser.add_argument('--model_file', type=str, default=None,
+                       help='ONNX模型文件名（默认resnet18_identity.onnx）')
+    parser.add_argument('--verify', action='store_true',
+                       help='将输入图像作为同一人的多帧进行身份验证')
+    parser.add_argument('--claimed_id', type=str, default=None,
+                       help='验证时声明的身份（类别名）')
+    parser.add_argument('--threads', type=int, default=0,
+                       help='onnxruntime算子内线程数，0表示使用metadata.json中的调优配置（未调优时为默认）')
+    parser.add_argument('--cache_path', type=str, default=None,
+                       help='预测缓存文件(SQLite)，重复识别相同图像时直接使用缓存结果')
+    parser.add_argument('--cache_size', type=int, default=DEFAULT_CACHE_SIZE,
+                       help='预测缓存文件保留的最大条目数（按最近使用淘汰）')
+    parser.add_argument('--metrics', action='store_true',
+                       help='分阶段记录延迟（解码/预处理/推理/融合），结束时打印统计')
+    parser.add_argument('--early_exit', action='store_true',
+                       help='使用early_exit.py导出的分段模型，置信度达到推荐阈值时提前退出')
+    parser.add_argument('--check_startup', action='store_true',
+                       help='测量导入到首次预测的耗时，超过预算时以非零状态退出')
+    parser.add_argument('--startup_budget_ms', type=float, default=DEFAULT_STARTUP_BUDGET_MS,
+                       help='导入到首次预测的耗时预算（毫秒）')
+
+    args = parser.parse_args()
+
+    if args.check_startup:
+        result = measure_startup(args.model_dir, args.model_file, args.images[0] if args.images else None)
+        # Windows上没有resource模块，峰值RSS为None
+        peak_rss = '未知' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.0f}MB"
+        print(f"导入 {result['import_ms']:.0f}ms + 加载模型 {result['load_ms']:.0f}ms + "
+              f"首次预测 {result['first_predict_ms']:.0f}ms = {result['total_ms']:.0f}ms "
+              f"(预算 {args.startup_budget_ms:.0f}ms), 峰值RSS {peak_rss}")
+        if result['torch_imported']:
+            print("错误: 推理路径导入了torch")
+            sys.exit(1)
+        if result['total_ms'] > args.startup_budget_ms:
+            print("启动耗时超出预算")
+            sys.exit(1)
+        print("启动耗时在预算内")
+        return
+
+    if not args.images:
+        parser.error('请提供待识别的图像')
+
+    metrics = None
+    if args.metrics:
+        from inference_metrics import InferenceMetrics
+        metrics = InferenceMetrics()
+    model = GaitInference(args.model_dir, args.model_file, intra_op_threads=args.threads,
+                          cache_size=args.cache_size if args.cache_path else 0, cache_path=args.cache_path,
+                          metrics=metrics, early_exit=args.early_exit)
+    if args.verify:
+        result = model.verify(args.images, args.claimed_id)
+        for path, prediction in zip(args.images, result['individual_results']):
+            print(f"  {path}: {prediction['class_id']} ({prediction['confidence'] * 100:.1f}%)")
+        status = f"通过，身份 {result['identified_id']}" if result['success'] else '未通过'
+        print(f"验证{status}，置信度 {result['confidence'] * 100:.1f}%，使用 {result['frames_used']} 帧")
+    else:
+        for path, prediction in zip(args.images, model.predict_batch(args.images)):
+            print(f"{path}: {prediction['class_id']} ({prediction['confidence'] * 100:.1f}%)")
+            for name, task in prediction.get('tasks', {}).items():
+                if 'class' in task:
+                    print(f"  {name}: {task['class']} ({task['confidence'] * 100:.1f}%)")
+                else:
+                    print(f"  {name}: {task['value']:.3f}")
+    if args.early_exit:
+        print(f"提前退出（阈值 {model.session.threshold:g}）: " +
+              ', '.join(f"{name}: {count}" for name, count in model.session.exit_counts.items()))
+    if metrics is not None:
+        metrics.print_summary()
+    if model.cache is not None:
+        model.cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+本地推理服务（不依赖PyTorch）
+基于gait_inference.GaitInference的最小HTTP服务，可监听TCP端口或Unix域套接字（同一台机器上的闸机网关进程调用），
+供负载测试(load_generator.py)和本地集成使用：
+  POST /predict   请求体为一张时频图的原始字节(JPEG/PNG)，返回 {"class_id", "class_index", "confidence"}
+  GET  /health    返回模型名称、类别数、会话数和预测缓存统计
+  GET  /metrics   开启--metrics时返回Prometheus文本格式的分阶段延迟直方图、在途请求数和排队数（见inference_metrics.py）
+"""
+
+import os
+import io
+import json
+import queue
+import signal
+import socket
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from gait_inference import DEFAULT_MODEL_DIR, GaitInference, tuned_runtime_config
+from inference_metrics import NULL_METRICS, InferenceMetrics, send_metrics
+from prediction_cache import DEFAULT_CACHE_SIZE
+
+
+class SessionPool:
+    """多个推理会话轮流处理请求；ort_autotune.py测得多会话吞吐更高时使用（num_sessions）"""
+
+    def __init__(self, models, metrics=NULL_METRICS):
+        self.models = models
+        self.metrics = metrics
+        self._idle = queue.Queue()
+        for model in models:
+            self._idle.put(model)
+
+    def predict(self, image):
+        # 排队数：等待空闲会话的请求
+        self.metrics.queue_enter()
+        model = self._idle.get()
+        self.metrics.queue_exit()
+        try:
+            return model.predict(image)
+        finally:
+            self._idle.put(model)
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics' and self.server.pool.metrics.enabled:
+            send_metrics(self, self.server.pool.metrics)
+            return
+        if self.path != '/health':
+            self._send_json(404, {'error': 'not found'})
+            return
+        model = self.server.pool.models[0]
+        self._send_json(200, {'model_name': model.metadata.get('model_name'), 'num_classes': len(model.class_names),
+                              'sessions': len(self.server.pool.models),
+                              'cache': model.cache.stats() if model.cache is not None else None})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            prediction = self.server.pool.predict(io.BytesIO(data))
+        except Exception as e:
+            self._send_json(400, {'error': f'图像解码或推理失败: {e}'})
+            return
+        self._send_json(200, {
+            'class_id': prediction['class_id'],
+            'class_index': prediction['class_index'],
+            'confidence': prediction['confidence']
+        })
+
+    def address_string(self):
+        # Unix域套接字没有客户端地址
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        self.socket.bind(self.server_address)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def create_server(pool, http_address=None, unix_path=None, verbose=False):
+    """创建推理服务，http_address为'host:port'，unix_path为套接字路径（二选一）"""
+    if unix_path:
+        server = UnixHTTPServer(unix_path, PredictionHandler)
+    else:
+        host, port = http_address.rsplit(':', 1)
+        server = ThreadingHTTPServer((host, int(port)), PredictionHandler)
+    server.daemon_threads = True
+    server.pool = pool
+    server.verbose = verbose
+    return server
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地身份识别推理服务（HTTP，TCP或Unix域套接字）')
+    parser.add_argument('--model_dir', type=str, default=DEFAULT_MODEL_DIR,
+                       help='模型目录（包含metadata.json和ONNX模型）')
+    parser.add_argument('--http', type=str, default='127.0.0.1:8765',
+                       help='监听地址 host:port')
+    parser.add_argument('--unix', type=str, default=None,
+                       help='改为监听Unix域套接字路径')
+    parser.add_argument('--threads', type=int, default=0,
+                       help='onnxruntime算子内线程数，0表示使用metadata.json中的调优配置（未调优时为默认）')
+    parser.add_argument('--sessions', type=int, default=0,
+                       help='推理会话数，0表示使用metadata.json中的调优结果（未调优时为1）')
+    parser.add_argument('--cache_size', type=int, default=None,
+                       help='预测缓存条目数（相同帧重复提交时直接返回），0表示不缓存；'
+                            f'默认指定--cache_path时为{DEFAULT_CACHE_SIZE}，否则不缓存')
+    parser.add_argument('--cache_path', type=str, default=None,
+                       help='预测缓存持久化文件(SQLite)，重启后继续使用；模型更新后自动失效')
+    parser.add_argument('--metrics', action='store_true',
+                       help='开启分阶段延迟观测，通过 GET /metrics 提供Prometheus指标')
+    parser.add_argument('--metrics_textfile', type=str, default=None,
+                       help='同时定期写入该Prometheus textfile（node_exporter textfile collector）')
+    parser.add_argument('--metrics_interval', type=float, default=15.0,
+                       help='textfile写入间隔（秒）')
+    parser.add_argument('--slow_log', type=str, default=None,
+                       help='慢请求日志(JSONL)路径，记录超过阈值的请求及各阶段耗时')
+    parser.add_argument('--slow_threshold_ms', type=float, default=250.0,
+                       help='慢请求阈值（毫秒）')
+    parser.add_argument('--slow_sample_rate', type=float, default=1.0,
+                       help='慢请求写入日志的采样率（0-1）')
+    parser.add_argument('--verbose', action='store_true',
+                       help='打印每个请求的访问日志')
+
+    args = parser.parse_args()
+    if args.cache_size is None:
+        args.cache_size = DEFAULT_CACHE_SIZE if args.cache_path else 0
+    elif args.cache_path and args.cache_size <= 0:
+        parser.error('--cache_path 需要正的 --cache_size')
+    metrics = NULL_METRICS
+    if args.metrics or args.metrics_textfile or args.slow_log:
+        metrics = InferenceMetrics(slow_log_path=args.slow_log, slow_threshold_ms=args.slow_threshold_ms,
+                                   slow_sample_rate=args.slow_sample_rate,
+                                   labels={'model': os.path.basename(os.path.normpath(args.model_dir))})
+        if args.metrics_textfile:
+            metrics.start_textfile_writer(args.metrics_textfile, args.metrics_interval)
+    model = GaitInference(args.model_dir, intra_op_threads=args.threads, cache_size=args.cache_size,
+                          cache_path=args.cache_path, metrics=metrics)
+    tuned = tuned_runtime_config(model.metadata)
+    num_sessions = args.sessions or (tuned or {}).get('num_sessions', 1)
+    models = [model] + [GaitInference(args.model_dir, intra_op_threads=args.threads, cache=model.cache,
+                                      metrics=metrics)
+                        for _ in range(num_sessions - 1)]
+    server = create_server(SessionPool(models, metrics), args.http, args.unix, args.verbose)
+    print(f"推理服务已启动: {'unix:' + args.unix if args.unix else 'http://' + args.http}, {num_sessions} 个推理会话")
+    # 被进程管理器终止(SIGTERM)时同样关闭服务并删除套接字文件
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        metrics.close()
+        if model.cache is not None:
+            stats = model.cache.stats()
+            print(f"预测缓存命中率 {stats['hit_rate'] * 100:.1f}% ({stats['hits']}/{stats['hits'] + stats['misses']})")
+            model.cache.close()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+
+
+if __name__ == '__main__':
+    main()
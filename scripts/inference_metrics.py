@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+推理/验证路径的延迟观测（不依赖PyTorch）
+gait_inference.GaitInference 和 gait_server.py 在每次决策中分阶段计时：
+  decode      图像解码（PIL打开并转换到输入模式）
+  preprocess  缩放、色图反查与标准化（前端preprocessImage的Python对应部分）
+  session_run onnxruntime推理（含预测缓存查找）
+  fusion      序贯策略/时序融合的逐帧更新
+  permission  time_permissions检查
+并提供：
+  - HDR风格（对数分段、每段等宽子桶，相对误差约3%）的延迟直方图，按阶段和请求类型（predict/verify）分别统计
+  - 在途请求数和会话排队数两个gauge
+  - Prometheus文本格式导出：写入textfile collector文件，或由本地HTTP端点 /metrics 提供
+  - 慢请求日志：总耗时超过阈值的请求按采样率写入JSONL，附各阶段耗时
+关闭时（默认）stage()/request()返回共享的空计时器，不读时钟、不加锁，开销见 python inference_metrics.py bench。
+
+用法:
+  metrics = InferenceMetrics(slow_log_path='slow.jsonl', slow_threshold_ms=200)
+  model = GaitInference(model_dir, metrics=metrics)
+  metrics.start_http_endpoint('127.0.0.1:9108')        # 或 metrics.start_textfile_writer('/var/lib/node_exporter/gait.prom')
+  python inference_metrics.py bench --model_dir ../public/models/resnet18_identity
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ('decode', 'preprocess', 'session_run', 'fusion', 'permission')
+REQUEST_KINDS = ('predict', 'verify')
+# Prometheus直方图的导出边界（秒）；内部直方图更细，导出时按这些边界累计
+EXPORT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+EXPORT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+METRIC_PREFIX = 'gait'
+
+
+class LatencyHistogram:
+    """HDR风格的延迟直方图，记录微秒整数
+
+    小于2^sub_bucket_bits的值逐一计数；更大的值按2的幂分段，每段再等分为2^(sub_bucket_bits-1)个子桶，
+    相对误差不超过 1/2^(sub_bucket_bits-1)（默认6位约3%）。记录为O(1)，内存与记录次数无关。
+    """
+
+    def __init__(self, max_value_us=60_000_000, sub_bucket_bits=6):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.max_value_us = max_value_us
+        self.counts = [0] * (self._index(max_value_us) + 1)
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def _lower_bound(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        shift, offset = divmod(index - self.sub_bucket_count, self.half_count)
+        return (self.half_count + offset) << (shift + 1)
+
+    def _upper_bound(self, index):
+        return self._lower_bound(index + 1) - 1 if index + 1 < len(self.counts) else self.max_value_us
+
+    def record(self, value_us):
+        value_us = min(max(int(value_us), 0), self.max_value_us)
+        index = self._index(value_us)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_us += value_us
+            if value_us > self.max_us:
+                self.max_us = value_us
+
+    def snapshot(self):
+        """返回一致的(counts, count, total_us, max_us)副本，导出时不阻塞记录"""
+        with self._lock:
+            return list(self.counts), self.count, self.total_us, self.max_us
+
+    def percentile(self, q, snapshot=None):
+        """q∈[0, 1]，返回所在子桶的上界（微秒）；没有记录时返回0"""
+        counts, count, _, max_us = snapshot or self.snapshot()
+        if count == 0:
+            return 0
+        target = max(1, int(q * count + 0.5))
+        seen = 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            if seen >= target:
+                return min(self._upper_bound(index), max_us)
+        return max_us
+
+    def cumulative_counts(self, boundaries_us, snapshot=None):
+        """每个导出边界以下（含）的记录数，子桶按下界归入"""
+        counts, _, _, _ = snapshot or self.snapshot()
+        result = []
+        index = seen = 0
+        for boundary in boundaries_us:
+            while index < len(counts) and self._lower_bound(index) <= boundary:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class _StageTimer:
+    """单个阶段的计时上下文，记录到阶段直方图，并累加到当前线程正在处理的请求"""
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.metrics._record_stage(self.name, elapsed)
+        return False
+
+
+class _RequestTimer:
+    """一次决策（predict/verify）的计时上下文；同一线程内嵌套的请求不重复计数"""
+
+    def __init__(self, metrics, kind):
+        self.metrics = metrics
+        self.kind = kind
+        self.start = 0.0
+        self.stages = {}
+        self.info = {}
+        self.outermost = False
+
+    def annotate(self, **info):
+        """附加到慢请求日志的字段（如verify使用的帧数）"""
+        self.info.update(info)
+
+    def __enter__(self):
+        local = self.metrics._local
+        if getattr(local, 'request', None) is not None:
+            return local.request
+        self.outermost = True
+        local.request = self
+        self.metrics._add_gauge('in_flight', 1)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.outermost:
+            return False
+        elapsed = time.perf_counter() - self.start
+        self.metrics._local.request = None
+        self.metrics._add_gauge('in_flight', -1)
+        self.metrics._finish_request(self, elapsed, exc)
+        return False
+
+
+class _NullTimer:
+    """关闭观测时使用的空计时器"""
+
+    __slots__ = ()
+
+    def annotate(self, **info):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class InferenceMetrics:
+    """推理路径的阶段计时、直方图、gauge和慢请求日志
+
+    用法:
+        metrics = InferenceMetrics()
+        with metrics.request('predict'):
+            with metrics.stage('decode'):
+                ...
+        text = metrics.render_prometheus()
+    同一实例可由多个GaitInference会话和服务线程共享。enabled=False时所有方法都是空操作。
+    """
+
+    def __init__(self, enabled=True, slow_log_path=None, slow_threshold_ms=250.0, slow_sample_rate=1.0,
+                 labels=None):
+        self.enabled = enabled
+        self.slow_log_path = slow_log_path
+        self.slow_threshold_s = slow_threshold_ms / 1000.0
+        self.slow_sample_rate = slow_sample_rate
+        # 附加到每个指标上的常量标签，如 {'model': 'resnet18_identity'}
+        self.labels = dict(labels or {})
+        self.stage_histograms = {name: LatencyHistogram() for name in STAGES}
+        self.request_histograms = {kind: LatencyHistogram() for kind in REQUEST_KINDS}
+        self.requests_total = {kind: 0 for kind in REQUEST_KINDS}
+        self.errors_total = {kind: 0 for kind in REQUEST_KINDS}
+        self.slow_total = {kind: 0 for kind in REQUEST_KINDS}
+        self.gauges = {'in_flight': 0, 'queue_depth': 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._slow_log = None
+        self._writer = None
+        self._http_server = None
+        if enabled and slow_log_path:
+            self._slow_log = open(slow_log_path, 'a', encoding='utf-8', buffering=1)
+
+    def stage(self, name):
+        """返回某个阶段的计时上下文"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name)
+
+    def request(self, kind):
+        """返回一次决策的计时上下文，with语句得到的对象可调用annotate()"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _RequestTimer(self, kind)
+
+    def queue_enter(self):
+        """请求开始等待空闲推理会话"""
+        if self.enabled:
+            self._add_gauge('queue_depth', 1)
+
+    def queue_exit(self):
+        if self.enabled:
+            self._add_gauge('queue_depth', -1)
+
+    def _add_gauge(self, name, delta):
+        with self._lock:
+            self.gauges[name] += delta
+
+    def _record_stage(self, name, elapsed):
+        histogram = self.stage_histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stage_histograms.setdefault(name, LatencyHistogram())
+        histogram.record(elapsed * 1e6)
+        request = getattr(self._local, 'request', None)
+        if request is not None:
+            request.stages[name] = request.stages.get(name, 0.0) + elapsed
+
+    def _finish_request(self, request, elapsed, exc):
+        kind = request.kind
+        histogram = self.request_histograms.get(kind)
+        if histogram is None:
+            with self._lock:
+                histogram = self.request_histograms.setdefault(kind, LatencyHistogram())
+        histogram.record(elapsed * 1e6)
+        slow = elapsed >= self.slow_threshold_s
+        with self._lock:
+            self.requests_total[kind] = self.requests_total.get(kind, 0) + 1
+            if exc is not None:
+                self.errors_total[kind] = self.errors_total.get(kind, 0) + 1
+            if slow:
+                self.slow_total[kind] = self.slow_total.get(kind, 0) + 1
+        if slow and self._slow_log is not None and random.random() < self.slow_sample_rate:
+            record = {
+                'timestamp': datetime.now().isoformat(),
+                'kind': kind,
+                'total_ms': round(elapsed * 1000, 3),
+                'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in request.stages.items()},
+                'unaccounted_ms': round((elapsed - sum(request.stages.values())) * 1000, 3),
+                'in_flight': self.gauges['in_flight'],
+                'queue_depth': self.gauges['queue_depth']
+            }
+            record.update(request.info)
+            if exc is not None:
+                record['error'] = repr(exc)
+            line = json.dumps(record, ensure_ascii=False) + '\n'
+            with self._lock:
+                self._slow_log.write(line)
+
+    def summary(self):
+        """{'stages': {阶段: {...}}, 'requests': {类型: {...}}}，耗时单位为毫秒"""
+        def describe(histogram):
+            snapshot = histogram.snapshot()
+            _, count, total_us, max_us = snapshot
+            return {
+                'count': count,
+                'mean_ms': total_us / count / 1000 if count else 0.0,
+                'p50_ms': histogram.percentile(0.5, snapshot) / 1000,
+                'p99_ms': histogram.percentile(0.99, snapshot) / 1000,
+                'max_ms': max_us / 1000
+            }
+        return {
+            'stages': {name: describe(h) for name, h in self.stage_histograms.items() if h.count},
+            'requests': {kind: describe(h) for kind, h in self.request_histograms.items() if h.count}
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"\n{'阶段/请求':<14}{'次数':>8}{'平均(ms)':>10}{'P50(ms)':>10}{'P99(ms)':>10}{'最大(ms)':>10}")
+        for name, row in list(summary['stages'].items()) + list(summary['requests'].items()):
+            print(f"{name:<14}{row['count']:>8}{row['mean_ms']:>10.2f}{row['p50_ms']:>10.2f}"
+                  f"{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}")
+
+    def _format_labels(self, **labels):
+        merged = dict(self.labels, **labels)
+        if not merged:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in merged.items()) + '}'
+
+    def _render_histograms(self, lines, name, label, histograms, help_text):
+        metric = f'{METRIC_PREFIX}_{name}_seconds'
+        quantile_metric = f'{METRIC_PREFIX}_{name}_quantile_seconds'
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        quantile_lines = []
+        boundaries_us = [boundary * 1e6 for boundary in EXPORT_BUCKETS]
+        for key, histogram in histograms.items():
+            snapshot = histogram.snapshot()
+            _, count, total_us, _ = snapshot
+            cumulative = histogram.cumulative_counts(boundaries_us, snapshot)
+            for boundary, value in zip(EXPORT_BUCKETS, cumulative):
+                lines.append(f'{metric}_bucket{self._format_labels(**{label: key}, le=f"{boundary:g}")} {value}')
+            lines.append(f'{metric}_bucket{self._format_labels(**{label: key}, le="+Inf")} {count}')
+            lines.append(f'{metric}_sum{self._format_labels(**{label: key})} {total_us / 1e6:.6f}')
+            lines.append(f'{metric}_count{self._format_labels(**{label: key})} {count}')
+            for q in EXPORT_QUANTILES:
+                value = histogram.percentile(q, snapshot) / 1e6
+                quantile_lines.append(f'{quantile_metric}{self._format_labels(**{label: key}, quantile=f"{q:g}")} '
+                                      f'{value:.6f}')
+        lines.append(f'# HELP {quantile_metric} {help_text}（直方图分位数）')
+        lines.append(f'# TYPE {quantile_metric} gauge')
+        lines.extend(quantile_lines)
+
+    def render_prometheus(self):
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        lines = []
+        self._render_histograms(lines, 'stage_latency', 'stage', self.stage_histograms, '推理路径各阶段耗时')
+        self._render_histograms(lines, 'request_latency', 'kind', self.request_histograms, '每次决策的总耗时')
+        with self._lock:
+            counters = [('requests_total', '已完成的决策数', self.requests_total),
+                        ('request_errors_total', '抛出异常的决策数', self.errors_total),
+                        ('slow_requests_total', '超过慢请求阈值的决策数', self.slow_total)]
+            counters = [(name, help_text, dict(values)) for name, help_text, values in counters]
+            gauges = dict(self.gauges)
+        for name, help_text, values in counters:
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} counter')
+            for kind, value in values.items():
+                lines.append(f'{METRIC_PREFIX}_{name}{self._format_labels(kind=kind)} {value}')
+        for name, help_text in (('in_flight', '正在处理的决策数'), ('queue_depth', '等待空闲推理会话的请求数')):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} gauge')
+            lines.append(f'{METRIC_PREFIX}_{name}{self._format_labels()} {gauges[name]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """写入node_exporter textfile collector文件（先写临时文件再改名，采集时不会读到半个文件）"""
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(path + '.tmp', path)
+
+    def start_textfile_writer(self, path, interval=15.0):
+        """后台线程每interval秒写一次textfile"""
+        if not self.enabled or self._writer is not None:
+            return
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.write_prometheus(path)
+            self.write_prometheus(path)
+
+        thread = threading.Thread(target=run, name='metrics-textfile', daemon=True)
+        thread.start()
+        self._writer = (thread, stop)
+        print(f"推理指标每 {interval:g} 秒写入: {path}")
+
+    def start_http_endpoint(self, address='127.0.0.1:9108'):
+        """在后台线程中提供 GET /metrics（独立于gait_server.py，嵌入其他进程时使用）"""
+        if not self.enabled or self._http_server is not None:
+            return
+        host, port = address.rsplit(':', 1)
+        server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+        server.daemon_threads = True
+        server.metrics = self
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        self._http_server = server
+        print(f"推理指标端点: http://{address}/metrics")
+
+    def close(self):
+        if self._writer is not None:
+            thread, stop = self._writer
+            stop.set()
+            thread.join()
+            self._writer = None
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+        if self._slow_log is not None:
+            self._slow_log.close()
+            self._slow_log = None
+
+
+NULL_METRICS = InferenceMetrics(enabled=False)
+
+
+def send_metrics(handler, metrics):
+    """把Prometheus文本写入HTTP响应（gait_server.py的/metrics与独立端点共用）"""
+    body = metrics.render_prometheus().encode('utf-8')
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        send_metrics(self, self.server.metrics)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_timer_overhead(iterations=1_000_000):
+    """单次 with metrics.stage(...) 的耗时（纳秒）：空循环、关闭、开启"""
+    enabled = InferenceMetrics()
+    results = {}
+    for name, metrics in (('baseline', None), ('disabled', NULL_METRICS), ('enabled', enabled)):
+        start = time.perf_counter()
+        if metrics is None:
+            for _ in range(iterations):
+                pass
+        else:
+            for _ in range(iterations):
+                with metrics.stage('decode'):
+                    pass
+        results[name] = (time.perf_counter() - start) * 1e9 / iterations
+    return {
+        'disabled_ns': results['disabled'] - results['baseline'],
+        'enabled_ns': results['enabled'] - results['baseline']
+    }
+
+
+def bench_predict(model_dir, repeats=200, rounds=5):
+    """同一张图像的predict()耗时中位数：未插桩的等价流程、关闭观测、开启观测，三者轮流运行以抵消漂移"""
+    import numpy as np
+    from PIL import Image
+    from gait_inference import GaitInference, NATIVE_SIZE, preprocess_image
+
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (NATIVE_SIZE, NATIVE_SIZE, 3), dtype=np.uint8))
+    disabled = GaitInference(model_dir)
+    enabled = GaitInference(model_dir, metrics=InferenceMetrics())
+
+    def raw():
+        batch = preprocess_image(image, disabled.preprocessing)[np.newaxis]
+        logits = disabled.session.run(disabled.output_names, {disabled.input_name: batch})[0]
+        return disabled._format_prediction(logits[0])
+
+    runs = {'uninstrumented': raw, 'disabled': lambda: disabled.predict(image),
+            'enabled': lambda: enabled.predict(image)}
+    samples = {name: [] for name in runs}
+    for run in runs.values():
+        run()
+    for _ in range(rounds):
+        for name, run in runs.items():
+            for _ in range(repeats // rounds):
+                start = time.perf_counter()
+                run()
+                samples[name].append((time.perf_counter() - start) * 1000)
+    return {name: float(np.median(values)) for name, values in samples.items()}, enabled.metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='推理观测开销基准')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench = subparsers.add_parser('bench', help='测量关闭/开启观测时的计时器与predict()开销')
+    bench.add_argument('--model_dir', type=str, default=None,
+                       help='模型目录；指定时同时测量端到端predict()耗时')
+    bench.add_argument('--iterations', type=int, default=1_000_000,
+                       help='计时器微基准的循环次数')
+    bench.add_argument('--repeats', type=int, default=200,
+                       help='每种配置的predict()次数')
+    args = parser.parse_args()
+
+    timer = bench_timer_overhead(args.iterations)
+    # 一次predict()进入3个阶段和1个请求计时器
+    calls_per_request = 4
+    print(f"计时器开销: 关闭 {timer['disabled_ns']:.0f} ns/次, 开启 {timer['enabled_ns']:.0f} ns/次 "
+          f"(每次predict约 {calls_per_request} 次)")
+
+    if args.model_dir:
+        medians, metrics = bench_predict(args.model_dir, args.repeats)
+        base = medians['uninstrumented']
+        print(f"\n{'配置':<16}{'predict中位数(ms)':>20}{'相对未插桩':>12}")
+        for name, value in medians.items():
+            print(f"{name:<16}{value:>20.3f}{value / base - 1:>+12.2%}")
+        disabled_share = calls_per_request * timer['disabled_ns'] / (base * 1e6)
+        print(f"关闭时计时器理论开销占predict耗时: {disabled_share:.4%}")
+        metrics.print_summary()
+
+
+if __name__ == '__main__':
+    main()
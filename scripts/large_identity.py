@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+大规模身份训练（数千至上万名住户）
+原有训练流程按约10个身份设计：对比学习对的负样本在每次取样时遍历全部类别，分类头为稠密softmax，
+每步计算全部类别的logits。多院区部署时身份数增长到上万，本模块提供按身份数不增长的训练组件：
+  - IdentityBalancedSampler：P×K采样，每个batch含P个身份、每个身份K张图像，不论身份总数多少每个batch都有足够的同类样本
+  - CosineClassifier：类别权重矩阵上的余弦分类头（类别中心即权重行），推理时输出 scale × cos 作为logits
+  - SampledMarginLoss：CosFace/ArcFace间隔损失，每个batch只取本batch出现的类别加上随机负类别计算logits；
+    类别权重的梯度为稀疏梯度（只含采样到的行），配合SparseAdam只更新这些行，单步计算量和激活内存只与采样类别数有关
+  - evaluate_retrieval：以嵌入检索为准的评估（每个身份一个注册模板，探针图像按余弦相似度检索），分块计算，不生成N×C的完整矩阵
+用法（训练）: python train_resnet18.py --large_identity --batch_size 64 --samples_per_identity 4 --sampled_classes 1024
+基准测试: python large_identity.py --identities 10,100,1000,10000
+"""
+
+import math
+import time
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import Sampler
+
+MARGIN_TYPES = ('cosface', 'arcface')
+DEFAULT_MARGINS = {'cosface': 0.35, 'arcface': 0.5}
+
+
+class IdentityBalancedSampler(Sampler):
+    """P×K身份均衡采样，配合DataLoader(batch_size=P×K, shuffle=False, sampler=...)使用
+
+    每个epoch按类别的随机排列依次取P个不同身份，每个身份随机取K张图像（不足K张时有放回抽取）。
+    一个epoch的样本数与数据集大小相同（取P×K的整数倍），生成顺序的代价为O(样本数)，与身份数无关。
+    """
+
+    def __init__(self, labels, identities_per_batch, samples_per_identity=4, seed=0):
+        self.identities_per_batch = identities_per_batch
+        self.samples_per_identity = samples_per_identity
+        self.batch_size = identities_per_batch * samples_per_identity
+        self.rng = np.random.default_rng(seed)
+
+        labels = np.asarray(labels)
+        order = np.argsort(labels, kind='stable')
+        classes, starts = np.unique(labels[order], return_index=True)
+        self.class_indices = np.split(order, starts[1:])
+        if len(classes) < identities_per_batch:
+            raise ValueError(f"身份数 {len(classes)} 少于每个batch的身份数 {identities_per_batch}")
+        self.num_batches = max(1, len(labels) // self.batch_size)
+
+    def __iter__(self):
+        k = self.samples_per_identity
+        permutation = self.rng.permutation(len(self.class_indices))
+        position = 0
+        for _ in range(self.num_batches):
+            if position + self.identities_per_batch > len(permutation):
+                permutation = self.rng.permutation(len(self.class_indices))
+                position = 0
+            for class_index in permutation[position:position + self.identities_per_batch]:
+                indices = self.class_indices[class_index]
+                yield from self.rng.choice(indices, k, replace=len(indices) < k).tolist()
+            position += self.identities_per_batch
+
+    def __len__(self):
+        return self.num_batches * self.batch_size
+
+    def __repr__(self):
+        return (f"IdentityBalancedSampler({len(self.class_indices)} 个身份, "
+                f"每batch {self.identities_per_batch}×{self.samples_per_identity})")
+
+
+class CosineClassifier(nn.Module):
+    """余弦分类头：logits = scale × cos(嵌入向量, 类别权重)
+
+    权重的每一行即该身份的类别中心；训练时由SampledMarginLoss按采样类别取行计算，推理和导出时输出全部类别的logits。
+    """
+
+    def __init__(self, embedding_dim, num_classes, scale=30.0):
+        super(CosineClassifier, self).__init__()
+        self.weight = nn.Parameter(torch.randn(num_classes, embedding_dim) * 0.01)
+        self.register_buffer('scale', torch.tensor(float(scale)))
+
+    @property
+    def out_features(self):
+        return self.weight.shape[0]
+
+    def forward(self, embeddings):
+        return self.scale * F.linear(F.normalize(embeddings, dim=1), F.normalize(self.weight, dim=1))
+
+
+class SampledMarginLoss(nn.Module):
+    """CosFace/ArcFace间隔损失，只在本batch的类别和随机负类别上计算
+
+    num_sampled: 每个batch随机补充的负类别数（本batch的类别全部保留），0或不小于类别总数时使用全部类别。
+    classifier.weight得到稀疏梯度，须用SparseAdam等支持稀疏梯度的优化器（见split_parameters）。
+    forward返回(损失, 采样类别上不加间隔的logits, 采样类别中的标签)，后两者用于统计训练准确率（采样类别内的准确率）。
+    """
+
+    def __init__(self, margin_type='cosface', margin=None, num_sampled=1024):
+        super(SampledMarginLoss, self).__init__()
+        if margin_type not in MARGIN_TYPES:
+            raise ValueError(f"不支持的间隔损失: {margin_type}，可选: {MARGIN_TYPES}")
+        self.margin_type = margin_type
+        self.margin = DEFAULT_MARGINS[margin_type] if margin is None else margin
+        self.num_sampled = num_sampled
+
+    def sample_classes(self, labels, num_classes):
+        """本batch的类别 ∪ 随机负类别（升序），以及标签在其中的位置"""
+        if not self.num_sampled or self.num_sampled >= num_classes:
+            return torch.arange(num_classes, device=labels.device), labels
+        negatives = torch.randint(num_classes, (self.num_sampled,), device=labels.device)
+        classes = torch.unique(torch.cat([labels, negatives]))
+        return classes, torch.searchsorted(classes, labels)
+
+    def forward(self, embeddings, labels, classifier):
+        classes, targets = self.sample_classes(labels, classifier.weight.shape[0])
+        # 按行取权重，反向传播只产生这些行的稀疏梯度
+        weight = F.embedding(classes, classifier.weight, sparse=True)
+        cosine = F.linear(F.normalize(embeddings, dim=1), F.normalize(weight, dim=1)).clamp(-1 + 1e-7, 1 - 1e-7)
+
+        target_cosine = cosine.gather(1, targets[:, None])
+        if self.margin_type == 'cosface':
+            margined = target_cosine - self.margin
+        else:
+            # cos(θ + m)；θ + m 超过π时改用 cos θ - m·sin m 保持单调
+            sine = torch.sqrt(1.0 - target_cosine ** 2)
+            margined = target_cosine * math.cos(self.margin) - sine * math.sin(self.margin)
+            margined = torch.where(target_cosine > math.cos(math.pi - self.margin), margined,
+                                   target_cosine - self.margin * math.sin(self.margin))
+        logits = classifier.scale * cosine.scatter(1, targets[:, None], margined)
+        return F.cross_entropy(logits, targets), classifier.scale * cosine, targets
+
+    def __repr__(self):
+        sampled = self.num_sampled if self.num_sampled else '全部'
+        return f"SampledMarginLoss({self.margin_type}, margin={self.margin}, 采样类别={sampled})"
+
+
+def split_parameters(model):
+    """(稠密参数, 类别权重)：类别权重只有采样到的行有梯度，单独用SparseAdam更新，其余参数照常用Adam"""
+    class_weight = model.classifier.weight
+    return [p for p in model.parameters() if p is not class_weight], [class_weight]
+
+
+def embed(model, images):
+    """L2归一化的嵌入向量（不经过分类头）"""
+    return F.normalize(model.embedding(model.backbone(images)), dim=1)
+
+
+def extract_embeddings(model, loader, device='cpu'):
+    """返回(N, D)嵌入向量和(N,)标签，保存在设备上"""
+    model.eval()
+    embeddings, labels = [], []
+    with torch.no_grad():
+        for images, targets in loader:
+            embeddings.append(embed(model, images.to(device)).float())
+            labels.append(targets.to(device))
+    return torch.cat(embeddings), torch.cat(labels)
+
+
+def class_templates(embeddings, labels, num_classes):
+    """每个身份的注册模板：该身份嵌入向量均值再归一化；没有注册图像的身份返回valid=False"""
+    sums = torch.zeros(num_classes, embeddings.shape[1], device=embeddings.device)
+    sums.index_add_(0, labels, embeddings)
+    counts = torch.bincount(labels, minlength=num_classes)
+    return F.normalize(sums, dim=1), counts > 0
+
+
+def evaluate_retrieval(model, gallery_loader, probe_loader, num_classes, device='cpu', chunk_size=1024,
+                       impostors_per_probe=100, far_targets=(1e-2, 1e-3), seed=0):
+    """嵌入检索评估：gallery_loader的图像按身份求注册模板，probe_loader的每张图像检索最相似的模板
+
+    返回rank-1/rank-5准确率(%)和给定误识率下的通过率TAR@FAR。
+    相似度按探针分块计算（每块 chunk_size × 身份数），冒名分数每个探针随机保留impostors_per_probe个。
+    """
+    gallery, gallery_labels = extract_embeddings(model, gallery_loader, device)
+    templates, enrolled = class_templates(gallery, gallery_labels, num_classes)
+    probes, probe_labels = extract_embeddings(model, probe_loader, device)
+    generator = torch.Generator(device=probes.device).manual_seed(seed)
+
+    rank1 = torch.zeros((), dtype=torch.long, device=probes.device)
+    rank5 = torch.zeros((), dtype=torch.long, device=probes.device)
+    genuine, impostor = [], []
+    for start in range(0, len(probes), chunk_size):
+        labels = probe_labels[start:start + chunk_size]
+        scores = probes[start:start + chunk_size] @ templates.T
+        scores[:, ~enrolled] = -2.0
+        top = scores.topk(min(5, num_classes), dim=1).indices
+        rank1 += (top[:, 0] == labels).sum()
+        rank5 += (top == labels[:, None]).any(dim=1).sum()
+
+        genuine.append(scores.gather(1, labels[:, None]).squeeze(1))
+        if num_classes > 1:
+            others = torch.randint(num_classes - 1, (len(labels), impostors_per_probe), device=scores.device,
+                                   generator=generator)
+            # 跳过本身份：大于等于本身份编号的索引后移一位
+            others = others + (others >= labels[:, None]).long()
+            sampled = scores.gather(1, others)
+            impostor.append(sampled[sampled > -2.0])
+
+    genuine = torch.cat(genuine)
+    impostor = torch.cat(impostor) if impostor else genuine.new_zeros(0)
+    total = max(1, len(probes))
+    results = {
+        'probes': len(probes),
+        'enrolled_identities': int(enrolled.sum()),
+        'rank1': 100.0 * rank1.item() / total,
+        'rank5': 100.0 * rank5.item() / total,
+        'genuine_mean': genuine.mean().item() if len(genuine) else 0.0,
+        'impostor_mean': impostor.mean().item() if len(impostor) else 0.0
+    }
+    for far in far_targets:
+        if len(impostor) == 0:
+            continue
+        # 冒名分数中只有比例far高于阈值
+        k = min(len(impostor), max(1, math.ceil(len(impostor) * (1.0 - far))))
+        threshold = impostor.kthvalue(k).values.item()
+        results[f'tar@far={far:g}'] = 100.0 * (genuine > threshold).float().mean().item()
+    return results
+
+
+def print_retrieval_results(results):
+    print(f"嵌入检索评估: {results['probes']} 张探针图像, {results['enrolled_identities']} 个注册身份")
+    print(f"  Rank-1: {results['rank1']:.2f}%, Rank-5: {results['rank5']:.2f}%")
+    print(f"  同身份平均相似度 {results['genuine_mean']:.3f}, 不同身份平均相似度 {results['impostor_mean']:.3f}")
+    for name, value in results.items():
+        if name.startswith('tar@'):
+            print(f"  TAR@FAR={name[len('tar@far='):]}: {value:.2f}%")
+
+
+def benchmark_head(num_classes, embedding_dim=128, batch_size=64, samples_per_identity=4, num_sampled=1024,
+                   steps=20, device='cpu', margin_type='cosface'):
+    """测量分类头+间隔损失+优化器单步的耗时和每步的logits内存（不含主干网络，主干耗时与身份数无关）"""
+    head = CosineClassifier(embedding_dim, num_classes).to(device)
+    loss_fn = SampledMarginLoss(margin_type, num_sampled=num_sampled)
+    optimizer = torch.optim.SparseAdam(head.parameters(), lr=1e-3)
+    identities = max(1, batch_size // samples_per_identity)
+    timings = []
+    logits_elements = 0
+    for step in range(steps + 3):
+        labels = torch.randint(num_classes, (identities,), device=device).repeat_interleave(samples_per_identity)
+        embeddings = torch.randn(len(labels), embedding_dim, device=device, requires_grad=True)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        loss, logits, _ = loss_fn(embeddings, labels, head)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        if step >= 3:
+            timings.append(time.perf_counter() - start)
+            logits_elements = max(logits_elements, logits.numel())
+    return {
+        'identities': num_classes,
+        'step_ms': 1000 * float(np.median(timings)),
+        'logits_mb': logits_elements * 4 * 3 / 1024 ** 2,  # logits、softmax和梯度
+        'class_weight_mb': num_classes * embedding_dim * 4 * 3 / 1024 ** 2  # 权重和Adam两个状态（梯度为稀疏）
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='大规模身份训练组件基准：分类头单步耗时和内存随身份数的变化')
+    parser.add_argument('--identities', type=str, default='10,100,1000,10000',
+                       help='比较的身份数，逗号分隔')
+    parser.add_argument('--batch_size', type=int, default=64,
+                       help='批次大小（P×K）')
+    parser.add_argument('--samples_per_identity', type=int, default=4,
+                       help='每个身份的样本数K')
+    parser.add_argument('--sampled_classes', type=int, default=1024,
+                       help='每个batch参与计算的类别数，0表示全部类别（稠密softmax）')
+    parser.add_argument('--embedding_dim', type=int, default=128,
+                       help='嵌入维度')
+    parser.add_argument('--margin_loss', type=str, default='cosface', choices=MARGIN_TYPES,
+                       help='间隔损失类型')
+    parser.add_argument('--steps', type=int, default=20,
+                       help='每种配置测量的步数')
+
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    counts = [int(n) for n in args.identities.split(',')]
+
+    print(f"{'身份数':>8}{'模式':>10}{'单步(ms)':>12}{'logits内存(MB)':>16}{'类别权重(MB)':>14}")
+    for num_sampled, mode in ((args.sampled_classes, '采样'), (0, '稠密')):
+        if mode == '稠密' and not args.sampled_classes:
+            continue
+        for count in counts:
+            result = benchmark_head(count, args.embedding_dim, args.batch_size, args.samples_per_identity,
+                                    num_sampled, args.steps, device, args.margin_loss)
+            print(f"{count:>10}{mode:>10}{result['step_ms']:>14.2f}{result['logits_mb']:>18.2f}"
+                  f"{result['class_weight_mb']:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+多闸机识别负载生成器
+模拟N个闸机同时向推理后端发送识别请求，测量整个设施规模下识别链路的吞吐、尾延迟和饱和点：
+  - 帧来源：回放数据集中的连续帧（public/dataset），或合成类似微多普勒时频图的帧
+  - 每个闸机有独立的到达过程（泊松/均匀/背靠背），每次通行验证发送若干帧（逐帧等待结果）
+  - 后端：进程内onnxruntime会话(inproc)、本地HTTP服务(http://host:port)或Unix域套接字(unix:/path)，
+    后两者的协议见gait_server.py
+延迟从“人到达闸机”的计划时刻算起，后端排队的时间也计入（避免协调遗漏导致低估尾延迟）。
+"""
+
+import io
+import os
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse
+
+import numpy as np
+from PIL import Image
+
+from spectrogram_preprocessing import NATIVE_SIZE, jet_colormap
+from sequential_verification import group_walk_sequences
+
+ARRIVAL_PROCESSES = ('poisson', 'uniform', 'closed')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_dataset_frames(dataset_path, frames_per_identity=60):
+    """读取每个身份按行走序列和帧号（DopplerN的数字）排序的前若干帧（原始字节），返回{身份: [字节]}"""
+    frames = {}
+    for identity in sorted(os.listdir(dataset_path)):
+        folder = os.path.join(dataset_path, identity)
+        if not os.path.isdir(folder):
+            continue
+        paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS)]
+        walks = group_walk_sequences(paths, [identity] * len(paths))
+        ordered = [paths[position] for key in sorted(walks) for position in walks[key]]
+        if ordered:
+            frames[identity] = [open(path, 'rb').read() for path in ordered[:frames_per_identity]]
+    if not frames:
+        raise FileNotFoundError(f"数据集中没有图像: {dataset_path}")
+    return frames
+
+
+def synthesize_frames(num_identities=10, frames_per_identity=20, seed=0):
+    """合成类似微多普勒时频图的帧：躯干正弦曲线 + 四肢谐波 + 噪声，经jet色图渲染并编码为JPEG
+
+    不同身份使用不同的步频和摆幅，用于没有真实数据时的负载测试（识别结果无意义）。
+    """
+    rng = np.random.default_rng(seed)
+    colormap = (jet_colormap(256) * 255).astype(np.uint8)
+    size = NATIVE_SIZE
+    rows = np.arange(size).reshape(-1, 1)
+    frames = {}
+    for identity in range(num_identities):
+        cadence = rng.uniform(3.0, 6.0)
+        swing = rng.uniform(20, 60)
+        torso = rng.uniform(0.45, 0.6) * size
+        identity_frames = []
+        for index in range(frames_per_identity):
+            t = np.linspace(0, cadence * 2 * np.pi, size) + index * 0.3
+            torso_line = torso + 6 * np.sin(t)
+            limb_line = torso + swing * np.sin(t + 0.5)
+            intensity = np.exp(-((rows - torso_line) ** 2) / 20.0)
+            intensity += 0.6 * np.exp(-((rows - limb_line) ** 2) / 60.0)
+            intensity += rng.gamma(1.0, 0.05, (size, size))
+            scaled = np.clip(intensity / intensity.max() * 255, 0, 255).astype(np.uint8)
+            buffer = io.BytesIO()
+            Image.fromarray(colormap[scaled]).save(buffer, format='JPEG', quality=90)
+            identity_frames.append(buffer.getvalue())
+        frames[f'SYN_{identity + 1}'] = identity_frames
+    return frames
+
+
+def sample_sequence(frames, rng, length):
+    """随机选择一个身份和起始位置，返回连续length帧（模拟一次通行采集的帧序列）"""
+    identity = rng.choice(list(frames))
+    sequence = frames[identity]
+    start = rng.randrange(max(1, len(sequence) - length + 1))
+    return [sequence[(start + i) % len(sequence)] for i in range(length)]
+
+
+class InProcessBackend:
+    """进程内onnxruntime会话，多个闸机线程共享（onnxruntime推理时释放GIL）"""
+
+    def __init__(self, model_dir, threads=0, cache_size=0):
+        from gait_inference import GaitInference
+        self.model = GaitInference(model_dir, intra_op_threads=threads, cache_size=cache_size)
+
+    def predict(self, data):
+        prediction = self.model.predict(io.BytesIO(data))
+        return {'class_id': prediction['class_id'], 'confidence': prediction['confidence']}
+
+    def close(self):
+        if self.model.cache is not None:
+            stats = self.model.cache.stats()
+            print(f"预测缓存命中率 {stats['hit_rate'] * 100:.1f}% ({stats['hits']}/{stats['hits'] + stats['misses']})")
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=30):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class HTTPBackend:
+    """gait_server.py协议的HTTP客户端，每个闸机线程保持一个长连接"""
+
+    def __init__(self, target, timeout=30):
+        self.target = target
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.target.startswith('unix:'):
+                connection = _UnixHTTPConnection(self.target[len('unix:'):], self.timeout)
+            else:
+                url = urlparse(self.target)
+                connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def predict(self, data):
+        connection = self._connection()
+        try:
+            connection.request('POST', '/predict', body=data, headers={'Content-Type': 'application/octet-stream'})
+            response = connection.getresponse()
+            payload = json.loads(response.read())
+        except (OSError, http.client.HTTPException):
+            # 连接断开时下次请求重新建立
+            connection.close()
+            self._local.connection = None
+            raise
+        if response.status != 200:
+            raise RuntimeError(payload.get('error', f'HTTP {response.status}'))
+        return payload
+
+    def close(self):
+        pass
+
+
+def create_backend(spec, model_dir=None, threads=0, cache_size=0):
+    """spec: 'inproc'、'http://host:port' 或 'unix:/path/to/socket'"""
+    if spec == 'inproc':
+        return InProcessBackend(model_dir, threads, cache_size)
+    if spec.startswith(('http://', 'unix:')):
+        return HTTPBackend(spec)
+    raise ValueError(f"不支持的后端: {spec}，可选: inproc, http://host:port, unix:/path")
+
+
+def _gate_worker(gate, backend, frames, config, start, results, lock):
+    """单个闸机：按到达过程产生通行，每次通行逐帧请求识别"""
+    rng = random.Random(config['seed'] * 1000 + gate)
+    end = start + config['duration']
+    rate = config['rate']
+    arrival = start + (rng.random() / rate if config['arrival'] != 'closed' else 0.0)
+    verification_latencies, frame_latencies, errors = [], [], 0
+
+    while arrival < end:
+        now = time.perf_counter()
+        if arrival > now:
+            time.sleep(arrival - now)
+        for data in sample_sequence(frames, rng, config['frames_per_verification']):
+            frame_start = time.perf_counter()
+            try:
+                backend.predict(data)
+            except Exception:
+                errors += 1
+            frame_latencies.append(time.perf_counter() - frame_start)
+        finished = time.perf_counter()
+        verification_latencies.append(finished - arrival)
+
+        if config['arrival'] == 'poisson':
+            arrival += rng.expovariate(rate)
+        elif config['arrival'] == 'uniform':
+            arrival += 1.0 / rate
+        else:
+            arrival = finished
+
+    with lock:
+        results['verification_latencies'].extend(verification_latencies)
+        results['frame_latencies'].extend(frame_latencies)
+        results['errors'] += errors
+        results['last_finish'] = max(results['last_finish'], time.perf_counter())
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    array = np.asarray(values) * 1000
+    return {'p50_ms': float(np.percentile(array, 50)), 'p95_ms': float(np.percentile(array, 95)),
+            'p99_ms': float(np.percentile(array, 99)), 'max_ms': float(array.max())}
+
+
+def run_load(backend, frames, gates, duration=10.0, arrival='poisson', rate=0.5, frames_per_verification=3,
+             seed=0):
+    """运行一轮负载，返回吞吐和延迟统计
+
+    rate: 每个闸机每秒到达的通行次数（closed模式下忽略，上一次通行结束立即开始下一次）
+    """
+    config = {'duration': duration, 'arrival': arrival, 'rate': rate,
+              'frames_per_verification': frames_per_verification, 'seed': seed}
+    results = {'verification_latencies': [], 'frame_latencies': [], 'errors': 0, 'last_finish': 0.0}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_gate_worker, args=(gate, backend, frames, config, start, results, lock),
+                                daemon=True) for gate in range(gates)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = max(results['last_finish'], start + duration) - start
+    verifications = len(results['verification_latencies'])
+    row = {
+        'gates': gates,
+        'arrival': arrival,
+        'offered_verifications_per_sec': gates * rate if arrival != 'closed' else None,
+        'verifications': verifications,
+        'verifications_per_sec': verifications / elapsed,
+        'frames_per_sec': len(results['frame_latencies']) / elapsed,
+        'errors': results['errors'],
+        'verification_latency': _percentiles(results['verification_latencies']),
+        'frame_latency': _percentiles(results['frame_latencies'])
+    }
+    return row
+
+
+def find_saturation(rows, latency_slo_ms, min_efficiency=0.9, min_scaling_gain=0.05):
+    """返回第一个饱和的闸机数，未饱和返回None
+
+    开环到达：达成的通行速率低于提供速率的min_efficiency，或验证p99超过延迟目标；
+    闭环（背靠背）：增加闸机后吞吐提升不足min_scaling_gain，或验证p99超过延迟目标。
+    """
+    previous = None
+    for row in rows:
+        p99 = row['verification_latency']['p99_ms']
+        if p99 is not None and p99 > latency_slo_ms:
+            return row['gates']
+        offered = row['offered_verifications_per_sec']
+        if offered is not None and row['verifications_per_sec'] < min_efficiency * offered:
+            return row['gates']
+        if offered is None and previous is not None and \
+                row['verifications_per_sec'] < (1 + min_scaling_gain) * previous['verifications_per_sec']:
+            return row['gates']
+        previous = row
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多闸机识别负载生成器（吞吐、尾延迟、饱和点）')
+    parser.add_argument('--backend', type=str, default='inproc',
+                       help='推理后端: inproc、http://host:port 或 unix:/path（服务端见gait_server.py）')
+    parser.add_argument('--model_dir', type=str, default='../public/models/resnet18_identity',
+                       help='inproc后端的模型目录')
+    parser.add_argument('--threads', type=int, default=0,
+                       help='inproc后端的onnxruntime算子内线程数，0表示使用metadata.json中的调优配置（未调优时为默认）')
+    parser.add_argument('--cache_size', type=int, default=0,
+                       help='inproc后端的预测缓存条目数，0表示不缓存（服务端缓存见gait_server.py --cache_size）')
+    parser.add_argument('--dataset_path', type=str, default='../public/dataset',
+                       help='回放帧的数据集路径')
+    parser.add_argument('--synthetic', action='store_true',
+                       help='使用合成时频图代替数据集帧')
+    parser.add_argument('--gates', type=str, default='1,2,4,8,16',
+                       help='依次测试的闸机数，逗号分隔')
+    parser.add_argument('--duration', type=float, default=10.0,
+                       help='每轮负载的持续时间（秒）')
+    parser.add_argument('--arrival', type=str, default='poisson', choices=ARRIVAL_PROCESSES,
+                       help='到达过程：poisson（泊松）、uniform（固定间隔）、closed（背靠背，测最大吞吐）')
+    parser.add_argument('--rate', type=float, default=0.5,
+                       help='每个闸机每秒到达的通行次数')
+    parser.add_argument('--frames_per_verification', type=int, default=3,
+                       help='每次通行验证发送的帧数')
+    parser.add_argument('--latency_slo_ms', type=float, default=1000.0,
+                       help='通行验证p99延迟目标（毫秒），超过即视为饱和')
+    parser.add_argument('--seed', type=int, default=0,
+                       help='随机种子')
+    parser.add_argument('--output', type=str, default=None,
+                       help='JSON报告保存路径')
+
+    args = parser.parse_args()
+    if args.synthetic:
+        frames = synthesize_frames(seed=args.seed)
+        print(f"使用合成帧: {len(frames)} 个身份")
+    else:
+        frames = load_dataset_frames(args.dataset_path)
+        print(f"回放数据集帧: {len(frames)} 个身份, {sum(len(v) for v in frames.values())} 帧")
+
+    backend = create_backend(args.backend, args.model_dir, args.threads, args.cache_size)
+    # 预热：首次推理包含会话初始化和内存分配
+    backend.predict(next(iter(frames.values()))[0])
+
+    gate_counts = [int(g) for g in args.gates.split(',')]
+    print(f"后端: {args.backend}, 到达过程: {args.arrival}"
+          f"{'' if args.arrival == 'closed' else f', 每闸机 {args.rate}/秒'}, 每次验证 {args.frames_per_verification} 帧")
+    print(f"{'闸机数':>6}{'验证/秒':>10}{'帧/秒':>10}{'验证p50':>10}{'验证p99':>10}{'帧p99':>10}{'错误':>6}")
+    rows = []
+    for gates in gate_counts:
+        row = run_load(backend, frames, gates, args.duration, args.arrival, args.rate,
+                       args.frames_per_verification, args.seed)
+        rows.append(row)
+        latency = row['verification_latency']
+        print(f"{gates:>9}{row['verifications_per_sec']:>12.2f}{row['frames_per_sec']:>11.1f}"
+              f"{latency['p50_ms'] or 0:>11.0f}{latency['p99_ms'] or 0:>11.0f}"
+              f"{row['frame_latency']['p99_ms'] or 0:>11.0f}{row['errors']:>7}")
+    backend.close()
+
+    saturation = find_saturation(rows, args.latency_slo_ms)
+    if saturation is None:
+        print(f"在测试范围内未饱和（最多 {gate_counts[-1]} 个闸机）")
+    else:
+        print(f"饱和点: {saturation} 个闸机（吞吐不再随闸机数增长或p99超过 {args.latency_slo_ms:.0f}ms）")
+
+    if args.output:
+        report = {'backend': args.backend, 'arguments': vars(args), 'saturation_gates': saturation, 'runs': rows}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"报告已保存到: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+DataLoader与线程数自动调优
+在多核CPU上，DataLoader worker进程与PyTorch算子内线程会互相争抢核心。
+这里用若干个批次的实际“读取+前向+反向”短跑测量一组(worker数, 预取深度, 算子线程数)组合，
+选出吞吐最高的配置，并按机器和数据集签名缓存，后续训练直接复用。
+"""
+
+import os
+import json
+import time
+import socket
+import hashlib
+import platform
+
+import torch
+from torch.utils.data import DataLoader
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'gait_identity', 'loader_autotune.json')
+
+PREFETCH_FACTORS = (2, 4)
+
+
+def machine_signature():
+    """机器签名：主机名、核心数、CPU型号、PyTorch版本"""
+    cpu_model = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu_model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{socket.gethostname()}|{os.cpu_count()}|{cpu_model}|torch-{torch.__version__}"
+
+
+def dataset_signature(image_paths, batch_size, preprocessing, contrastive=False):
+    """数据集签名：图像数量、抽样文件大小、预处理配置、批次大小和模式"""
+    digest = hashlib.sha1()
+    digest.update(f"{len(image_paths)}|{batch_size}|{contrastive}|".encode())
+    digest.update(json.dumps(preprocessing, sort_keys=True).encode())
+    step = max(1, len(image_paths) // 64)
+    for path in sorted(image_paths)[::step]:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = -1
+        digest.update(f"{os.path.basename(path)}:{size}".encode())
+    return digest.hexdigest()[:16]
+
+
+def candidate_configs(cpu_count=None):
+    """候选配置：worker数 × 预取深度 × 算子线程数，保证worker与线程总数不超过核心数"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    worker_counts = [w for w in (0, 2, 4, 8, 16, 32) if w < cpu_count] or [0]
+
+    configs = []
+    for num_workers in worker_counts:
+        available = max(1, cpu_count - num_workers)
+        thread_counts = sorted({available, max(1, available // 2)}, reverse=True)
+        prefetch_factors = PREFETCH_FACTORS if num_workers > 0 else (None,)
+        for torch_threads in thread_counts:
+            for prefetch_factor in prefetch_factors:
+                configs.append({
+                    'num_workers': num_workers,
+                    'prefetch_factor': prefetch_factor,
+                    'torch_threads': torch_threads
+                })
+    return configs
+
+
+def loader_kwargs(config, pin_memory=False):
+    """将调优结果转换为DataLoader参数"""
+    kwargs = {'num_workers': config['num_workers'], 'pin_memory': pin_memory}
+    if config['num_workers'] > 0:
+        kwargs['prefetch_factor'] = config['prefetch_factor']
+        # 每个epoch都重新创建worker进程的开销较大，保持常驻
+        kwargs['persistent_workers'] = True
+    return kwargs
+
+
+def measure_config(dataset, batch_size, config, step_fn, num_batches, pin_memory=False):
+    """测量单个配置的吞吐(图像/秒)，不计入worker启动和首个批次"""
+    torch.set_num_threads(config['torch_threads'])
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, **loader_kwargs(config, pin_memory))
+
+    iterator = iter(loader)
+    step_fn(next(iterator))
+
+    images = 0
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            break
+        step_fn(batch)
+        images += batch_size
+    elapsed = time.perf_counter() - start
+    del iterator, loader
+    return images / elapsed if elapsed > 0 else 0.0
+
+
+def load_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache_path, cache):
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=2, ensure_ascii=False)
+
+
+def autotune_loader(dataset, batch_size, step_fn, signature, cache_path=DEFAULT_CACHE_PATH,
+                    num_batches=10, pin_memory=False, refresh=False):
+    """返回最快的加载配置；同一机器和数据集签名的结果直接从缓存读取
+
+    step_fn: 对每个批次执行一次与训练相近的计算（前向+反向），使测量包含线程争用
+    """
+    cache_key = f"{machine_signature()}|{signature}"
+    cache = load_cache(cache_path)
+    if not refresh and cache_key in cache:
+        config = cache[cache_key]['config']
+        print(f"使用缓存的DataLoader配置: {config}")
+        torch.set_num_threads(config['torch_threads'])
+        return config
+
+    # 批次数不足时缩短每次试验，保证每个配置测量相同数量的批次
+    num_batches = max(1, min(num_batches, len(dataset) // batch_size - 1))
+    default_threads = torch.get_num_threads()
+    configs = candidate_configs()
+    print(f"开始DataLoader自动调优：{len(configs)} 个候选配置，每个测量 {num_batches} 个批次")
+
+    trials = []
+    for config in configs:
+        throughput = measure_config(dataset, batch_size, config, step_fn, num_batches, pin_memory)
+        trials.append({'config': config, 'images_per_sec': throughput})
+        print(f"  workers={config['num_workers']:>2}, prefetch={config['prefetch_factor']}, "
+              f"threads={config['torch_threads']:>2}: {throughput:.1f} 图像/秒")
+    torch.set_num_threads(default_threads)
+
+    best = max(trials, key=lambda trial: trial['images_per_sec'])
+    config = best['config']
+    print(f"最快配置: {config} ({best['images_per_sec']:.1f} 图像/秒)")
+
+    cache[cache_key] = {
+        'config': config,
+        'images_per_sec': best['images_per_sec'],
+        'trials': trials,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    save_cache(cache_path, cache)
+    print(f"调优结果已缓存到: {cache_path}")
+
+    torch.set_num_threads(config['torch_threads'])
+    return config
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+按样本损失跳过简单样本的训练采样器
+同一次行走的相邻DopplerN帧高度冗余，训练几个epoch后大部分训练样本的损失已接近0，
+每个epoch仍对全部样本做前向和反向传播。本采样器按数据集位置记录每个样本最近一次的分类损失：
+  - 预热阶段和每隔若干epoch的全量epoch使用全部样本（同时刷新所有样本的损失）
+  - 其余epoch中，连续多次损失低于阈值的"简单样本"只以小概率保留（保留下来的用于刷新其损失），其余样本全部训练
+损失数组保存在训练设备上，每个step用索引写入，不产生设备同步；每个epoch开始时同步一次来决定本轮样本。
+"""
+
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+class LossAwareSampler(Sampler):
+    """替代DataLoader的shuffle=True，配合train_model(sample_skipper=...)使用
+
+    DataLoader按采样器给出的顺序组batch（多worker时顺序不变），
+    第k个batch对应本轮索引的[k * batch_size, (k + 1) * batch_size)段，据此把逐样本损失写回数据集位置。
+    """
+
+    def __init__(self, num_samples, batch_size, device='cpu', loss_threshold=0.05, patience=2, easy_keep=0.1,
+                 warmup_epochs=5, full_pass_every=5, seed=0):
+        """
+        loss_threshold: 损失低于该值视为已学会
+        patience: 连续这么多次低于阈值才算简单样本
+        easy_keep: 非全量epoch中简单样本的保留概率
+        warmup_epochs / full_pass_every: 前若干epoch及之后每隔若干epoch使用全部样本
+        """
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self.loss_threshold = loss_threshold
+        self.patience = patience
+        self.easy_keep = easy_keep
+        self.warmup_epochs = warmup_epochs
+        self.full_pass_every = full_pass_every
+        self.rng = np.random.default_rng(seed)
+
+        self.losses = torch.full((num_samples,), float('inf'), device=device)
+        self.easy_streak = torch.zeros(num_samples, dtype=torch.int16, device=device)
+        self._positions = torch.arange(num_samples)
+        self._device_positions = self._positions.to(device)
+        self.epoch = 0
+        self.phase = 0  # 渐进分辨率的阶段号，由ProgressiveResize设置
+        self.full_pass = True
+        self.history = []
+        self._epoch_start = None
+
+    def is_full_pass(self, epoch):
+        return epoch < self.warmup_epochs or (self.full_pass_every > 0 and
+                                              (epoch - self.warmup_epochs) % self.full_pass_every == 0)
+
+    def set_epoch(self, epoch):
+        """在每个epoch开始前调用，决定本轮训练的样本"""
+        self.epoch = epoch
+        self.full_pass = self.is_full_pass(epoch)
+        if self.full_pass:
+            selected = np.arange(self.num_samples)
+        else:
+            easy = (self.easy_streak >= self.patience).cpu().numpy()
+            keep = ~easy | (self.rng.random(self.num_samples) < self.easy_keep)
+            selected = np.flatnonzero(keep)
+        self.rng.shuffle(selected)
+        self._positions = torch.from_numpy(selected)
+        self._device_positions = self._positions.to(self.losses.device)
+        self._epoch_start = time.perf_counter()
+
+    def update(self, batch_idx, per_sample_loss):
+        """记录一个batch的逐样本损失（设备上的张量）"""
+        start = batch_idx * self.batch_size
+        positions = self._device_positions[start:start + len(per_sample_loss)]
+        loss = per_sample_loss.detach().float()
+        self.losses[positions] = loss
+        streak = self.easy_streak[positions]
+        self.easy_streak[positions] = torch.where(loss < self.loss_threshold, streak + 1, torch.zeros_like(streak))
+
+    def end_epoch(self):
+        """记录本轮样本数和训练耗时，返回本轮统计"""
+        stats = {
+            'epoch': self.epoch + 1,
+            'full_pass': self.full_pass,
+            'phase': self.phase,
+            'samples': len(self._positions),
+            'seconds': time.perf_counter() - self._epoch_start,
+            'easy': int((self.easy_streak >= self.patience).sum())
+        }
+        self.history.append(stats)
+        return stats
+
+    def summary(self):
+        """整个训练的样本节省比例和实测加速（以全量epoch的平均耗时为基准）
+
+        不同分辨率阶段的epoch耗时不可比，基准按阶段分别估计；某个阶段没有全量epoch时无法估计，
+        full_pass_seconds和speedup为None。
+        """
+        trained = sum(s['samples'] for s in self.history)
+        seconds = sum(s['seconds'] for s in self.history)
+        baseline = 0.0
+        for phase in sorted({s['phase'] for s in self.history}):
+            epochs = [s for s in self.history if s['phase'] == phase]
+            # 每个阶段的第一个epoch包含worker启动等一次性开销，有其他全量epoch时不计入基准
+            full = [s for s in epochs if s['full_pass']]
+            full = full[1:] if len(full) > 1 else full
+            if not full:
+                baseline = None
+                break
+            baseline += np.mean([s['seconds'] for s in full]) * len(epochs)
+        return {
+            'samples_trained': trained,
+            'samples_full': self.num_samples * len(self.history),
+            'sample_fraction': trained / max(1, self.num_samples * len(self.history)),
+            'train_seconds': seconds,
+            'full_pass_seconds': baseline,
+            'speedup': None if baseline is None else (baseline / seconds if seconds > 0 else 1.0)
+        }
+
+    def __iter__(self):
+        return iter(self._positions.tolist())
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __repr__(self):
+        return (f"LossAwareSampler(threshold={self.loss_threshold}, patience={self.patience}, "
+                f"easy_keep={self.easy_keep}, warmup={self.warmup_epochs}, full_pass_every={self.full_pass_every})")
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+与具体模型无关的层工具：按输入预处理（rgb/gray/colormap）调整预训练网络的第一层卷积
+train_resnet18.py、convert_to_tfjs.py、coreset_select.py和student_models.py共用。
+"""
+
+import torch
+import torch.nn as nn
+
+
+def adapt_conv_input_channels(conv, in_channels):
+    """将卷积层改为in_channels个输入通道
+
+    单通道输入时把预训练滤波器沿RGB维度求和：对灰度图复制成三通道再卷积的结果与之等价，
+    因此可以直接沿用ImageNet预训练权重。
+    """
+    if conv.in_channels == in_channels:
+        return conv
+    if in_channels != 1:
+        raise ValueError(f"仅支持将卷积层改为单通道输入，收到: {in_channels}")
+
+    new_conv = nn.Conv2d(1, conv.out_channels, kernel_size=conv.kernel_size, stride=conv.stride,
+                         padding=conv.padding, dilation=conv.dilation, bias=conv.bias is not None)
+    with torch.no_grad():
+        new_conv.weight.copy_(conv.weight.sum(dim=1, keepdim=True))
+        if conv.bias is not None:
+            new_conv.bias.copy_(conv.bias)
+    new_conv.weight.requires_grad = conv.weight.requires_grad
+    return new_conv
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+共享主干的多任务输出头
+闸机除身份外还需要人员类型（住户/员工，决定time_permissions）等信息，界面上还显示步态分析结果；
+每个问题单独训练一个模型就要对同一帧多跑一次完整的ResNet18。本模块在ResNet18Contrastive的池化特征（512维）上
+挂多个命名输出头，与身份分类共用一次主干前向：
+  - classification：分类头，输出logits（如 person_type: resident/staff）
+  - score：回归头，输出一个标量（如 gait_quality）
+任务配置为JSON文件（train_resnet18.py --tasks），标签按身份给出（同一身份的所有帧标签相同），未标注的身份不参与该任务的损失：
+  {
+    "person_type": {"type": "classification", "classes": ["resident", "staff"], "weight": 0.5,
+                    "labels": {"ID_1": "resident", "ID_2": "staff"}},
+    "gait_quality": {"type": "score", "weight": 0.2, "labels": {"ID_1": 0.8, "ID_2": 0.6}}
+  }
+导出的ONNX模型第一个输出仍为身份logits('output')，其后按任务名依次输出，metadata.json的tasks段记录各输出的含义。
+"""
+
+import json
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+TASK_TYPES = ('classification', 'score')
+# 身份分类的输出名（与单任务模型一致）
+IDENTITY_OUTPUT = 'output'
+IGNORE_INDEX = -100
+
+
+def load_task_config(path, class_names):
+    """读取并校验任务配置，返回 {任务名: {'type', 'classes', 'weight', 'labels'}}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    tasks = {}
+    for name, task in config.items():
+        if name == IDENTITY_OUTPUT or not name.isidentifier():
+            raise ValueError(f"任务名 '{name}' 无效：须为合法标识符且不能为 '{IDENTITY_OUTPUT}'")
+        task_type = task.get('type', 'classification')
+        if task_type not in TASK_TYPES:
+            raise ValueError(f"任务 {name} 的类型 {task_type} 不支持，可选: {TASK_TYPES}")
+        classes = list(task.get('classes', [])) if task_type == 'classification' else []
+        if task_type == 'classification' and len(classes) < 2:
+            raise ValueError(f"分类任务 {name} 至少需要2个类别")
+
+        labels = {}
+        for identity, label in task.get('labels', {}).items():
+            if identity not in class_names:
+                print(f"警告: 任务 {name} 的标签中身份 {identity} 不在数据集中，已忽略")
+                continue
+            if task_type == 'classification' and label not in classes:
+                raise ValueError(f"任务 {name} 中身份 {identity} 的标签 {label} 不在类别 {classes} 中")
+            labels[identity] = label if task_type == 'classification' else float(label)
+        if not labels:
+            raise ValueError(f"任务 {name} 没有可用的标签")
+
+        tasks[name] = {'type': task_type, 'classes': classes, 'weight': float(task.get('weight', 1.0)),
+                       'labels': labels}
+        print(f"任务 {name} ({task_type}): 损失权重 {tasks[name]['weight']}, "
+              f"已标注 {len(labels)}/{len(class_names)} 个身份")
+    return tasks
+
+
+def task_head_config(tasks):
+    """去掉标签后的任务配置，随检查点和元数据保存，用于重建输出头和解释输出"""
+    return {name: {'type': task['type'], 'classes': list(task['classes']), 'weight': task['weight']}
+            for name, task in tasks.items()}
+
+
+def task_output_size(task):
+    return len(task['classes']) if task['type'] == 'classification' else 1
+
+
+def build_task_heads(in_features, head_config):
+    """为每个任务创建输出头（为空时不增加任何参数，与旧检查点兼容）"""
+    return nn.ModuleDict({
+        name: nn.Sequential(
+            nn.Linear(in_features, 128),
+            nn.ReLU(),
+            nn.Dropout(0.3),
+            nn.Linear(128, task_output_size(task))
+        ) for name, task in (head_config or {}).items()
+    })
+
+
+def forward_task_heads(task_heads, head_config, features):
+    """主干池化特征 → {任务名: 输出}；分类任务为(N, 类别数)的logits，回归任务为(N,)"""
+    outputs = {}
+    for name, head in task_heads.items():
+        output = head(features)
+        outputs[name] = output.squeeze(1) if head_config[name]['type'] == 'score' else output
+    return outputs
+
+
+class MultiTaskLoss(nn.Module):
+    """按身份查表得到各任务的目标，计算加权损失
+
+    分类任务为交叉熵，回归任务为均方误差；未标注身份的样本不计入对应任务的损失（batch中没有标注样本时该任务损失为0）。
+    目标表作为buffer保存在训练设备上，查表不产生设备同步。
+    """
+
+    def __init__(self, tasks, class_names):
+        super(MultiTaskLoss, self).__init__()
+        self.tasks = task_head_config(tasks)
+        for name, task in tasks.items():
+            if task['type'] == 'classification':
+                targets = torch.full((len(class_names),), IGNORE_INDEX, dtype=torch.long)
+                for identity, label in task['labels'].items():
+                    targets[class_names.index(identity)] = task['classes'].index(label)
+            else:
+                targets = torch.full((len(class_names),), float('nan'))
+                for identity, value in task['labels'].items():
+                    targets[class_names.index(identity)] = value
+            self.register_buffer(f'{name}_targets', targets)
+
+    def forward(self, task_outputs, identity_labels):
+        """返回(加权总损失, {任务名: 损失})"""
+        total = 0.0
+        losses = {}
+        for name, task in self.tasks.items():
+            targets = getattr(self, f'{name}_targets')[identity_labels]
+            output = task_outputs[name]
+            if task['type'] == 'classification':
+                labeled = (targets != IGNORE_INDEX).sum().clamp(min=1)
+                loss = F.cross_entropy(output, targets, ignore_index=IGNORE_INDEX, reduction='sum') / labeled
+            else:
+                mask = ~torch.isnan(targets)
+                error = torch.where(mask, output - torch.nan_to_num(targets), torch.zeros_like(output))
+                loss = error.pow(2).sum() / mask.sum().clamp(min=1)
+            losses[name] = loss
+            total = total + task['weight'] * loss
+        return total, losses
+
+
+class MultiTaskExport(nn.Module):
+    """ONNX导出包装：一次前向输出 (身份logits, 任务1输出, 任务2输出, ...)"""
+
+    def __init__(self, model):
+        super(MultiTaskExport, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        _, logits, _, task_outputs = self.model(x, return_tasks=True)
+        return (logits,) + tuple(task_outputs[name] for name in self.model.task_heads.keys())
+
+
+def export_output_names(model):
+    """导出时的输出名：身份logits在前，其后为各任务"""
+    return [IDENTITY_OUTPUT] + list(getattr(model, 'task_heads', {}).keys())
+
+
+def export_wrapper(model):
+    """带任务头的模型返回多输出包装，否则返回模型本身"""
+    return MultiTaskExport(model) if len(getattr(model, 'task_heads', {})) > 0 else model
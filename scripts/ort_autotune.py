@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+onnxruntime会话配置自动调优
+用数据集中的代表性batch测量不同会话配置的延迟和吞吐，把最快的配置写入模型目录的metadata.json
+(runtime.onnxruntime)，gait_inference.GaitInference、bulk_score.py和gait_server.py会自动使用（原生CPU结果不用于Web端WASM会话）。
+完整网格过大，按阶段搜索，每个阶段在前一阶段的最优配置上只改变一组参数：
+  1. 算子内线程数 × 会话数（多个会话并发运行，会话数 × 线程数不超过核心数）
+  2. 图优化级别
+  3. 执行模式（顺序/并行）× 算子间线程数
+  4. 内存池(arena)和内存复用规划(mem pattern)
+只依赖NumPy、Pillow和onnxruntime。
+"""
+
+import os
+import json
+import time
+import socket
+import random
+import platform
+import argparse
+import threading
+
+import numpy as np
+import onnxruntime as ort
+
+from gait_inference import (DEFAULT_MODEL_DIR, GRAPH_OPTIMIZATION_LEVELS, create_session_options, load_metadata,
+                            preprocess_image, resolve_model_source)
+from spectrogram_preprocessing import get_input_shape
+
+OBJECTIVES = ('throughput', 'p50', 'p99')
+
+BASE_SETTINGS = {
+    'intra_op_num_threads': 1,
+    'inter_op_num_threads': 1,
+    'execution_mode': 'sequential',
+    'graph_optimization_level': 'all',
+    'enable_cpu_mem_arena': True,
+    'enable_mem_pattern': True
+}
+
+
+def machine_signature():
+    """调优时的机器信息，部署到不同机器时可据此判断是否需要重新调优"""
+    cpu_model = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu_model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{socket.gethostname()}|{os.cpu_count()}|{cpu_model}|onnxruntime-{ort.__version__}"
+
+
+def load_representative_batches(dataset_path, preprocessing, batch_size=1, num_batches=16, seed=0):
+    """从每个身份均匀抽取图像组成batch；数据集不存在时使用随机输入"""
+    shape = get_input_shape(preprocessing, batch_size)
+    paths = []
+    if dataset_path and os.path.isdir(dataset_path):
+        for identity in sorted(os.listdir(dataset_path)):
+            folder = os.path.join(dataset_path, identity)
+            if os.path.isdir(folder):
+                paths.extend(os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                             if name.lower().endswith(('.jpg', '.jpeg', '.png')))
+    if not paths:
+        print(f"警告: 未找到数据集图像 ({dataset_path})，使用随机输入")
+        rng = np.random.default_rng(seed)
+        return [rng.standard_normal(shape).astype(np.float32) for _ in range(num_batches)]
+
+    random.Random(seed).shuffle(paths)
+    needed = batch_size * num_batches
+    images = [preprocess_image(path, preprocessing) for path in (paths * (needed // len(paths) + 1))[:needed]]
+    return [np.stack(images[i:i + batch_size]) for i in range(0, needed, batch_size)]
+
+
+def measure_config(model_source, settings, num_sessions, batches, iterations=30, warmup=3):
+    """测量一个配置：num_sessions个会话在各自线程中并发推理，返回单次推理延迟分位数和吞吐(图像/秒)"""
+    sessions = [ort.InferenceSession(model_source, create_session_options(settings),
+                                     providers=['CPUExecutionProvider']) for _ in range(num_sessions)]
+    input_name = sessions[0].get_inputs()[0].name
+    latencies = [[] for _ in sessions]
+
+    def run(index):
+        session = sessions[index]
+        for i in range(warmup):
+            session.run(None, {input_name: batches[i % len(batches)]})
+        barrier.wait()
+        for i in range(iterations):
+            start = time.perf_counter()
+            session.run(None, {input_name: batches[(i + index) % len(batches)]})
+            latencies[index].append(time.perf_counter() - start)
+
+    barrier = threading.Barrier(num_sessions + 1)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(num_sessions)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_latencies = np.concatenate(latencies) * 1000
+    images = num_sessions * iterations * len(batches[0])
+    return {
+        'p50_ms': float(np.percentile(all_latencies, 50)),
+        'p99_ms': float(np.percentile(all_latencies, 99)),
+        'throughput': images / elapsed
+    }
+
+
+def _improves(result, best, objective, min_gain):
+    """result比best好min_gain（相对值）以上才替换，避免测量抖动导致来回切换配置"""
+    if objective == 'throughput':
+        return result['throughput'] > best['throughput'] * (1 + min_gain)
+    key = f'{objective}_ms'
+    return result[key] < best[key] * (1 - min_gain)
+
+
+def _powers_of_two(limit):
+    values = [1]
+    while values[-1] * 2 <= limit:
+        values.append(values[-1] * 2)
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+def candidate_stages(cpu_count):
+    """各阶段的候选参数，每个候选为(会话配置的修改, 会话数)"""
+    thread_counts = _powers_of_two(cpu_count)
+    threads_stage = []
+    for sessions in _powers_of_two(cpu_count):
+        for threads in thread_counts:
+            if sessions * threads <= cpu_count:
+                threads_stage.append(({'intra_op_num_threads': threads}, sessions))
+    return [
+        ('threads', threads_stage),
+        ('graph_optimization_level', [({'graph_optimization_level': level}, None)
+                                      for level in GRAPH_OPTIMIZATION_LEVELS]),
+        ('execution_mode', [({'execution_mode': 'sequential', 'inter_op_num_threads': 1}, None)] +
+                           [({'execution_mode': 'parallel', 'inter_op_num_threads': threads}, None)
+                            for threads in _powers_of_two(min(4, cpu_count))]),
+        ('memory', [({'enable_cpu_mem_arena': arena, 'enable_mem_pattern': pattern}, None)
+                    for arena in (True, False) for pattern in (True, False)])
+    ]
+
+
+def autotune_session(model_source, batches, objective='throughput', cpu_count=None, iterations=30, min_gain=0.03):
+    """按阶段搜索会话配置，返回(最优结果, 全部试验)"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    best = {'session_options': dict(BASE_SETTINGS), 'num_sessions': 1}
+    best.update(measure_config(model_source, best['session_options'], 1, batches, iterations))
+    trials = [dict(best, stage='baseline')]
+    print(f"基线: p50 {best['p50_ms']:.1f}ms, p99 {best['p99_ms']:.1f}ms, {best['throughput']:.1f} 图像/秒")
+
+    for stage, candidates in candidate_stages(cpu_count):
+        print(f"阶段 {stage}: {len(candidates)} 个候选")
+        stage_best = best
+        for changes, sessions in candidates:
+            settings = {**best['session_options'], **changes}
+            num_sessions = sessions or best['num_sessions']
+            if settings == best['session_options'] and num_sessions == best['num_sessions']:
+                continue
+            result = measure_config(model_source, settings, num_sessions, batches, iterations)
+            trial = {'session_options': settings, 'num_sessions': num_sessions, **result}
+            trials.append(dict(trial, stage=stage))
+            print(f"  {changes} × {num_sessions}会话: p50 {result['p50_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms, "
+                  f"{result['throughput']:.1f} 图像/秒")
+            if _improves(result, stage_best, objective, min_gain):
+                stage_best = trial
+        best = stage_best
+    return best, trials
+
+
+def update_metadata_runtime(metadata_path, runtime):
+    """把调优结果写入已有的metadata.json"""
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    metadata.setdefault('runtime', {})['onnxruntime'] = runtime
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    print(f"会话调优结果已写入: {metadata_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='onnxruntime会话配置自动调优（结果写入metadata.json）')
+    parser.add_argument('--model_dir', type=str, default=DEFAULT_MODEL_DIR,
+                       help='模型目录（包含metadata.json和ONNX模型）')
+    parser.add_argument('--model_file', type=str, default=None,
+                       help='ONNX模型文件名（默认resnet18_identity.onnx）')
+    parser.add_argument('--dataset_path', type=str, default='../public/dataset',
+                       help='代表性输入的数据集路径')
+    parser.add_argument('--batch_size', type=int, default=1,
+                       help='每次推理的batch大小（闸机逐帧识别为1，批量打分可设为64）')
+    parser.add_argument('--iterations', type=int, default=30,
+                       help='每个配置每个会话的推理次数')
+    parser.add_argument('--objective', type=str, default='throughput', choices=OBJECTIVES,
+                       help='优化目标：吞吐，或单次推理延迟的p50/p99')
+    parser.add_argument('--max_threads', type=int, default=None,
+                       help='参与调优的最大核心数（默认本机全部核心）')
+    parser.add_argument('--min_gain', type=float, default=0.03,
+                       help='候选配置至少好于当前最优的相对比例才采用（过滤测量抖动）')
+    parser.add_argument('--dry_run', action='store_true',
+                       help='只打印结果，不写入metadata.json')
+
+    args = parser.parse_args()
+    metadata = load_metadata(args.model_dir)
+    model_source = resolve_model_source(args.model_dir, args.model_file)
+    batches = load_representative_batches(args.dataset_path, metadata['preprocessing'], args.batch_size)
+
+    best, trials = autotune_session(model_source, batches, args.objective, args.max_threads, args.iterations,
+                                    args.min_gain)
+    baseline = trials[0]
+    print(f"\n最优配置: {best['session_options']}, {best['num_sessions']} 个会话")
+    print(f"  p50 {best['p50_ms']:.1f}ms, p99 {best['p99_ms']:.1f}ms, {best['throughput']:.1f} 图像/秒 "
+          f"(基线 {baseline['throughput']:.1f} 图像/秒)")
+
+    runtime = {
+        'session_options': best['session_options'],
+        'num_sessions': best['num_sessions'],
+        'batch_size': args.batch_size,
+        'objective': args.objective,
+        'p50_ms': best['p50_ms'],
+        'p99_ms': best['p99_ms'],
+        'throughput': best['throughput'],
+        'machine': machine_signature(),
+        'tuned_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    if not args.dry_run:
+        update_metadata_runtime(os.path.join(args.model_dir, 'metadata.json'), runtime)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+预测结果缓存（不依赖PyTorch）
+演示页和展示页反复提交dataset_index.json中的同一批时频图，闸机重试也会重发相同的帧，
+对相同输入重复运行ResNet18没有意义。本模块按"模型哈希 + 预处理后输入字节"的哈希缓存模型输出（logits、嵌入向量）：
+  - 内存中按LRU淘汰，可限制条目数和总字节数
+  - 可选持久化到SQLite文件，重启后继续命中（只载入上限内最近使用的条目）；打开时模型哈希不一致（模型文件已更新）则自动清空
+  - 同一模型的不同输出变体（例如额外暴露嵌入向量的图）按变体名区分条目，共用一个缓存文件时互不影响
+  - 统计命中率
+"""
+
+import io
+import os
+import sqlite3
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# 持久化时每累计这么多次写入提交一次事务
+COMMIT_EVERY = 64
+# 调用方默认的缓存条目数上限
+DEFAULT_CACHE_SIZE = 10000
+
+
+def input_key(array, variant=''):
+    """预处理后输入的哈希（含形状和类型，避免不同分辨率的输入字节恰好相同）
+
+    variant: 输出变体名（例如暴露为额外输出的嵌入张量名），不同变体的条目互不覆盖
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{variant}|{array.dtype.str}{array.shape}'.encode())
+    digest.update(array.data)
+    return digest.digest()
+
+
+def _encode(outputs):
+    buffer = io.BytesIO()
+    np.savez(buffer, **outputs)
+    return buffer.getvalue()
+
+
+def _decode(blob):
+    with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def cached_run(session, input_name, output_names, batch, cache, variant=''):
+    """带缓存的session.run：只对未命中的输入运行模型，返回与session.run相同的输出列表
+
+    缓存中按输出名保存，同一模型的不同调用方（推理服务、批量打分）可以共用一个缓存文件；
+    修改过的图（额外输出嵌入向量）通过variant区分。
+    """
+    if cache is None:
+        return session.run(output_names, {input_name: batch})
+    keys = [input_key(item, variant) for item in batch]
+    cached = [cache.get(key, output_names) for key in keys]
+    misses = [i for i, outputs in enumerate(cached) if outputs is None]
+    if misses:
+        results = session.run(output_names, {input_name: batch[misses]})
+        for row, i in enumerate(misses):
+            cached[i] = {name: result[row] for name, result in zip(output_names, results)}
+            cache.put(keys[i], cached[i])
+    return [np.stack([outputs[name] for outputs in cached]) for name in output_names]
+
+
+class PredictionCache:
+    """按输入内容哈希缓存模型输出，线程安全
+
+    用法:
+        cache = PredictionCache(model_fingerprint(model_source), max_entries=DEFAULT_CACHE_SIZE, path='cache.sqlite')
+        key = input_key(preprocessed)
+        outputs = cache.get(key)               # 未命中返回None
+        if outputs is None:
+            cache.put(key, {'logits': logits})
+        print(cache.stats())
+    """
+
+    def __init__(self, model_hash, max_entries=DEFAULT_CACHE_SIZE, max_bytes=0, path=None):
+        """max_entries/max_bytes: 条目数和总字节数上限，0表示不限制；path: SQLite持久化文件（至少需要一个上限）"""
+        if path and not (max_entries or max_bytes):
+            raise ValueError("持久化的预测缓存需要条目数或字节数上限")
+        self.model_hash = model_hash
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = self._open_db(path) if path else None
+
+    def _open_db(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        db.execute('CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, value BLOB, last_used INTEGER)')
+        row = db.execute("SELECT value FROM meta WHERE name = 'model_hash'").fetchone()
+        if row is None or row[0] != self.model_hash:
+            if row is not None:
+                print(f"模型已更新，清空预测缓存: {path}")
+            db.execute('DELETE FROM entries')
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('model_hash', ?)", (self.model_hash,))
+            db.commit()
+            return db
+
+        # 从最近使用的条目开始载入，达到上限即停止，更旧的条目直接删除（内存占用不随文件大小增长）
+        loaded = []
+        cutoff = None
+        for key, value, last_used in db.execute('SELECT key, value, last_used FROM entries ORDER BY last_used DESC'):
+            if ((self.max_entries and len(loaded) >= self.max_entries) or
+                    (self.max_bytes and self._bytes + len(value) > self.max_bytes)):
+                cutoff = last_used
+                break
+            loaded.append((key, value))
+            self._bytes += len(value)
+            self._clock = max(self._clock, last_used)
+        for key, value in reversed(loaded):
+            self._entries[key] = value
+        if cutoff is not None:
+            db.execute('DELETE FROM entries WHERE last_used <= ?', (cutoff,))
+        db.commit()
+        print(f"已载入预测缓存: {path}, {len(self._entries)} 条")
+        return db
+
+    def _evict(self):
+        evicted = []
+        while self._entries and ((self.max_entries and len(self._entries) > self.max_entries) or
+                                 (self.max_bytes and self._bytes > self.max_bytes)):
+            key, value = self._entries.popitem(last=False)
+            self._bytes -= len(value)
+            evicted.append(key)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _write(self, statement, rows):
+        self._db.executemany(statement, rows)
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_EVERY:
+            self._db.commit()
+            self._pending_writes = 0
+
+    def get(self, key, names=None):
+        """返回缓存的输出字典；names指定需要的输出名，缓存中缺少任一输出视为未命中"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                outputs = _decode(value)
+                if names is None or all(name in outputs for name in names):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    if self._db is not None:
+                        self._clock += 1
+                        self._write('UPDATE entries SET last_used = ? WHERE key = ?', [(self._clock, key)])
+                    return outputs
+            self.misses += 1
+            return None
+
+    def put(self, key, outputs):
+        value = _encode(outputs)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = value
+            self._bytes += len(value)
+            evicted = self._evict()
+            if self._db is not None:
+                # last_used为访问序号，重启后按此恢复LRU顺序
+                self._clock += 1
+                self._write('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', [(key, value, self._clock)])
+                if evicted:
+                    self._write('DELETE FROM entries WHERE key = ?', [(k,) for k in evicted])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM entries')
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查看或清空持久化的预测缓存')
+    parser.add_argument('path', type=str,
+                       help='SQLite缓存文件')
+    parser.add_argument('--clear', action='store_true',
+                       help='清空缓存')
+
+    args = parser.parse_args()
+    db = sqlite3.connect(args.path)
+    row = db.execute("SELECT value FROM meta WHERE name = 'model_hash'").fetchone()
+    count, size = db.execute('SELECT COUNT(*), IFNULL(SUM(LENGTH(value)), 0) FROM entries').fetchone()
+    print(f"模型哈希: {row[0] if row else '无'}")
+    print(f"缓存条目: {count}, {size / 1024 / 1024:.2f} MB")
+    if args.clear:
+        db.execute('DELETE FROM entries')
+        db.commit()
+        db.execute('VACUUM')
+        print("缓存已清空")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+渐进分辨率训练
+微多普勒时频图中区分身份的粗粒度结构在低分辨率下已经可见。前期epoch以较低分辨率（如112、160）和较大batch训练，
+最后若干epoch恢复部署分辨率，以缩短总训练时间；验证集始终使用部署分辨率。
+每个分辨率阶段使用独立的DataLoader：图像在worker中直接解码并缩放到该阶段的分辨率
+（常驻worker持有数据集副本，修改主进程中数据集的transform不会生效，所以切换阶段时重建DataLoader）。
+"""
+
+import copy
+import time
+
+from torch.utils.data import DataLoader
+
+
+def parse_resize_schedule(spec, num_epochs, final_size, base_batch_size):
+    """解析分辨率阶段，如 '112:0.3,160:0.3' 或 '112:20:32,160:20'
+
+    每段为 分辨率:epoch数[:batch大小]，epoch数小于1时表示占总epoch数的比例；
+    未指定batch大小时按像素数反比放大（显存占用与部署分辨率相近）。剩余epoch使用部署分辨率和原batch大小。
+    返回阶段列表 [{'size', 'batch_size', 'start_epoch', 'end_epoch'}]
+    """
+    phases = []
+    start = 0
+    for item in spec.split(','):
+        parts = item.strip().split(':')
+        if len(parts) not in (2, 3):
+            raise ValueError(f"无法解析分辨率阶段 '{item}'，格式为 分辨率:epoch数[:batch大小]")
+        size = int(parts[0])
+        if size > final_size:
+            raise ValueError(f"阶段分辨率 {size} 大于部署分辨率 {final_size}")
+        length = float(parts[1])
+        epochs = int(round(length * num_epochs)) if length < 1 else int(length)
+        batch_size = int(parts[2]) if len(parts) == 3 else max(base_batch_size,
+                                                               base_batch_size * final_size ** 2 // size ** 2)
+        if epochs > 0:
+            phases.append({'size': size, 'batch_size': batch_size, 'start_epoch': start, 'end_epoch': start + epochs})
+            start += epochs
+    if start >= num_epochs:
+        raise ValueError(f"低分辨率阶段共 {start} 个epoch，至少需要为部署分辨率保留1个epoch（总共 {num_epochs}）")
+    phases.append({'size': final_size, 'batch_size': base_batch_size, 'start_epoch': start, 'end_epoch': num_epochs})
+    return phases
+
+
+class ProgressiveResize:
+    """按epoch提供对应分辨率阶段的训练DataLoader
+
+    transform_factory(size) 返回该分辨率的训练transform；其余DataLoader参数（num_workers、sampler等）与原训练集一致。
+    """
+
+    def __init__(self, phases, transform_factory, sampler=None, **loader_kwargs):
+        self.phases = phases
+        self.transform_factory = transform_factory
+        self.sampler = sampler
+        self.loader_kwargs = loader_kwargs
+        self._phase = None
+        self._loader = None
+        self._phase_start = None
+        self.phase_seconds = [0.0] * len(phases)
+
+    def phase_for_epoch(self, epoch):
+        for index, phase in enumerate(self.phases):
+            if phase['start_epoch'] <= epoch < phase['end_epoch']:
+                return index
+        return len(self.phases) - 1
+
+    def loader_for_epoch(self, epoch, base_loader):
+        """返回该epoch使用的训练DataLoader；部署分辨率阶段直接使用base_loader"""
+        index = self.phase_for_epoch(epoch)
+        if index != self._phase:
+            phase = self.phases[index]
+            # 释放上一阶段的常驻worker
+            self._loader = None
+            if index == len(self.phases) - 1:
+                self._loader = base_loader
+            else:
+                dataset = copy.copy(base_loader.dataset)
+                dataset.transform = self.transform_factory(phase['size'])
+                self._loader = DataLoader(dataset, batch_size=phase['batch_size'], shuffle=self.sampler is None,
+                                          sampler=self.sampler, **self.loader_kwargs)
+            self._phase = index
+            print(f"分辨率阶段 {index + 1}/{len(self.phases)}: {phase['size']}x{phase['size']}, "
+                  f"batch {phase['batch_size']}, epoch {phase['start_epoch'] + 1}-{phase['end_epoch']}")
+        # 跳过简单样本的采样器按batch大小把逐样本损失写回数据集位置
+        if self.sampler is not None:
+            self.sampler.batch_size = self.phases[index]['batch_size']
+            self.sampler.phase = index
+        self._phase_start = time.perf_counter()
+        return self._loader
+
+    def end_epoch(self):
+        self.phase_seconds[self._phase] += time.perf_counter() - self._phase_start
+
+    def summary(self):
+        return [dict(phase, train_seconds=seconds) for phase, seconds in zip(self.phases, self.phase_seconds)]
+
+    def __repr__(self):
+        return 'ProgressiveResize(' + ', '.join(
+            f"{p['size']}px×{p['end_epoch'] - p['start_epoch']}ep(batch {p['batch_size']})" for p in self.phases) + ')'
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+ResNet18结构化通道剪枝脚本
+对训练好的模型在layer2-layer4的残差块内部按重要性剪除卷积通道（同步裁剪BatchNorm和下游卷积的输入通道），
+直到满足FLOPs或延迟预算，然后微调若干轮，输出真正更小的稠密模型
+"""
+
+import os
+import json
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+
+from spectrogram_preprocessing import get_input_shape
+
+# 参与剪枝的残差阶段
+PRUNABLE_LAYERS = ('layer2', 'layer3', 'layer4')
+
+
+def get_resnet_trunk(model):
+    """返回模型中的ResNet主干（对比学习模型为backbone，标准模型为自身）"""
+    return model.backbone if hasattr(model, 'backbone') else model
+
+
+def iter_prunable_blocks(trunk):
+    """遍历可剪枝的BasicBlock，返回(名称, block)
+
+    只裁剪block内部conv1的输出通道：这些通道只被bn1和conv2使用，
+    不影响残差连接两侧的通道数，因此无需改动downsample和相邻block。
+    """
+    for layer_name in PRUNABLE_LAYERS:
+        for block_idx, block in enumerate(getattr(trunk, layer_name)):
+            yield f'{layer_name}.{block_idx}', block
+
+
+def count_flops(model, input_size=None):
+    """统计卷积层和全连接层的乘加次数(MACs)"""
+    input_size = input_size or get_input_shape(getattr(model, 'preprocessing', None))
+    total = [0]
+
+    def conv_hook(module, inputs, output):
+        kernel_ops = module.kernel_size[0] * module.kernel_size[1] * (module.in_channels // module.groups)
+        total[0] += output.numel() * kernel_ops
+
+    def linear_hook(module, inputs, output):
+        total[0] += module.in_features * module.out_features * (output.numel() // module.out_features)
+
+    handles = []
+    for module in model.modules():
+        if isinstance(module, nn.Conv2d):
+            handles.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, nn.Linear):
+            handles.append(module.register_forward_hook(linear_hook))
+
+    was_training = model.training
+    model.eval()
+    device = next(model.parameters()).device
+    with torch.no_grad():
+        model(torch.zeros(input_size, device=device))
+    model.train(was_training)
+
+    for handle in handles:
+        handle.remove()
+    return total[0]
+
+
+def measure_latency_ms(model, input_size=None, runs=20):
+    """CPU单帧推理延迟中位数(ms)"""
+    input_size = input_size or get_input_shape(getattr(model, 'preprocessing', None))
+    model = model.to('cpu')
+    model.eval()
+    dummy_input = torch.randn(input_size)
+    timings = []
+    with torch.no_grad():
+        for _ in range(3):
+            model(dummy_input)
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(dummy_input)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def filter_importance(block):
+    """conv1输出通道的重要性：滤波器L1范数 × |BN缩放系数|"""
+    weight_norm = block.conv1.weight.detach().abs().sum(dim=(1, 2, 3))
+    bn_scale = block.bn1.weight.detach().abs()
+    return weight_norm * bn_scale
+
+
+def _new_conv(conv, in_channels, out_channels):
+    return nn.Conv2d(in_channels, out_channels, kernel_size=conv.kernel_size, stride=conv.stride,
+                     padding=conv.padding, dilation=conv.dilation, groups=conv.groups,
+                     bias=conv.bias is not None)
+
+
+def resize_block(block, channels):
+    """按给定的中间通道数重建block的conv1/bn1/conv2（权重未初始化，用于加载剪枝后的检查点）"""
+    block.conv1 = _new_conv(block.conv1, block.conv1.in_channels, channels)
+    block.bn1 = nn.BatchNorm2d(channels)
+    block.conv2 = _new_conv(block.conv2, channels, block.conv2.out_channels)
+
+
+def prune_block(block, keep_indices):
+    """物理删除block中conv1的输出通道，并同步裁剪bn1和conv2的输入通道"""
+    keep_indices = keep_indices.sort().values
+    old_conv1, old_bn1, old_conv2 = block.conv1, block.bn1, block.conv2
+    requires_grad = old_conv1.weight.requires_grad
+
+    resize_block(block, len(keep_indices))
+    with torch.no_grad():
+        block.conv1.weight.copy_(old_conv1.weight[keep_indices])
+        block.bn1.weight.copy_(old_bn1.weight[keep_indices])
+        block.bn1.bias.copy_(old_bn1.bias[keep_indices])
+        block.bn1.running_mean.copy_(old_bn1.running_mean[keep_indices])
+        block.bn1.running_var.copy_(old_bn1.running_var[keep_indices])
+        block.bn1.num_batches_tracked.copy_(old_bn1.num_batches_tracked)
+        block.conv2.weight.copy_(old_conv2.weight[:, keep_indices])
+
+    # 保持原有的冻结/解冻设置
+    for module in (block.conv1, block.bn1, block.conv2):
+        for param in module.parameters():
+            param.requires_grad = requires_grad
+    block.to(old_conv1.weight.device)
+
+
+def apply_channel_config(model, channel_config):
+    """根据检查点中的pruned_channels重建剪枝后的结构"""
+    trunk = get_resnet_trunk(model)
+    for name, block in iter_prunable_blocks(trunk):
+        if name in channel_config:
+            resize_block(block, channel_config[name])
+    model.pruned_channels = dict(channel_config)
+    return model
+
+
+def get_channel_config(model):
+    """当前模型各可剪枝block的中间通道数"""
+    return {name: block.conv1.out_channels for name, block in iter_prunable_blocks(get_resnet_trunk(model))}
+
+
+def prune_step(model, fraction, min_channels=8):
+    """一轮全局剪枝：按层内归一化后的重要性，剪掉全部可剪枝通道中最不重要的fraction比例"""
+    trunk = get_resnet_trunk(model)
+    blocks = dict(iter_prunable_blocks(trunk))
+
+    candidates = []
+    for name, block in blocks.items():
+        scores = filter_importance(block)
+        # 不同层的数值尺度不同，按层均值归一化后再做全局排序
+        scores = scores / (scores.mean() + 1e-12)
+        for channel, score in enumerate(scores.tolist()):
+            candidates.append((score, name, channel))
+
+    num_to_prune = max(1, int(len(candidates) * fraction))
+    candidates.sort()
+
+    removed = {name: set() for name in blocks}
+    pruned = 0
+    for score, name, channel in candidates:
+        if pruned >= num_to_prune:
+            break
+        remaining = blocks[name].conv1.out_channels - len(removed[name])
+        if remaining <= min_channels:
+            continue
+        removed[name].add(channel)
+        pruned += 1
+
+    for name, block in blocks.items():
+        if removed[name]:
+            keep = [c for c in range(block.conv1.out_channels) if c not in removed[name]]
+            prune_block(block, torch.tensor(keep, dtype=torch.long))
+
+    model.pruned_channels = get_channel_config(model)
+    return pruned
+
+
+def prune_to_budget(model, target_flops_ratio=None, target_latency_ms=None, step_fraction=0.05, min_channels=8):
+    """迭代剪枝直到FLOPs比例或CPU延迟满足预算"""
+    base_flops = count_flops(model)
+    print(f"剪枝前FLOPs: {base_flops / 1e9:.3f} GMACs")
+
+    for iteration in range(1, 100):
+        flops = count_flops(model)
+        if target_flops_ratio is not None and flops <= base_flops * target_flops_ratio:
+            break
+        if target_latency_ms is not None:
+            latency = measure_latency_ms(model)
+            if latency <= target_latency_ms:
+                break
+        pruned = prune_step(model, step_fraction, min_channels)
+        if pruned == 0:
+            print("所有block均已达到最小通道数，停止剪枝")
+            break
+        print(f"  第{iteration}轮: 剪除 {pruned} 个通道, FLOPs {count_flops(model) / base_flops:.1%}")
+
+    return model
+
+
+def main():
+    from torch.utils.data import DataLoader
+    from sklearn.model_selection import train_test_split
+    from train_resnet18 import (GaitDataset, load_dataset, create_data_transforms, get_image_mode, train_model,
+                                measure_model_profile, save_model_for_web)
+    from convert_to_tfjs import load_pytorch_model
+
+    parser = argparse.ArgumentParser(description='ResNet18结构化通道剪枝')
+    parser.add_argument('--model_path', type=str,
+                       default='../public/models/resnet18_identity/resnet18_identity.pth',
+                       help='训练好的模型检查点')
+    parser.add_argument('--dataset_path', type=str, default='../dataset',
+                       help='数据集路径（用于微调和评估）')
+    parser.add_argument('--target_flops_ratio', type=float, default=0.5,
+                       help='剪枝后FLOPs占原模型的目标比例')
+    parser.add_argument('--target_latency_ms', type=float, default=None,
+                       help='CPU单帧延迟预算(ms)，指定后以延迟为剪枝目标')
+    parser.add_argument('--step_fraction', type=float, default=0.05,
+                       help='每轮剪除的通道比例')
+    parser.add_argument('--min_channels', type=int, default=8,
+                       help='每个block至少保留的通道数')
+    parser.add_argument('--finetune_epochs', type=int, default=4,
+                       help='剪枝后微调轮数')
+    parser.add_argument('--batch_size', type=int, default=8,
+                       help='批次大小')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='DataLoader worker数')
+    parser.add_argument('--learning_rate', type=float, default=0.0001,
+                       help='微调学习率')
+    parser.add_argument('--save_path', type=str, default='../public/models/resnet18_identity_pruned',
+                       help='剪枝模型保存路径')
+    parser.add_argument('--trust_checkpoint', action='store_true',
+                       help='允许加载包含权重以外Python对象的检查点（会执行其中的代码，仅用于可信来源）')
+
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f"使用设备: {device}")
+
+    model, class_names = load_pytorch_model(args.model_path, trust_checkpoint=args.trust_checkpoint)
+    is_contrastive = hasattr(model, 'embedding')
+
+    image_paths, labels, _ = load_dataset(args.dataset_path)
+    if len(image_paths) == 0:
+        print("错误: 未找到任何图像文件")
+        return
+    train_paths, val_paths, train_labels, val_labels = train_test_split(
+        image_paths, labels, test_size=0.15, random_state=42, stratify=labels
+    )
+    preprocessing = model.preprocessing
+    train_transform, val_transform = create_data_transforms(preprocessing['input_mode'], preprocessing['resize'][0])
+    image_mode = get_image_mode(preprocessing['input_mode'])
+    train_dataset = GaitDataset(train_paths, train_labels, train_transform, contrastive_mode=is_contrastive,
+                                image_mode=image_mode)
+    val_dataset = GaitDataset(val_paths, val_labels, val_transform, contrastive_mode=False, image_mode=image_mode)
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.workers)
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.workers)
+
+    print("\n评估原始模型...")
+    original_profile = measure_model_profile(model, val_loader, device)
+    original_flops = count_flops(model.to('cpu'))
+
+    target_flops_ratio = None if args.target_latency_ms is not None else args.target_flops_ratio
+    print("\n开始结构化剪枝...")
+    prune_to_budget(model.to('cpu'), target_flops_ratio, args.target_latency_ms,
+                    args.step_fraction, args.min_channels)
+    print(f"剪枝后通道配置: {model.pruned_channels}")
+
+    if args.finetune_epochs > 0:
+        print(f"\n微调 {args.finetune_epochs} 轮...")
+        model, _ = train_model(
+            model=model,
+            train_loader=train_loader,
+            val_loader=val_loader,
+            num_epochs=args.finetune_epochs,
+            learning_rate=args.learning_rate,
+            device=device,
+            contrastive_learning=is_contrastive
+        )
+
+    pruned_profile = measure_model_profile(model, val_loader, device)
+    pruned_flops = count_flops(model.to('cpu'))
+
+    save_model_for_web(model, class_names, args.save_path)
+
+    report = {
+        'source_model': args.model_path,
+        'pruned_channels': model.pruned_channels,
+        'original': dict(original_profile, gmacs=original_flops / 1e9),
+        'pruned': dict(pruned_profile, gmacs=pruned_flops / 1e9),
+        'flops_ratio': pruned_flops / original_flops
+    }
+    report_path = os.path.join(args.save_path, 'pruning_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{'='*70}")
+    print("✂️  结构化剪枝报告")
+    print(f"{'='*70}")
+    print(f"{'模型':<10}{'验证准确率':>12}{'GMACs':>10}{'参数量(M)':>12}{'ONNX(MB)':>12}{'P50延迟(ms)':>14}")
+    for name, profile, flops in (('原始', original_profile, original_flops), ('剪枝后', pruned_profile, pruned_flops)):
+        print(f"{name:<10}{profile['val_accuracy']:>11.2f}%{flops / 1e9:>10.3f}{profile['num_parameters'] / 1e6:>12.2f}"
+              f"{profile['onnx_size_mb']:>12.2f}{profile['cpu_latency_ms_p50']:>14.2f}")
+    print(f"剪枝报告已保存到: {report_path}")
+
+
+if __name__ == '__main__':
+    main()
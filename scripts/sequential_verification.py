@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+序贯式身份验证策略（SPRT风格的提前终止）
+逐帧累加经过温度校准的对数似然，一旦达到接受或拒绝边界立即给出决策，
+置信度很高的通行只需1帧，不再固定识别3帧。
+附带离线仿真器：在数据集的连续帧序列上统计不同边界下的平均帧数、延迟和准确率，用于选择边界参数。
+"""
+
+import os
+import re
+import json
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+
+def log_softmax(logits, axis=-1):
+    logits = np.asarray(logits, dtype=np.float64)
+    shifted = logits - logits.max(axis=axis, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=axis, keepdims=True))
+
+
+def fit_temperature(logits, labels, temperatures=None):
+    """温度缩放校准：在验证集logits上搜索使负对数似然最小的温度"""
+    logits = np.asarray(logits, dtype=np.float64)
+    labels = np.asarray(labels, dtype=np.int64)
+    if temperatures is None:
+        temperatures = np.exp(np.linspace(np.log(0.05), np.log(20.0), 200))
+
+    best_temperature, best_nll = 1.0, np.inf
+    for temperature in temperatures:
+        nll = -log_softmax(logits / temperature)[np.arange(len(labels)), labels].mean()
+        if nll < best_nll:
+            best_temperature, best_nll = float(temperature), nll
+    return best_temperature
+
+
+class SequentialVerifier:
+    """逐帧序贯决策器
+
+    对每个身份c维护累计对数似然 sum_t log p(c | x_t)，在均匀先验下得到后验p(c | x_1..t)。
+    检验 H1: 身份为c  vs  H0: 身份不是c，对数几率 log(p_c / (1 - p_c))：
+      >= accept_log_odds  → 接受（通行）
+      <= reject_log_odds  → 拒绝
+      达到max_frames仍未越界 → 拒绝（证据不足）
+    指定claimed_id时检验该身份，否则检验当前后验最大的身份。
+    注意：不指定claimed_id时最大后验不低于1/K，对数几率不会低于log(1/(K-1))，
+    拒绝边界需高于该值才会生效（10个身份时约为-2.2）。
+    """
+
+    def __init__(self, temperature=1.0, accept_log_odds=4.6, reject_log_odds=-4.6,
+                 min_frames=1, max_frames=5, claimed_id=None):
+        self.temperature = temperature
+        self.accept_log_odds = accept_log_odds
+        self.reject_log_odds = reject_log_odds
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.claimed_id = claimed_id
+        self.reset()
+
+    def reset(self):
+        self.cumulative = None
+        self.frames = 0
+
+    def get_policy(self):
+        """写入metadata.json的策略参数"""
+        return {
+            'type': 'sprt',
+            'temperature': self.temperature,
+            'accept_log_odds': self.accept_log_odds,
+            'reject_log_odds': self.reject_log_odds,
+            'min_frames': self.min_frames,
+            'max_frames': self.max_frames
+        }
+
+    @classmethod
+    def from_policy(cls, policy, claimed_id=None):
+        params = {k: v for k, v in policy.items() if k != 'type'}
+        return cls(claimed_id=claimed_id, **params)
+
+    def update(self, logits):
+        """输入一帧的logits，返回当前决策"""
+        frame_log_probs = log_softmax(np.asarray(logits).reshape(-1) / self.temperature)
+        self.cumulative = frame_log_probs if self.cumulative is None else self.cumulative + frame_log_probs
+        self.frames += 1
+
+        posterior_log = log_softmax(self.cumulative)
+        class_index = int(np.argmax(posterior_log)) if self.claimed_id is None else self.claimed_id
+        log_p = posterior_log[class_index]
+        # log(p / (1 - p))，用log1p(-exp)保证p接近1时的数值稳定
+        log_odds = float(log_p - np.log(-np.expm1(min(log_p, -1e-12))))
+
+        decision = 'continue'
+        if self.frames >= self.min_frames:
+            if log_odds >= self.accept_log_odds:
+                decision = 'accept'
+            elif log_odds <= self.reject_log_odds or self.frames >= self.max_frames:
+                decision = 'reject'
+
+        return {
+            'decision': decision,
+            'class_index': class_index,
+            'posterior': float(np.exp(log_p)),
+            'log_odds': log_odds,
+            'frames': self.frames
+        }
+
+
+def run_sequence(verifier, frame_logits):
+    """对一个帧序列运行序贯决策，返回最终决策"""
+    verifier.reset()
+    result = None
+    for logits in frame_logits:
+        result = verifier.update(logits)
+        if result['decision'] != 'continue':
+            break
+    return result
+
+
+def fixed_consistency_policy(frame_logits, required_images=3, confidence_threshold=0.7):
+    """原有策略：固定识别required_images帧，全部一致且平均置信度达标才通过"""
+    frames = frame_logits[:required_images]
+    probs = np.exp(log_softmax(frames))
+    predictions = probs.argmax(axis=1)
+    consistent = bool((predictions == predictions[0]).all())
+    confidence = float(probs.max(axis=1).mean())
+    accepted = consistent and confidence >= confidence_threshold
+    return {
+        'decision': 'accept' if accepted else 'reject',
+        'class_index': int(predictions[0]),
+        'frames': len(frames)
+    }
+
+
+def group_walk_sequences(image_paths, labels):
+    """按行走序列分组（ID1_case1_1_Doppler12.jpg → ID1_case1_1），组内按帧号排序"""
+    walks = defaultdict(list)
+    for position, path in enumerate(image_paths):
+        name = os.path.splitext(os.path.basename(path))[0]
+        match = re.match(r'(.+)_Doppler(\d+)$', name)
+        walk, frame = (match.group(1), int(match.group(2))) if match else (name, 0)
+        walks[(labels[position], walk)].append((frame, position))
+    return {key: [position for _, position in sorted(frames)] for key, frames in walks.items()}
+
+
+def sample_sequences(walks, sequence_length, sequences_per_walk, seed=42):
+    """从每个行走序列中随机截取连续帧窗口，返回[(label, [位置索引])]"""
+    rng = np.random.default_rng(seed)
+    sequences = []
+    for (label, _), positions in sorted(walks.items()):
+        if len(positions) < sequence_length:
+            continue
+        starts = rng.integers(0, len(positions) - sequence_length + 1, size=sequences_per_walk)
+        for start in starts:
+            sequences.append((label, positions[start:start + sequence_length]))
+    return sequences
+
+
+def evaluate_policy(decide, logits, sequences, frame_latency_ms):
+    """统计策略在序列集合上的准确率、错误接受率、平均帧数和延迟"""
+    correct = false_accept = rejected = 0
+    frames_used = []
+    for label, positions in sequences:
+        result = decide(logits[positions])
+        frames_used.append(result['frames'])
+        if result['decision'] == 'accept':
+            if result['class_index'] == label:
+                correct += 1
+            else:
+                false_accept += 1
+        else:
+            rejected += 1
+
+    total = len(sequences)
+    mean_frames = float(np.mean(frames_used))
+    return {
+        'accuracy': 100.0 * correct / total,
+        'false_accept_rate': 100.0 * false_accept / total,
+        'reject_rate': 100.0 * rejected / total,
+        'mean_frames': mean_frames,
+        'p95_frames': float(np.percentile(frames_used, 95)),
+        'mean_latency_ms': mean_frames * frame_latency_ms
+    }
+
+
+def simulate_policies(logits, sequences, temperature, accept_bounds, reject_bounds, max_frames,
+                      frame_latency_ms, required_images=3, confidence_threshold=0.7):
+    """扫描接受/拒绝边界组合，并与固定帧数策略对比"""
+    baseline = evaluate_policy(
+        lambda frames: fixed_consistency_policy(frames, required_images, confidence_threshold),
+        logits, sequences, frame_latency_ms
+    )
+    baseline['policy'] = {'type': 'fixed', 'required_images': required_images,
+                          'confidence_threshold': confidence_threshold}
+
+    results = []
+    for accept in accept_bounds:
+        for reject in reject_bounds:
+            verifier = SequentialVerifier(temperature, accept, reject, max_frames=max_frames)
+            metrics = evaluate_policy(lambda frames: run_sequence(verifier, frames),
+                                      logits, sequences, frame_latency_ms)
+            metrics['policy'] = verifier.get_policy()
+            results.append(metrics)
+    return baseline, results
+
+
+def select_policy(baseline, results, max_false_accept_rate=None):
+    """选择平均帧数最少、且准确率和错误接受率不差于固定策略、帧数少于固定策略的边界"""
+    max_false_accept_rate = baseline['false_accept_rate'] if max_false_accept_rate is None else max_false_accept_rate
+    eligible = [r for r in results
+                if r['accuracy'] >= baseline['accuracy'] and r['false_accept_rate'] <= max_false_accept_rate
+                and r['mean_frames'] < baseline['mean_frames']]
+    if not eligible:
+        return None
+    return min(eligible, key=lambda r: (r['mean_frames'], -r['accuracy']))
+
+
+def update_metadata_policy(metadata_path, policy):
+    """把选定的序贯策略写入已有的metadata.json"""
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    usage = metadata.setdefault('usage', {})
+    usage['sequential_policy'] = policy
+    usage['required_images'] = policy['max_frames']
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    print(f"序贯策略已写入: {metadata_path}")
+
+
+def compute_logits(model, image_paths, labels, batch_size=32, device='cpu'):
+    """用PyTorch模型计算所有帧的logits"""
+    import torch
+    from torch.utils.data import DataLoader
+    from train_resnet18 import GaitDataset, create_data_transforms, get_image_mode
+
+    preprocessing = model.preprocessing
+    _, transform = create_data_transforms(preprocessing['input_mode'], preprocessing['resize'][0])
+    dataset = GaitDataset(image_paths, labels, transform, image_mode=get_image_mode(preprocessing['input_mode']))
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=4)
+
+    model = model.to(device)
+    model.eval()
+    outputs = []
+    with torch.no_grad():
+        for images, _ in loader:
+            outputs.append(model(images.to(device)).cpu().numpy())
+    return np.concatenate(outputs)
+
+
+def parse_bounds(text):
+    return [float(value) for value in text.split(',') if value.strip()]
+
+
+def main():
+    from sklearn.model_selection import train_test_split
+    from train_resnet18 import load_dataset
+    from convert_to_tfjs import load_pytorch_model
+    from prune_resnet18 import measure_latency_ms
+
+    parser = argparse.ArgumentParser(description='序贯式提前终止验证策略离线仿真')
+    parser.add_argument('--model_path', type=str,
+                       default='../public/models/resnet18_identity/resnet18_identity.pth',
+                       help='PyTorch模型路径')
+    parser.add_argument('--dataset_path', type=str, default='../dataset',
+                       help='数据集路径（建议使用未参与训练的采集数据）')
+    parser.add_argument('--accept_bounds', type=str, default='1.5,2.2,3.0,4.6,6.9',
+                       help='接受边界(对数几率)候选，逗号分隔')
+    parser.add_argument('--reject_bounds', type=str, default='-0.5,-1.0,-2.0',
+                       help='拒绝边界(对数几率)候选，逗号分隔')
+    parser.add_argument('--max_frames', type=int, default=5,
+                       help='单次决策最多使用的帧数')
+    parser.add_argument('--sequences_per_walk', type=int, default=50,
+                       help='每个行走序列随机截取的仿真序列数')
+    parser.add_argument('--frame_latency_ms', type=float, default=None,
+                       help='单帧推理延迟(ms)，默认在本机CPU上实测')
+    parser.add_argument('--output', type=str, default='sequential_policy_report.json',
+                       help='仿真报告输出路径')
+    parser.add_argument('--update_metadata', type=str, default=None,
+                       help='将选定策略写入该metadata.json')
+    parser.add_argument('--trust_checkpoint', action='store_true',
+                       help='允许加载包含权重以外Python对象的检查点（会执行其中的代码，仅用于可信来源）')
+
+    args = parser.parse_args()
+
+    model, class_names = load_pytorch_model(args.model_path, trust_checkpoint=args.trust_checkpoint)
+    image_paths, labels, dataset_classes = load_dataset(args.dataset_path)
+    if dataset_classes != class_names:
+        print(f"警告: 数据集类别 {dataset_classes} 与模型类别 {class_names} 不一致")
+
+    print("\n计算所有帧的logits...")
+    logits = compute_logits(model, image_paths, labels)
+    labels = np.asarray(labels)
+
+    # 温度在划分出的验证帧上校准
+    _, calibration_idx = train_test_split(np.arange(len(labels)), test_size=0.15, random_state=42, stratify=labels)
+    temperature = fit_temperature(logits[calibration_idx], labels[calibration_idx])
+    print(f"校准温度: {temperature:.3f}")
+
+    frame_latency_ms = args.frame_latency_ms or measure_latency_ms(model)
+    print(f"单帧推理延迟: {frame_latency_ms:.2f} ms")
+
+    walks = group_walk_sequences(image_paths, labels)
+    sequences = sample_sequences(walks, max(args.max_frames, 3), args.sequences_per_walk)
+    print(f"行走序列: {len(walks)} 个, 仿真序列: {len(sequences)} 条")
+
+    baseline, results = simulate_policies(
+        logits, sequences, temperature, parse_bounds(args.accept_bounds), parse_bounds(args.reject_bounds),
+        args.max_frames, frame_latency_ms
+    )
+    selected = select_policy(baseline, results)
+
+    print(f"\n{'接受边界':>10}{'拒绝边界':>10}{'准确率':>10}{'错误接受':>10}{'平均帧数':>10}{'平均延迟(ms)':>14}")
+    print(f"{'固定3帧':>10}{'':>10}{baseline['accuracy']:>9.2f}%{baseline['false_accept_rate']:>9.2f}%"
+          f"{baseline['mean_frames']:>10.2f}{baseline['mean_latency_ms']:>14.2f}")
+    for r in results:
+        marker = ' ←' if r is selected else ''
+        print(f"{r['policy']['accept_log_odds']:>10.2f}{r['policy']['reject_log_odds']:>10.2f}"
+              f"{r['accuracy']:>9.2f}%{r['false_accept_rate']:>9.2f}%{r['mean_frames']:>10.2f}"
+              f"{r['mean_latency_ms']:>14.2f}{marker}")
+
+    report = {
+        'temperature': temperature,
+        'frame_latency_ms': frame_latency_ms,
+        'num_sequences': len(sequences),
+        'baseline': baseline,
+        'results': results,
+        'selected': selected
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n仿真报告已保存到: {args.output}")
+
+    if selected is None:
+        print("⚠️  没有边界组合能在准确率和错误接受率不变差的前提下减少帧数")
+        return
+    print(f"推荐策略: 平均 {selected['mean_frames']:.2f} 帧 (固定策略 {baseline['mean_frames']:.0f} 帧), "
+          f"延迟降低 {1 - selected['mean_latency_ms'] / baseline['mean_latency_ms']:.0%}")
+    if args.update_metadata:
+        update_metadata_policy(args.update_metadata, selected['policy'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+设备端批量时频图数据增强
+在GaitDataset中逐图做PIL增强会拖慢本已受解码限制的DataLoader worker。这里在batch整理并送到训练设备之后
+统一做向量化增强，worker的工作量不变。只提供物理上合理的变换（不做翻转、旋转、色彩抖动）：
+  time_mask     - 时间掩蔽：随机时间段置为背景（遮挡、丢帧）
+  freq_mask     - 频率掩蔽：随机多普勒频段置为背景
+  time_shift    - 时间平移：沿时间轴按整像素小幅平移，移出部分补背景
+  gain          - 增益抖动：按比例缩放回波强度（距离、RCS差异）
+  doppler_scale - 多普勒缩放：沿频率轴以零多普勒行为中心缩放（步速快慢）
+时频图横轴为时间、纵轴为多普勒频率，背景为jet色图的最低强度。
+每个变换可单独配置概率和幅度，使用独立的随机数生成器（固定种子可复现，不影响全局随机状态）。
+"""
+
+import time
+import argparse
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from spectrogram_preprocessing import build_colormap_lut, get_preprocessing_config, jet_colormap
+
+AUGMENTATIONS = ('time_mask', 'freq_mask', 'time_shift', 'gain', 'doppler_scale')
+
+# p为每个样本应用该变换的概率；宽度、平移量为相对图像尺寸的比例
+DEFAULT_AUGMENT_CONFIG = {
+    'time_mask': {'p': 0.5, 'count': 2, 'max_width': 0.1},
+    'freq_mask': {'p': 0.5, 'count': 1, 'max_width': 0.08},
+    'time_shift': {'p': 0.5, 'max_shift': 0.1},
+    'gain': {'p': 0.5, 'min_gain': 0.8, 'max_gain': 1.2},
+    'doppler_scale': {'p': 0.5, 'min_scale': 0.9, 'max_scale': 1.1, 'center': 0.5},
+}
+
+
+def parse_augment_spec(spec):
+    """解析增强配置字符串
+
+    'all'                         → 全部变换，默认参数
+    'time_mask,gain'              → 只启用列出的变换
+    'time_mask:p=0.3:count=3,gain:max_gain=1.5' → 覆盖单个参数
+    'none'或空字符串               → 不增强，返回空字典
+    """
+    if not spec or spec == 'none':
+        return {}
+    if spec == 'all':
+        return {name: dict(params) for name, params in DEFAULT_AUGMENT_CONFIG.items()}
+
+    config = {}
+    for item in spec.split(','):
+        name, *overrides = item.strip().split(':')
+        if name not in DEFAULT_AUGMENT_CONFIG:
+            raise ValueError(f"未知的增强变换: {name}，可选: {AUGMENTATIONS}")
+        params = dict(DEFAULT_AUGMENT_CONFIG[name])
+        for override in overrides:
+            key, value = override.split('=')
+            if key not in params:
+                raise ValueError(f"{name} 没有参数 {key}，可选: {tuple(params)}")
+            params[key] = int(value) if isinstance(params[key], int) else float(value)
+        config[name] = params
+    return config
+
+
+def background_pixel(preprocessing):
+    """各输入模式下“无回波”像素的原始值（[0,1]，每通道一个）"""
+    lowest = jet_colormap(256)[0]
+    if preprocessing['input_mode'] == 'rgb':
+        return lowest.tolist()
+    if preprocessing['input_mode'] == 'gray':
+        # 与PIL的convert('L')相同的亮度公式
+        return [float(np.round(lowest @ np.array([0.299, 0.587, 0.114]) * 255) / 255)]
+    return [0.0]
+
+
+class BatchSpectrogramAugment:
+    """对(N, C, H, W)的归一化batch做向量化增强，只在训练集batch上调用
+
+    用法:
+        augment = BatchSpectrogramAugment(preprocessing, parse_augment_spec('all'), seed=0, device=device)
+        images = augment(images)
+    """
+
+    def __init__(self, preprocessing=None, config=None, seed=0, device='cpu'):
+        self.preprocessing = preprocessing or get_preprocessing_config()
+        self.config = parse_augment_spec('all') if config is None else config
+        self.device = torch.device(device)
+        self.input_mode = self.preprocessing['input_mode']
+
+        normalize = self.preprocessing['normalize']
+        self.mean = torch.tensor(normalize['mean'], device=self.device).view(1, -1, 1, 1)
+        self.std = torch.tensor(normalize['std'], device=self.device).view(1, -1, 1, 1)
+        background = torch.tensor(background_pixel(self.preprocessing), device=self.device).view(1, -1, 1, 1)
+        self.background = (background - self.mean) / self.std
+
+        if 'gain' in self.config and self.input_mode == 'rgb':
+            # RGB输入先按jet色图反查出标量强度再缩放，缩放后重新渲染
+            bits = self.preprocessing.get('colormap', {}).get('lut_bits', 5)
+            self.lut_bits = bits
+            self.lut = torch.from_numpy(build_colormap_lut(bits).astype(np.int64)).to(self.device)
+            self.colormap = torch.tensor(jet_colormap(256), dtype=torch.float32, device=self.device)
+
+        self.seed = seed
+        self.generator = torch.Generator(device=self.device)
+        self.generator.manual_seed(seed)
+
+    def __repr__(self):
+        parts = [f"{name}({', '.join(f'{k}={v}' for k, v in params.items())})"
+                 for name, params in self.config.items()]
+        return f"{self.__class__.__name__}(seed={self.seed}, {'; '.join(parts) or '无变换'})"
+
+    def _rand(self, *shape):
+        return torch.rand(shape, generator=self.generator, device=self.device)
+
+    def _uniform(self, low, high, n):
+        return low + (high - low) * self._rand(n)
+
+    def _selected(self, name, n):
+        return self._rand(n) < self.config[name]['p']
+
+    def _interval_mask(self, name, n, length):
+        """每个样本count个随机区间的并集，返回(N, length)布尔掩码"""
+        params = self.config[name]
+        count = int(params['count'])
+        widths = (self._rand(n, count) * params['max_width'] * length).long()
+        starts = (self._rand(n, count) * (length - widths + 1)).long()
+        positions = torch.arange(length, device=self.device).view(1, 1, -1)
+        mask = ((positions >= starts.unsqueeze(-1)) & (positions < (starts + widths).unsqueeze(-1))).any(dim=1)
+        return mask & self._selected(name, n).unsqueeze(1)
+
+    def _apply_selected(self, images, selected, transform):
+        """对选中的样本应用transform(子batch, 下标)
+
+        CPU上只计算选中的样本；GPU上对整个batch计算后按掩码选择（下标为None），
+        避免nonzero()引起的主机同步打断异步执行。
+        """
+        if self.device.type != 'cpu':
+            return torch.where(selected.view(-1, 1, 1, 1), transform(images, None), images)
+        index = selected.nonzero().squeeze(1)
+        if index.numel() == 0:
+            return images
+        images = images.clone()
+        images[index] = transform(images[index], index)
+        return images
+
+    def _gain(self, images):
+        params = self.config['gain']
+        n = images.size(0)
+        gains = self._uniform(params['min_gain'], params['max_gain'], n)
+        selected = self._selected('gain', n)
+
+        def transform(subset, index):
+            factors = (gains if index is None else gains[index]).view(-1, 1, 1, 1)
+            raw = subset * self.std + self.mean
+            if self.input_mode == 'rgb':
+                bits = self.lut_bits
+                quantized = (raw.clamp(0, 1) * 255).round().long() >> (8 - bits)
+                lut_index = (quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) | quantized[:, 2]
+                intensity = self.lut[lut_index].unsqueeze(1).float()
+                scaled = (intensity * factors).round().clamp(0, 255).long().squeeze(1)
+                raw = self.colormap[scaled].permute(0, 3, 1, 2)
+            elif self.input_mode == 'colormap':
+                raw = (raw * factors).clamp(0, 1)
+            else:
+                # 灰度模式下jet亮度与强度不是单调关系，近似为相对背景亮度缩放
+                background = self.background * self.std + self.mean
+                raw = (background + (raw - background) * factors).clamp(0, 1)
+            return (raw - self.mean) / self.std
+
+        return self._apply_selected(images, selected, transform)
+
+    def _geometric(self, images):
+        """时间平移和多普勒缩放合并为一次仿射重采样，区域外补背景"""
+        n, _, height, width = images.shape
+        theta = torch.zeros(n, 2, 3, device=self.device)
+        theta[:, 0, 0] = 1.0
+        theta[:, 1, 1] = 1.0
+        selected = torch.zeros(n, dtype=torch.bool, device=self.device)
+
+        if 'time_shift' in self.config:
+            params = self.config['time_shift']
+            # 按整像素平移，重采样后不引入插值模糊
+            shift = (self._uniform(-params['max_shift'], params['max_shift'], n) * width).round()
+            shift_selected = self._selected('time_shift', n)
+            theta[:, 0, 2] = torch.where(shift_selected, -2.0 * shift / width, torch.zeros_like(shift))
+            selected |= shift_selected
+        if 'doppler_scale' in self.config:
+            params = self.config['doppler_scale']
+            scale = self._uniform(params['min_scale'], params['max_scale'], n)
+            scale_selected = self._selected('doppler_scale', n)
+            inverse = torch.where(scale_selected, 1.0 / scale, torch.ones_like(scale))
+            center = 2.0 * params['center'] - 1.0
+            theta[:, 1, 1] = inverse
+            theta[:, 1, 2] = center * (1.0 - inverse)
+            selected |= scale_selected
+
+        def transform(subset, index):
+            subset_theta = theta if index is None else theta[index]
+            grid = F.affine_grid(subset_theta, list(subset.shape), align_corners=False)
+            return F.grid_sample(subset - self.background, grid, mode='bilinear', padding_mode='zeros',
+                                 align_corners=False) + self.background
+
+        return self._apply_selected(images, selected, transform)
+
+    @torch.no_grad()
+    def __call__(self, images):
+        if not self.config:
+            return images
+        n, _, height, width = images.shape
+        if 'gain' in self.config:
+            images = self._gain(images)
+        if 'time_shift' in self.config or 'doppler_scale' in self.config:
+            images = self._geometric(images)
+        if 'time_mask' in self.config:
+            mask = self._interval_mask('time_mask', n, width)
+            images = torch.where(mask.view(n, 1, 1, width), self.background, images)
+        if 'freq_mask' in self.config:
+            mask = self._interval_mask('freq_mask', n, height)
+            images = torch.where(mask.view(n, 1, height, 1), self.background, images)
+        return images
+
+
+def benchmark_augment(preprocessing, config, batch_size=64, device='cpu', repeats=20):
+    """测量每个变换单独启用时处理一个batch的耗时(ms)"""
+    shape = (batch_size, preprocessing['channels'], *preprocessing['resize'])
+    images = torch.randn(shape, device=device)
+    results = {}
+    for name in list(config) + ['all']:
+        augment = BatchSpectrogramAugment(preprocessing, config if name == 'all' else {name: config[name]},
+                                          device=device)
+        augment(images)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            augment(images)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        results[name] = (time.perf_counter() - start) / repeats * 1000
+    return results
+
+
+def save_preview(image_paths, preprocessing, augment, output_path, copies=4):
+    """保存增强效果预览图：每行为一张原图及其若干个增强结果"""
+    from PIL import Image
+    from gait_inference import preprocess_image
+
+    originals = torch.from_numpy(np.stack([preprocess_image(path, preprocessing) for path in image_paths]))
+    originals = originals.to(augment.device)
+    rows = [originals] + [augment(originals) for _ in range(copies)]
+    grid = torch.stack(rows, dim=1)
+    raw = (grid * augment.std.unsqueeze(1) + augment.mean.unsqueeze(1)).clamp(0, 1)
+    n, columns, channels, height, width = raw.shape
+    canvas = (raw.permute(0, 3, 1, 4, 2).reshape(n * height, columns * width, channels) * 255).byte().cpu().numpy()
+    Image.fromarray(canvas.squeeze(-1) if channels == 1 else canvas).save(output_path)
+    print(f"增强预览已保存到: {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='设备端批量时频图增强：耗时测量与效果预览')
+    parser.add_argument('--augment', type=str, default='all',
+                       help="增强配置，如 'all' 或 'time_mask:p=0.3,gain:max_gain=1.5'")
+    parser.add_argument('--input_mode', type=str, default='rgb',
+                       help='输入模式 (rgb/gray/colormap)')
+    parser.add_argument('--input_size', type=int, default=224,
+                       help='输入分辨率')
+    parser.add_argument('--batch_size', type=int, default=64,
+                       help='测量耗时的批次大小')
+    parser.add_argument('--seed', type=int, default=0,
+                       help='随机种子')
+    parser.add_argument('--preview', type=str, nargs='*', default=None,
+                       help='用这些时频图生成增强预览')
+    parser.add_argument('--preview_output', type=str, default='./augment_preview.png',
+                       help='预览图保存路径')
+
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    preprocessing = get_preprocessing_config(args.input_mode, args.input_size)
+    config = parse_augment_spec(args.augment)
+
+    if args.preview:
+        augment = BatchSpectrogramAugment(preprocessing, config, args.seed, device)
+        save_preview(args.preview, preprocessing, augment, args.preview_output)
+        return
+
+    print(f"设备: {device}, batch: {args.batch_size}x{preprocessing['channels']}x{args.input_size}x{args.input_size}")
+    for name, ms in benchmark_augment(preprocessing, config, args.batch_size, device).items():
+        print(f"  {name:<14} {ms:8.2f} ms/batch")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+微多普勒时频图预处理配置
+时频图是标量强度经jet色图渲染得到的256x256彩色图像。除默认的RGB输入外，支持：
+  gray     - 直接按灰度读取（JPEG只解码亮度通道，最快）
+  colormap - 按jet色图反查，恢复原始标量强度（保留完整的强度信息）
+本模块只依赖NumPy和Pillow，训练脚本和Web导出元数据共用同一份配置
+"""
+
+import numpy as np
+from PIL import Image
+
+INPUT_MODES = ('rgb', 'gray', 'colormap')
+
+# 时频图原始分辨率
+NATIVE_SIZE = 256
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+# 单通道输入使用ImageNet三通道统计量的均值，与conv1按通道求和的初始化方式匹配
+SINGLE_CHANNEL_MEAN = [0.449]
+SINGLE_CHANNEL_STD = [0.226]
+
+# 色图反查表的量化位数（每通道32级，共32768项）
+LUT_BITS = 5
+
+
+def jet_colormap(n=256):
+    """MATLAB jet色图，返回(n, 3)的[0,1]浮点数组"""
+    x = np.linspace(0.0, 1.0, n)
+    red = np.interp(x, [0, 3 / 8, 5 / 8, 7 / 8, 1], [0, 0, 1, 1, 0.5])
+    green = np.interp(x, [0, 1 / 8, 3 / 8, 5 / 8, 7 / 8, 1], [0, 0, 1, 1, 0, 0])
+    blue = np.interp(x, [0, 1 / 8, 3 / 8, 5 / 8, 1], [0.5, 1, 1, 0, 0])
+    return np.stack([red, green, blue], axis=1)
+
+
+_LUT_CACHE = {}
+
+
+def build_colormap_lut(bits=LUT_BITS):
+    """构建量化RGB → 色图索引(0-255)的反查表，按最近邻颜色匹配"""
+    if bits in _LUT_CACHE:
+        return _LUT_CACHE[bits]
+
+    levels = 1 << bits
+    step = 256 // levels
+    centers = (np.arange(levels) * step + step // 2) / 255.0
+    grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+    colormap = jet_colormap(256).reshape(1, -1, 3)
+
+    lut = np.empty(levels ** 3, dtype=np.uint8)
+    # 分块计算距离，避免一次性分配过大的中间数组
+    for start in range(0, len(grid), 4096):
+        distances = ((grid[start:start + 4096] - colormap) ** 2).sum(axis=2)
+        lut[start:start + 4096] = distances.argmin(axis=1)
+
+    _LUT_CACHE[bits] = lut
+    return lut
+
+
+def invert_colormap(rgb_array, bits=LUT_BITS):
+    """将(H, W, 3) uint8的jet渲染图还原为(H, W) uint8标量强度"""
+    lut = build_colormap_lut(bits)
+    quantized = (rgb_array >> (8 - bits)).astype(np.int32)
+    index = (quantized[..., 0] << (2 * bits)) | (quantized[..., 1] << bits) | quantized[..., 2]
+    return lut[index]
+
+
+class ColormapInverse:
+    """torchvision风格的变换：RGB PIL图像 → 单通道强度PIL图像"""
+
+    def __init__(self, bits=LUT_BITS):
+        self.bits = bits
+        build_colormap_lut(bits)
+
+    def __call__(self, image):
+        rgb = np.asarray(image.convert('RGB'))
+        return Image.fromarray(invert_colormap(rgb, self.bits), mode='L')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(colormap=jet, bits={self.bits})'
+
+
+def get_preprocessing_config(input_mode='rgb', input_size=224):
+    """返回预处理配置，写入检查点和metadata.json，供训练、转换和Web推理共用"""
+    if input_mode not in INPUT_MODES:
+        raise ValueError(f"不支持的输入模式: {input_mode}，可选: {INPUT_MODES}")
+
+    single_channel = input_mode != 'rgb'
+    config = {
+        'input_mode': input_mode,
+        'channels': 1 if single_channel else 3,
+        'resize': [input_size, input_size],
+        'normalize': {
+            'mean': SINGLE_CHANNEL_MEAN if single_channel else IMAGENET_MEAN,
+            'std': SINGLE_CHANNEL_STD if single_channel else IMAGENET_STD
+        }
+    }
+    if input_mode == 'colormap':
+        config['colormap'] = {'name': 'jet', 'lut_bits': LUT_BITS}
+    return config
+
+
+def get_input_shape(preprocessing=None, batch_size=1):
+    """模型输入张量形状 (N, C, H, W)"""
+    preprocessing = preprocessing or get_preprocessing_config()
+    height, width = preprocessing['resize']
+    return (batch_size, preprocessing['channels'], height, width)
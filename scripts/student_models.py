@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+轻量级学生模型结构
+用于知识蒸馏：由训练好的ResNet18教师模型指导，得到适合门禁终端浏览器WASM推理的小模型
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torchvision.models as models
+from torchvision.models.resnet import BasicBlock
+
+from model_layers import adapt_conv_input_channels
+
+# 可选的学生模型结构
+STUDENT_ARCHITECTURES = ('mobilenet_v3_small', 'resnet18_slim')
+
+
+class L2Norm(nn.Module):
+    """L2标准化层"""
+    def __init__(self, dim=1):
+        super(L2Norm, self).__init__()
+        self.dim = dim
+
+    def forward(self, x):
+        return F.normalize(x, p=2, dim=self.dim)
+
+
+class SlimResNet18(nn.Module):
+    """按宽度系数缩减通道数的ResNet18主干（结构与torchvision ResNet18一致）"""
+
+    def __init__(self, width_multiplier=0.5):
+        super(SlimResNet18, self).__init__()
+        widths = [max(8, int(round(c * width_multiplier))) for c in (64, 128, 256, 512)]
+
+        self.conv1 = nn.Conv2d(3, widths[0], kernel_size=7, stride=2, padding=3, bias=False)
+        self.bn1 = nn.BatchNorm2d(widths[0])
+        self.relu = nn.ReLU(inplace=True)
+        self.maxpool = nn.MaxPool2d(kernel_size=3, stride=2, padding=1)
+
+        in_channels = widths[0]
+        for i, out_channels in enumerate(widths):
+            stride = 1 if i == 0 else 2
+            downsample = None
+            if stride != 1 or in_channels != out_channels:
+                downsample = nn.Sequential(
+                    nn.Conv2d(in_channels, out_channels, kernel_size=1, stride=stride, bias=False),
+                    nn.BatchNorm2d(out_channels)
+                )
+            layer = nn.Sequential(
+                BasicBlock(in_channels, out_channels, stride, downsample),
+                BasicBlock(out_channels, out_channels)
+            )
+            setattr(self, f'layer{i + 1}', layer)
+            in_channels = out_channels
+
+        self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
+        self.num_features = widths[-1]
+
+    def forward(self, x):
+        x = self.maxpool(self.relu(self.bn1(self.conv1(x))))
+        x = self.layer4(self.layer3(self.layer2(self.layer1(x))))
+        return torch.flatten(self.avgpool(x), 1)
+
+    def load_sliced_weights(self, reference_state_dict):
+        """用完整ResNet18权重的前N个通道初始化（比随机初始化收敛更快）"""
+        own_state = self.state_dict()
+        for name, tensor in own_state.items():
+            if name not in reference_state_dict:
+                continue
+            source = reference_state_dict[name]
+            if tensor.dim() == 0:
+                tensor.copy_(source)
+            else:
+                tensor.copy_(source[tuple(slice(0, size) for size in tensor.shape)])
+
+
+def build_student_backbone(arch, width_multiplier=0.5, pretrained=True, in_channels=3):
+    """创建学生模型主干，返回(主干网络, 输出特征维度)"""
+    if arch == 'mobilenet_v3_small':
+        mobilenet = models.mobilenet_v3_small(pretrained=pretrained)
+        mobilenet.features[0][0] = adapt_conv_input_channels(mobilenet.features[0][0], in_channels)
+        backbone = nn.Sequential(mobilenet.features, mobilenet.avgpool, nn.Flatten(1))
+        return backbone, mobilenet.classifier[0].in_features
+
+    if arch == 'resnet18_slim':
+        backbone = SlimResNet18(width_multiplier)
+        if pretrained:
+            backbone.load_sliced_weights(models.resnet18(pretrained=True).state_dict())
+        backbone.conv1 = adapt_conv_input_channels(backbone.conv1, in_channels)
+        return backbone, backbone.num_features
+
+    raise ValueError(f"不支持的学生模型结构: {arch}，可选: {STUDENT_ARCHITECTURES}")
+
+
+class StudentModel(nn.Module):
+    """蒸馏学生模型：轻量主干 + 嵌入层 + 分类头
+
+    接口与ResNet18Contrastive一致：训练时返回(嵌入向量, 分类结果)，推理时只返回分类结果，
+    因此可以直接使用save_model_for_web和convert_to_onnx导出。
+    """
+
+    def __init__(self, num_classes, arch='mobilenet_v3_small', embedding_dim=128,
+                 width_multiplier=0.5, pretrained=True, in_channels=3):
+        super(StudentModel, self).__init__()
+        self.arch = arch
+        self.embedding_dim = embedding_dim
+        self.width_multiplier = width_multiplier
+        self.in_channels = in_channels
+
+        self.backbone, num_features = build_student_backbone(arch, width_multiplier, pretrained, in_channels)
+
+        self.embedding = nn.Sequential(
+            nn.Linear(num_features, embedding_dim),
+            L2Norm(dim=1)
+        )
+        self.classifier = nn.Linear(embedding_dim, num_classes)
+
+    def get_config(self):
+        """保存到检查点中的结构参数，用于重建模型"""
+        return {
+            'arch': self.arch,
+            'embedding_dim': self.embedding_dim,
+            'width_multiplier': self.width_multiplier,
+            'in_channels': self.in_channels
+        }
+
+    def forward(self, x):
+        embeddings = self.embedding(self.backbone(x))
+
+        if self.training:
+            return embeddings, self.classifier(embeddings)
+        return self.classifier(embeddings)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+逐帧嵌入向量的流式时序融合（推理端，不依赖PyTorch）
+一次行走产生连续的多普勒帧。原有验证逐帧独立分类再检查标签是否一致，丢弃了帧间的时序信息。
+融合模型接在冻结的ResNet18Contrastive之后，输入每帧的嵌入向量：
+  因果1D卷积（核大小K，只看当前帧和之前K-1帧） → ReLU → 注意力池化（对到目前为止的所有帧加权平均） → 线性分类
+流式推理时只保存最近K帧嵌入的环形缓冲区和注意力池化的在线softmax累加量（最大分数、权重和、加权和），
+每来一帧的额外计算量为 K×D×H + H×C 次乘加（默认约3万次，ResNet18单帧约18亿次），
+序列级后验达到接受阈值即可提前给出决策。
+模型由 train_temporal_fusion.py 在缓存的嵌入向量上训练，权重保存为npz，参数写入metadata.json的usage.temporal_fusion。
+"""
+
+import os
+
+import numpy as np
+
+FUSION_FILE = 'temporal_fusion.npz'
+
+
+def softmax(logits):
+    shifted = logits - logits.max()
+    exp = np.exp(shifted)
+    return exp / exp.sum()
+
+
+class TemporalFusionWeights:
+    """融合模型权重（numpy），与train_temporal_fusion.TemporalFusion的参数一一对应"""
+
+    def __init__(self, arrays):
+        # Conv1d权重(H, D, K) → (K, H, D)，第j个切片作用于窗口中第j帧（最后一个为当前帧）
+        self.conv_weight = np.ascontiguousarray(np.transpose(arrays['conv_weight'], (2, 0, 1)), dtype=np.float32)
+        self.conv_bias = arrays['conv_bias'].astype(np.float32)
+        self.attention_weight = arrays['attention_weight'].reshape(-1).astype(np.float32)
+        self.attention_bias = float(np.asarray(arrays['attention_bias']).reshape(-1)[0])
+        self.classifier_weight = arrays['classifier_weight'].astype(np.float32)
+        self.classifier_bias = arrays['classifier_bias'].astype(np.float32)
+        self.kernel_size, self.hidden_dim, self.embedding_dim = self.conv_weight.shape
+        self.num_classes = self.classifier_weight.shape[0]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls({name: data[name] for name in data.files})
+
+
+class StreamingTemporalFusion:
+    """单个行走序列的流式融合状态，update()的返回值与SequentialVerifier.update相同
+
+    决策：序列级后验（温度缩放后的softmax）不低于accept_threshold且已满min_frames帧 → 接受；
+    达到max_frames仍未接受 → 拒绝。指定claimed_id时检验该身份，否则检验后验最大的身份。
+    """
+
+    def __init__(self, weights, temperature=1.0, accept_threshold=0.95, min_frames=1, max_frames=5, claimed_id=None):
+        self.weights = weights
+        self.temperature = temperature
+        self.accept_threshold = accept_threshold
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.claimed_id = claimed_id
+        self.reset()
+
+    def reset(self):
+        w = self.weights
+        # 最近K帧的环形缓冲区，序列开始前的位置为0（与训练时的左侧零填充一致）
+        self.buffer = np.zeros((w.kernel_size, w.embedding_dim), dtype=np.float32)
+        self.position = 0
+        self.max_score = -np.inf
+        self.weight_sum = 0.0
+        self.weighted = np.zeros(w.hidden_dim, dtype=np.float32)
+        self.frames = 0
+
+    def step(self, embedding):
+        """加入一帧嵌入向量，返回到目前为止的序列级logits"""
+        w = self.weights
+        k = w.kernel_size
+        self.buffer[self.position] = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        self.position = (self.position + 1) % k
+        # 按时间顺序排列窗口：position此时指向最早的一帧
+        window = self.buffer[(self.position + np.arange(k)) % k]
+        hidden = np.maximum(np.einsum('khd,kd->h', w.conv_weight, window) + w.conv_bias, 0.0)
+
+        # 在线softmax：分数最大值变化时重新缩放已有的累加量
+        score = float(hidden @ w.attention_weight + w.attention_bias)
+        new_max = max(self.max_score, score)
+        scale = np.exp(self.max_score - new_max) if self.frames else 0.0
+        current = np.exp(score - new_max)
+        self.weight_sum = self.weight_sum * scale + current
+        self.weighted = self.weighted * scale + current * hidden
+        self.max_score = new_max
+        self.frames += 1
+
+        pooled = self.weighted / self.weight_sum
+        return w.classifier_weight @ pooled + w.classifier_bias
+
+    def update(self, embedding):
+        probabilities = softmax(self.step(embedding) / self.temperature)
+        class_index = int(np.argmax(probabilities)) if self.claimed_id is None else self.claimed_id
+        posterior = float(probabilities[class_index])
+
+        decision = 'continue'
+        if self.frames >= self.min_frames:
+            if posterior >= self.accept_threshold:
+                decision = 'accept'
+            elif self.frames >= self.max_frames:
+                decision = 'reject'
+
+        return {
+            'decision': decision,
+            'class_index': class_index,
+            'posterior': posterior,
+            'frames': self.frames
+        }
+
+
+class TemporalFusion:
+    """按metadata.json中的usage.temporal_fusion加载融合模型，为每个行走序列创建流式状态
+
+    用法:
+        fusion = TemporalFusion.from_policy(model_dir, metadata['usage']['temporal_fusion'])
+        stream = fusion.stream()
+        for embedding in frame_embeddings:
+            step = stream.update(embedding)
+            if step['decision'] != 'continue':
+                break
+    """
+
+    def __init__(self, weights, temperature=1.0, accept_threshold=0.95, min_frames=1, max_frames=5,
+                 embedding_tensor=None):
+        self.weights = weights
+        self.temperature = temperature
+        self.accept_threshold = accept_threshold
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        # ONNX图中嵌入向量张量名，None表示自动选择（见bulk_score.find_embedding_tensor）
+        self.embedding_tensor = embedding_tensor
+
+    @classmethod
+    def from_policy(cls, model_dir, policy):
+        weights = TemporalFusionWeights.load(os.path.join(model_dir, policy.get('file', FUSION_FILE)))
+        return cls(weights, policy.get('temperature', 1.0), policy['accept_threshold'], policy.get('min_frames', 1),
+                   policy['max_frames'], policy.get('embedding_tensor'))
+
+    def get_policy(self):
+        """写入metadata.json的参数"""
+        return {
+            'type': 'temporal_fusion',
+            'file': FUSION_FILE,
+            'temperature': self.temperature,
+            'accept_threshold': self.accept_threshold,
+            'min_frames': self.min_frames,
+            'max_frames': self.max_frames,
+            'embedding_tensor': self.embedding_tensor
+        }
+
+    def stream(self, claimed_id=None):
+        return StreamingTemporalFusion(self.weights, self.temperature, self.accept_threshold, self.min_frames,
+                                       self.max_frames, claimed_id)
+
+    def sequence_logits(self, embeddings):
+        """整段序列逐帧的序列级logits，返回(T, 类别数)"""
+        stream = self.stream()
+        return np.stack([stream.step(embedding) for embedding in embeddings])
@@ -19,32 +19,72 @@ import json
 import numpy as np
 import random
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+from sklearn.metrics import classification_report, confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
 import warnings
 warnings.filterwarnings('ignore')
 
+from training_profiler import TrainingProfiler, parse_step_window
+from device_metrics import MetricAccumulator
+from training_memory import enable_activation_checkpointing
+from loader_autotune import DEFAULT_CACHE_PATH, autotune_loader, dataset_signature, loader_kwargs
+from model_layers import adapt_conv_input_channels
+from student_models import StudentModel, STUDENT_ARCHITECTURES
+from early_exit import build_exit_heads, forward_with_exits
+from multi_task import (MultiTaskLoss, build_task_heads, export_output_names, export_wrapper, forward_task_heads,
+                        load_task_config, task_head_config)
+from spectrogram_augment import BatchSpectrogramAugment, parse_augment_spec
+from loss_aware_sampling import LossAwareSampler
+from progressive_resize import ProgressiveResize, parse_resize_schedule
+from large_identity import (CosineClassifier, IdentityBalancedSampler, SampledMarginLoss, MARGIN_TYPES,
+                            evaluate_retrieval, print_retrieval_results, split_parameters)
+from spectrogram_preprocessing import (INPUT_MODES, NATIVE_SIZE, ColormapInverse,
+                                       get_preprocessing_config, get_input_shape)
+
+# 身份数超过该值时不再逐个打印每个身份的统计，只打印汇总和表现最差的身份
+PER_CLASS_REPORT_LIMIT = 50
+
+def summarize_names(names, limit=PER_CLASS_REPORT_LIMIT):
+    """身份较多时只显示首尾几个"""
+    if len(names) <= limit:
+        return str(list(names))
+    return f"[{', '.join(names[:5])}, ..., {', '.join(names[-5:])}] (共{len(names)}个)"
+
 class GaitDataset(Dataset):
     """步态数据集类"""
     
-    def __init__(self, image_paths, labels, transform=None, contrastive_mode=False):
+    def __init__(self, image_paths, labels, transform=None, contrastive_mode=False, image_mode='RGB'):
         self.image_paths = image_paths
         self.labels = labels
         self.transform = transform
         self.contrastive_mode = contrastive_mode
+        # 'RGB'或'L'：灰度输入模式下JPEG只解码亮度通道
+        self.image_mode = image_mode
         
-        # 为对比学习创建按类别分组的索引
-        if self.contrastive_mode:
-            self.class_to_indices = {}
-            for idx, label in enumerate(labels):
-                if label not in self.class_to_indices:
-                    self.class_to_indices[label] = []
-                self.class_to_indices[label].append(idx)
+        # 按类别分组的索引（对比学习取正负样本、身份均衡采样使用），构建代价与样本数成正比
+        self.class_to_indices = {}
+        for idx, label in enumerate(labels):
+            self.class_to_indices.setdefault(label, []).append(idx)
+        self.classes = list(self.class_to_indices.keys())
         
     def __len__(self):
         return len(self.image_paths)
     
+    def _load_image(self, image_path):
+        """按image_mode加载图像"""
+        image = Image.open(image_path)
+        if self.image_mode == 'L':
+            image.draft('L', image.size)
+        return image.convert(self.image_mode)
+    
+    def _zero_image(self):
+        """加载失败时使用的零图像"""
+        zero_image = Image.new(self.image_mode, (NATIVE_SIZE, NATIVE_SIZE))
+        if self.transform:
+            return self.transform(zero_image)
+        return transforms.ToTensor()(zero_image)
+    
     def __getitem__(self, idx):
         if self.contrastive_mode:
             return self._get_contrastive_pair(idx)
@@ -58,7 +98,7 @@ class GaitDataset(Dataset):
         
         try:
             # 加载图像
-            image = Image.open(image_path).convert('RGB')
+            image = self._load_image(image_path)
             
             if self.transform:
                 image = self.transform(image)
@@ -67,11 +107,7 @@ class GaitDataset(Dataset):
         except Exception as e:
             print(f"Error loading image {image_path}: {e}")
             # 返回零图像作为备用
-            if self.transform:
-                zero_image = self.transform(Image.new('RGB', (256, 256), (0, 0, 0)))
-            else:
-                zero_image = transforms.ToTensor()(Image.new('RGB', (256, 256), (0, 0, 0)))
-            return zero_image, label
+            return self._zero_image(), label
     
     def _get_contrastive_pair(self, idx):
         """获取对比学习的图像对 - 优化负样本选择策略"""
@@ -84,36 +120,38 @@ class GaitDataset(Dataset):
         
         if is_positive:
             # 选择同类的另一个样本作为正样本
-            positive_indices = [i for i in self.class_to_indices[anchor_label] if i != idx]
-            if positive_indices:
-                positive_idx = random.choice(positive_indices)
+            same_class = self.class_to_indices[anchor_label]
+            if len(same_class) > 1:
+                positive_idx = random.choice(same_class)
+                while positive_idx == idx:
+                    positive_idx = random.choice(same_class)
             else:
                 positive_idx = idx  # 如果没有其他同类样本，使用自己
             pair_path = self.image_paths[positive_idx]
             pair_label = anchor_label
             similarity = 1.0
         else:
-            # 智能负样本选择策略：从所有其他类别中选择
-            negative_classes = [c for c in self.class_to_indices.keys() if c != anchor_label]
-            if negative_classes:
+            # 智能负样本选择策略：从所有其他类别中选择（重新抽取直到不是锚点类别，不遍历全部类别）
+            if len(self.classes) > 1:
                 # 策略1: 随机选择负样本类别（保持多样性）
                 if random.random() > 0.3:
-                    negative_class = random.choice(negative_classes)
+                    negative_class = random.choice(self.classes)
+                    while negative_class == anchor_label:
+                        negative_class = random.choice(self.classes)
                     negative_idx = random.choice(self.class_to_indices[negative_class])
                 # 策略2: 选择相邻ID作为困难负样本（更具挑战性）
                 else:
-                    # 优先选择相邻的用户ID作为困难负样本
+                    # 优先选择相邻的用户ID作为困难负样本（相邻2个ID内）
                     current_id = anchor_label
-                    adjacent_ids = []
-                    for neg_class in negative_classes:
-                        id_diff = abs(neg_class - current_id)
-                        if id_diff <= 2:  # 相邻2个ID内
-                            adjacent_ids.append(neg_class)
+                    adjacent_ids = [c for c in range(current_id - 2, current_id + 3)
+                                    if c != current_id and c in self.class_to_indices]
                     
                     if adjacent_ids:
                         negative_class = random.choice(adjacent_ids)
                     else:
-                        negative_class = random.choice(negative_classes)
+                        negative_class = random.choice(self.classes)
+                        while negative_class == anchor_label:
+                            negative_class = random.choice(self.classes)
                     
                     negative_idx = random.choice(self.class_to_indices[negative_class])
                 
@@ -126,8 +164,8 @@ class GaitDataset(Dataset):
         
         try:
             # 加载锚点图像和配对图像
-            anchor_image = Image.open(anchor_path).convert('RGB')
-            pair_image = Image.open(pair_path).convert('RGB')
+            anchor_image = self._load_image(anchor_path)
+            pair_image = self._load_image(pair_path)
             
             if self.transform:
                 anchor_image = self.transform(anchor_image)
@@ -138,10 +176,7 @@ class GaitDataset(Dataset):
         except Exception as e:
             print(f"Error loading contrastive pair: {e}")
             # 返回零图像对作为备用
-            if self.transform:
-                zero_image = self.transform(Image.new('RGB', (256, 256), (0, 0, 0)))
-            else:
-                zero_image = transforms.ToTensor()(Image.new('RGB', (256, 256), (0, 0, 0)))
+            zero_image = self._zero_image()
             return (zero_image, zero_image), (anchor_label, anchor_label, 1.0)
 
 def load_dataset(dataset_path):
@@ -180,34 +215,67 @@ def load_dataset(dataset_path):
                 labels.append(class_idx)
                 image_count += 1
         
-        print(f"  {class_dir}: {image_count} 张图像")
+        if len(user_dirs) <= PER_CLASS_REPORT_LIMIT:
+            print(f"  {class_dir}: {image_count} 张图像")
     
     if len(class_names) == 0:
         print("错误: 未找到符合格式的用户目录 (ID_*)")
         return [], [], []
     
-    print(f"总共找到 {len(class_names)} 个用户类别")
-    print(f"类别排序: {class_names}")
+    print(f"总共找到 {len(class_names)} 个用户类别, {len(image_paths)} 张图像")
+    print(f"类别排序: {summarize_names(class_names)}")
     return image_paths, labels, class_names
 
-def create_data_transforms():
-    """创建微多普勒时频图专用的简洁预处理"""
-    
-    # 训练时的最小化预处理（保持时频图的物理意义）
-    train_transform = transforms.Compose([
-        transforms.Resize((224, 224)),  # 直接resize到目标尺寸
+def load_manifest(manifest_path, dataset_path):
+    """读取清单（{身份: [文件名]}，与dataset_index.json格式相同，如coreset_select.py的输出），返回其中文件的完整路径集合
+
+    数据集中已不存在的文件跳过并给出警告
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    selected, missing = set(), 0
+    for class_dir, files in manifest.items():
+        for img_file in files:
+            img_path = os.path.join(dataset_path, class_dir, img_file)
+            if os.path.isfile(img_path):
+                selected.add(img_path)
+            else:
+                missing += 1
+    print(f"使用数据清单: {manifest_path} ({len(selected)} 张图像)")
+    if missing:
+        print(f"警告: 清单中有 {missing} 个文件在数据集中不存在，已跳过")
+    return selected
+
+def get_image_mode(input_mode='rgb'):
+    """GaitDataset加载图像时使用的PIL模式"""
+    return 'L' if input_mode == 'gray' else 'RGB'
+
+def create_data_transforms(input_mode='rgb', input_size=224):
+    """创建微多普勒时频图专用的简洁预处理
+    
+    input_mode: 'rgb'为默认三通道输入；'gray'和'colormap'为单通道输入
+    input_size: 输入分辨率，等于原始分辨率(256)时不做重采样
+    """
+    preprocessing = get_preprocessing_config(input_mode, input_size)
+    
+    steps = []
+    if input_mode == 'colormap':
+        # 按jet色图反查还原标量强度
+        steps.append(ColormapInverse())
+    if input_size != NATIVE_SIZE:
+        steps.append(transforms.Resize((input_size, input_size)))
+    steps.extend([
         transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                           std=[0.229, 0.224, 0.225])
+        transforms.Normalize(mean=preprocessing['normalize']['mean'],
+                           std=preprocessing['normalize']['std'])
     ])
     
+    # 训练时的最小化预处理（保持时频图的物理意义）
+    # 数据增强不在这里逐图执行，而是在batch送到设备后批量进行（见spectrogram_augment.py和--augment）
+    train_transform = transforms.Compose(steps)
+    
     # 验证/测试时使用相同预处理
-    val_transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                           std=[0.229, 0.224, 0.225])
-    ])
+    val_transform = transforms.Compose(list(steps))
     
     return train_transform, val_transform
 
@@ -237,11 +305,14 @@ class ContrastiveLoss(nn.Module):
 class ResNet18Contrastive(nn.Module):
     """支持对比学习的ResNet18模型"""
     
-    def __init__(self, num_classes, embedding_dim=128):
+    def __init__(self, num_classes, embedding_dim=128, in_channels=3, exit_layers=(), pretrained=True,
+                 tasks=None, classifier_type='mlp'):
         super(ResNet18Contrastive, self).__init__()
         
         # 加载预训练的ResNet18
-        self.backbone = models.resnet18(pretrained=True)
+        self.backbone = models.resnet18(pretrained=pretrained)
+        # 单通道输入时将conv1的预训练滤波器沿RGB维度求和
+        self.backbone.conv1 = adapt_conv_input_channels(self.backbone.conv1, in_channels)
         
         # 更激进的解冻策略：解冻更多层以提高学习能力
         for param in self.backbone.parameters():
@@ -271,14 +342,34 @@ class ResNet18Contrastive(nn.Module):
         )
         
         # 分类头
-        self.classifier = nn.Sequential(
-            nn.Linear(embedding_dim, 256),
-            nn.ReLU(),
-            nn.Dropout(0.5),
-            nn.Linear(256, num_classes)
-        )
+        if classifier_type == 'cosine':
+            # 大规模身份模式：余弦分类头，权重行即各身份的类别中心（见large_identity.py）
+            self.classifier = CosineClassifier(embedding_dim, num_classes)
+        else:
+            self.classifier = nn.Sequential(
+                nn.Linear(embedding_dim, 256),
+                nn.ReLU(),
+                nn.Dropout(0.5),
+                nn.Linear(256, num_classes)
+            )
+        
+        # 提前退出分支（为空时不增加任何参数，与旧检查点兼容）
+        self.exit_heads = build_exit_heads(self.backbone, exit_layers, num_classes)
+        
+        # 多任务输出头（人员类型、步态质量等），接在主干池化特征上，与身份分类共用一次前向
+        self.task_config = task_head_config(tasks) if tasks else {}
+        self.task_heads = build_task_heads(num_features, self.task_config)
+        
+    def forward(self, x, return_exits=False, return_tasks=False):
+        if return_exits or return_tasks:
+            # 联合训练：同时返回各退出分支的logits；return_tasks时追加各任务头的输出
+            features, exit_logits = forward_with_exits(self.backbone, self.exit_heads if return_exits else {}, x)
+            embeddings = self.embedding(features)
+            outputs = (embeddings, self.classifier(embeddings), exit_logits)
+            if return_tasks:
+                outputs += (forward_task_heads(self.task_heads, self.task_config, features),)
+            return outputs
         
-    def forward(self, x):
         features = self.backbone(x)
         embeddings = self.embedding(features)
         
@@ -299,15 +390,27 @@ class L2Norm(nn.Module):
     def forward(self, x):
         return F.normalize(x, p=2, dim=self.dim)
 
-def create_model(num_classes, contrastive_learning=False, embedding_dim=128):
-    """创建ResNet18模型"""
-    
-    if contrastive_learning:
-        # 使用对比学习模型
-        model = ResNet18Contrastive(num_classes, embedding_dim)
+def create_model(num_classes, contrastive_learning=False, embedding_dim=128, input_mode='rgb', input_size=224,
+                 exit_layers=(), pretrained=True, tasks=None, classifier_type='mlp'):
+    """创建ResNet18模型
+    
+    exit_layers: 对比学习模型中添加提前退出分支的残差阶段，例如 ('layer2', 'layer3')
+    tasks: 对比学习模型中与身份分类共用主干的多任务输出头配置（见multi_task.py）
+    classifier_type: 'cosine'时创建带余弦分类头的嵌入模型（大规模身份模式，见large_identity.py）
+    pretrained: 是否加载ImageNet预训练权重（基准测试等离线场景可关闭）
+    """
+    
+    preprocessing = get_preprocessing_config(input_mode, input_size)
+    
+    if contrastive_learning or classifier_type == 'cosine':
+        # 使用对比学习模型（嵌入向量 + 分类头）
+        model = ResNet18Contrastive(num_classes, embedding_dim, in_channels=preprocessing['channels'],
+                                    exit_layers=exit_layers, pretrained=pretrained, tasks=tasks,
+                                    classifier_type=classifier_type)
     else:
         # 使用标准分类模型
-        model = models.resnet18(pretrained=True)
+        model = models.resnet18(pretrained=pretrained)
+        model.conv1 = adapt_conv_input_channels(model.conv1, preprocessing['channels'])
         
         # 冻结前面的层，只训练最后几层
         for param in model.parameters():
@@ -328,19 +431,53 @@ def create_model(num_classes, contrastive_learning=False, embedding_dim=128):
             nn.Linear(256, num_classes)
         )
     
+    # 记录输入预处理配置，随检查点和导出元数据一起保存
+    model.preprocessing = preprocessing
     return model
 
-def train_model(model, train_loader, val_loader, num_epochs=50, learning_rate=0.001, device='cuda', contrastive_learning=False, contrastive_weight=0.5):
-    """训练模型"""
+def train_model(model, train_loader, val_loader, num_epochs=50, learning_rate=0.001, device='cuda', contrastive_learning=False, contrastive_weight=0.5, profiler=None, exit_loss_weight=0.3,
+                metrics_sync_every=20, progress_interval=1.0, accumulate_steps=1, augment=None, sample_skipper=None,
+                resize_schedule=None, task_loss=None, margin_loss=None):
+    """训练模型
+    
+    profiler: 可选的TrainingProfiler，开启后记录每个step的分阶段耗时
+    exit_loss_weight: 模型带提前退出分支时，每个分支分类损失的权重
+    metrics_sync_every / progress_interval: 训练指标在设备端累加，最多每N步、每隔若干秒同步一次用于进度显示
+    accumulate_steps: 梯度累积步数，有效批次为 batch_size × accumulate_steps
+    augment: 可选的BatchSpectrogramAugment，在训练batch送到设备后做批量增强（验证集不增强）
+    sample_skipper: 可选的LossAwareSampler（须同时作为train_loader的sampler），按逐样本损失跳过简单样本
+    resize_schedule: 可选的ProgressiveResize，前期epoch以低分辨率训练，train_loader用于部署分辨率阶段
+    task_loss: 可选的MultiTaskLoss，模型带多任务输出头时与身份损失按各任务权重联合训练
+    margin_loss: 可选的SampledMarginLoss（大规模身份模式，模型须带余弦分类头），以嵌入向量上的间隔损失代替交叉熵，
+                 每个batch只计算采样类别；训练准确率为采样类别内的准确率
+    """
+    
+    if margin_loss is not None and sample_skipper is not None:
+        # 间隔损失只给出batch平均值，没有跳过简单样本所需的逐样本损失
+        raise ValueError("margin_loss 不能与 sample_skipper 同时使用")
     
     model = model.to(device)
+    if profiler is None:
+        profiler = TrainingProfiler(enabled=False)
     
     # 损失函数和优化器
     criterion = nn.CrossEntropyLoss()
     contrastive_criterion = ContrastiveLoss(margin=1.0) if contrastive_learning else None
-    optimizer = optim.Adam(model.parameters(), lr=learning_rate, weight_decay=1e-5)
+    use_exits = contrastive_learning and len(getattr(model, 'exit_heads', {})) > 0
+    use_tasks = contrastive_learning and task_loss is not None and len(getattr(model, 'task_heads', {})) > 0
+    task_names = tuple(f'task_{name}' for name in model.task_heads.keys()) if use_tasks else ()
+    if use_tasks:
+        task_loss = task_loss.to(device)
+    if margin_loss is not None:
+        # 类别权重只有采样到的行有（稀疏）梯度，用SparseAdam只更新这些行，单步开销与身份总数无关
+        dense_params, class_params = split_parameters(model)
+        optimizers = [optim.Adam(dense_params, lr=learning_rate, weight_decay=1e-5),
+                      optim.SparseAdam(class_params, lr=learning_rate)]
+    else:
+        optimizers = [optim.Adam(model.parameters(), lr=learning_rate, weight_decay=1e-5)]
     # 使用余弦退火调度器，更平滑的学习率衰减
-    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=num_epochs//4, eta_min=learning_rate*0.01)
+    schedulers = [optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=max(1, num_epochs//4), eta_min=learning_rate*0.01)
+                  for optimizer in optimizers]
     
     # 记录训练历史
     train_losses = []
@@ -353,6 +490,21 @@ def train_model(model, train_loader, val_loader, num_epochs=50, learning_rate=0.
     print(f"对比学习模式: {'开启' if contrastive_learning else '关闭'}")
     if contrastive_learning:
         print(f"对比学习权重: {contrastive_weight}")
+    if use_exits:
+        print(f"提前退出分支: {list(model.exit_heads.keys())}, 损失权重: {exit_loss_weight}")
+    if margin_loss is not None:
+        print(f"大规模身份模式: {margin_loss}, 类别数: {model.classifier.out_features}")
+    if use_tasks:
+        print("多任务输出头: " + ", ".join(f"{name}({task['type']}, 权重 {task['weight']})"
+                                         for name, task in task_loss.tasks.items()))
+    if accumulate_steps > 1:
+        print(f"梯度累积: {accumulate_steps} 步, 有效批次: {train_loader.batch_size * accumulate_steps}")
+    if augment is not None:
+        print(f"设备端数据增强: {augment}")
+    if sample_skipper is not None:
+        print(f"跳过简单样本: {sample_skipper}")
+    if resize_schedule is not None:
+        print(f"渐进分辨率: {resize_schedule}")
     print(f"训练样本数: {len(train_loader.dataset)}")
     print(f"验证样本数: {len(val_loader.dataset)}")
     print("-" * 50)
@@ -360,91 +512,168 @@ def train_model(model, train_loader, val_loader, num_epochs=50, learning_rate=0.
     best_val_accuracy = 0.0
     best_model_state = None
     
+    train_metrics = MetricAccumulator(device, ('loss', 'contrastive_loss') + task_names, metrics_sync_every,
+                                      progress_interval)
+    val_metrics = MetricAccumulator(device, ('loss',) + task_names, metrics_sync_every, progress_interval)
+    task_history = {name: {'train': [], 'val': []} for name in task_names}
+    progress_fields = {'Loss': 'loss', 'Acc': 'accuracy'}
+    if contrastive_learning:
+        progress_fields['ContLoss'] = 'contrastive_loss'
+    
     for epoch in range(num_epochs):
         # 训练阶段
         model.train()
-        running_loss = 0.0
-        running_contrastive_loss = 0.0
-        correct_predictions = 0
-        total_samples = 0
+        train_metrics.reset()
+        if sample_skipper is not None:
+            sample_skipper.set_epoch(epoch)
+        epoch_loader = train_loader if resize_schedule is None else resize_schedule.loader_for_epoch(epoch, train_loader)
         
-        train_pbar = tqdm(train_loader, desc=f'Epoch {epoch+1}/{num_epochs} [Train]')
+        profiler.begin_epoch(epoch + 1)
+        train_pbar = tqdm(profiler.wrap_loader(epoch_loader), total=len(epoch_loader),
+                          desc=f'Epoch {epoch+1}/{num_epochs} [Train]')
+        for optimizer in optimizers:
+            optimizer.zero_grad()
         for batch_idx, batch_data in enumerate(train_pbar):
+            # 每accumulate_steps个batch（或epoch最后一个batch）更新一次参数
+            should_step = (batch_idx + 1) % accumulate_steps == 0 or batch_idx + 1 == len(epoch_loader)
             
             if contrastive_learning:
                 # 对比学习模式
                 (anchor_images, pair_images), (anchor_labels, pair_labels, similarities) = batch_data
-                anchor_images = anchor_images.to(device)
-                pair_images = pair_images.to(device)
-                anchor_labels = anchor_labels.to(device)
-                similarities = similarities.to(device)
-                
-                optimizer.zero_grad()
-                
-                # 前向传播
-                anchor_embeddings, anchor_outputs = model(anchor_images)
-                pair_embeddings, pair_outputs = model(pair_images)
+                with profiler.stage('h2d'):
+                    anchor_images = anchor_images.to(device)
+                    pair_images = pair_images.to(device)
+                    anchor_labels = anchor_labels.to(device)
+                    similarities = similarities.to(device)
+                if augment is not None:
+                    with profiler.stage('augment'):
+                        anchor_images = augment(anchor_images)
+                        pair_images = augment(pair_images)
                 
-                # 分类损失
-                classification_loss = criterion(anchor_outputs, anchor_labels)
+                with profiler.stage('forward'):
+                    # 前向传播
+                    if use_exits or use_tasks:
+                        # 退出分支和任务头与身份分类共用同一次主干前向
+                        anchor_embeddings, anchor_outputs, exit_outputs, *task_outputs = model(
+                            anchor_images, return_exits=use_exits, return_tasks=use_tasks)
+                    else:
+                        anchor_embeddings, anchor_outputs = model(anchor_images)
+                    pair_embeddings, pair_outputs = model(pair_images)
+                    
+                    # 分类损失
+                    if sample_skipper is not None:
+                        per_sample_loss = F.cross_entropy(anchor_outputs, anchor_labels, reduction='none')
+                        classification_loss = per_sample_loss.mean()
+                    else:
+                        classification_loss = criterion(anchor_outputs, anchor_labels)
+                    
+                    # 对比损失
+                    contrastive_loss = contrastive_criterion(anchor_embeddings, pair_embeddings, similarities)
+                    
+                    # 总损失
+                    total_loss = (1 - contrastive_weight) * classification_loss + contrastive_weight * contrastive_loss
+                    
+                    # 提前退出分支与主分类头联合训练
+                    if use_exits:
+                        for exit_logits in exit_outputs.values():
+                            total_loss = total_loss + exit_loss_weight * criterion(exit_logits, anchor_labels)
+                    
+                    # 各任务头按权重加入总损失（标签按身份查表）
+                    task_losses = {}
+                    if use_tasks:
+                        weighted_task_loss, task_losses = task_loss(task_outputs[0], anchor_labels)
+                        total_loss = total_loss + weighted_task_loss
                 
-                # 对比损失
-                contrastive_loss = contrastive_criterion(anchor_embeddings, pair_embeddings, similarities)
+                with profiler.stage('backward'):
+                    (total_loss / accumulate_steps).backward()
                 
-                # 总损失
-                total_loss = (1 - contrastive_weight) * classification_loss + contrastive_weight * contrastive_loss
+                with profiler.stage('metrics'):
+                    train_metrics.update(anchor_outputs, anchor_labels, loss=total_loss,
+                                         contrastive_loss=contrastive_loss,
+                                         **{f'task_{name}': loss for name, loss in task_losses.items()})
                 
-                total_loss.backward()
-                optimizer.step()
+            elif margin_loss is not None:
+                # 大规模身份模式：嵌入向量上的间隔损失，分类头只取本batch采样到的类别
+                images, labels = batch_data
+                with profiler.stage('h2d'):
+                    images, labels = images.to(device), labels.to(device)
+                if augment is not None:
+                    with profiler.stage('augment'):
+                        images = augment(images)
                 
-                running_loss += total_loss.item()
-                running_contrastive_loss += contrastive_loss.item()
+                with profiler.stage('forward'):
+                    embeddings = model.embedding(model.backbone(images))
+                    loss, sampled_logits, sampled_labels = margin_loss(embeddings, labels, model.classifier)
+                with profiler.stage('backward'):
+                    (loss / accumulate_steps).backward()
                 
-                # 计算准确率
-                _, predicted = torch.max(anchor_outputs.data, 1)
-                total_samples += anchor_labels.size(0)
-                correct_predictions += (predicted == anchor_labels).sum().item()
+                with profiler.stage('metrics'):
+                    train_metrics.update(sampled_logits, sampled_labels, loss=loss)
                 
             else:
                 # 标准分类模式
                 images, labels = batch_data
-                images, labels = images.to(device), labels.to(device)
+                with profiler.stage('h2d'):
+                    images, labels = images.to(device), labels.to(device)
+                if augment is not None:
+                    with profiler.stage('augment'):
+                        images = augment(images)
                 
-                optimizer.zero_grad()
-                outputs = model(images)
-                loss = criterion(outputs, labels)
-                loss.backward()
-                optimizer.step()
+                with profiler.stage('forward'):
+                    outputs = model(images)
+                    if sample_skipper is not None:
+                        per_sample_loss = F.cross_entropy(outputs, labels, reduction='none')
+                        loss = per_sample_loss.mean()
+                    else:
+                        loss = criterion(outputs, labels)
+                with profiler.stage('backward'):
+                    (loss / accumulate_steps).backward()
                 
-                running_loss += loss.item()
-                _, predicted = torch.max(outputs.data, 1)
-                total_samples += labels.size(0)
-                correct_predictions += (predicted == labels).sum().item()
+                with profiler.stage('metrics'):
+                    train_metrics.update(outputs, labels, loss=loss)
             
-            # 更新进度条
-            current_accuracy = 100 * correct_predictions / total_samples
-            postfix = {'Loss': f'{running_loss/(batch_idx+1):.4f}', 'Acc': f'{current_accuracy:.2f}%'}
-            if contrastive_learning:
-                postfix['ContLoss'] = f'{running_contrastive_loss/(batch_idx+1):.4f}'
-            train_pbar.set_postfix(postfix)
+            if sample_skipper is not None:
+                with profiler.stage('metrics'):
+                    sample_skipper.update(batch_idx, per_sample_loss)
+            
+            if should_step:
+                with profiler.stage('optimizer'):
+                    for optimizer in optimizers:
+                        optimizer.step()
+                        optimizer.zero_grad()
+            
+            # 更新进度条（按时间节流）
+            with profiler.stage('metrics'):
+                train_metrics.show_progress(train_pbar, progress_fields)
+            profiler.end_step()
+        
+        profiler.end_epoch()
         
-        # 计算训练指标
-        epoch_train_loss = running_loss / len(train_loader)
-        epoch_train_accuracy = 100 * correct_predictions / total_samples
-        epoch_contrastive_loss = running_contrastive_loss / len(train_loader) if contrastive_learning else 0
+        # 计算训练指标（epoch结束时同步一次）
+        epoch_train = train_metrics.compute()
+        if sample_skipper is not None:
+            skip_stats = sample_skipper.end_epoch()
+        if resize_schedule is not None:
+            resize_schedule.end_epoch()
+        epoch_train_loss = epoch_train['loss']
+        epoch_train_accuracy = epoch_train['accuracy']
+        epoch_contrastive_loss = epoch_train['contrastive_loss'] if contrastive_learning else 0
         
         # 验证阶段
         model.eval()
-        val_running_loss = 0.0
-        val_correct_predictions = 0
-        val_total_samples = 0
+        val_metrics.reset()
         
         with torch.no_grad():
             val_pbar = tqdm(val_loader, desc=f'Epoch {epoch+1}/{num_epochs} [Val]')
             for images, labels in val_pbar:
                 images, labels = images.to(device), labels.to(device)
                 
-                if contrastive_learning:
+                val_task_losses = {}
+                if use_tasks:
+                    # 验证时同时评估各任务头
+                    _, outputs, _, task_outputs = model(images, return_tasks=True)
+                    _, val_task_losses = task_loss(task_outputs, labels)
+                elif contrastive_learning:
                     # 验证时只使用分类输出
                     outputs = model(images)  # 推理模式下只返回分类结果
                 else:
@@ -452,21 +681,16 @@ def train_model(model, train_loader, val_loader, num_epochs=50, learning_rate=0.
                     
                 loss = criterion(outputs, labels)
                 
-                val_running_loss += loss.item()
-                _, predicted = torch.max(outputs.data, 1)
-                val_total_samples += labels.size(0)
-                val_correct_predictions += (predicted == labels).sum().item()
+                val_metrics.update(outputs, labels, loss=loss,
+                                   **{f'task_{name}': value for name, value in val_task_losses.items()})
                 
                 # 更新进度条
-                current_val_accuracy = 100 * val_correct_predictions / val_total_samples
-                val_pbar.set_postfix({
-                    'Loss': f'{val_running_loss/(len(val_pbar)-len(val_loader)+len(val_pbar)):.4f}',
-                    'Acc': f'{current_val_accuracy:.2f}%'
-                })
+                val_metrics.show_progress(val_pbar, {'Loss': 'loss', 'Acc': 'accuracy'})
         
         # 计算验证指标
-        epoch_val_loss = val_running_loss / len(val_loader)
-        epoch_val_accuracy = 100 * val_correct_predictions / val_total_samples
+        epoch_val = val_metrics.compute()
+        epoch_val_loss = epoch_val['loss']
+        epoch_val_accuracy = epoch_val['accuracy']
         
         # 保存最佳模型
         if epoch_val_accuracy > best_val_accuracy:
@@ -480,6 +704,9 @@ def train_model(model, train_loader, val_loader, num_epochs=50, learning_rate=0.
         val_accuracies.append(epoch_val_accuracy)
         if contrastive_learning:
             contrastive_losses.append(epoch_contrastive_loss)
+        for name in task_names:
+            task_history[name]['train'].append(epoch_train[name])
+            task_history[name]['val'].append(epoch_val[name])
         
         # 打印epoch结果
         print(f'Epoch {epoch+1}/{num_epochs}:')
@@ -487,11 +714,35 @@ def train_model(model, train_loader, val_loader, num_epochs=50, learning_rate=0.
         if contrastive_learning:
             print(f'  Contrastive Loss: {epoch_contrastive_loss:.4f}')
         print(f'  Val Loss: {epoch_val_loss:.4f}, Val Acc: {epoch_val_accuracy:.2f}%')
+        for name in task_names:
+            print(f'  {name[len("task_"):]} Loss: train {epoch_train[name]:.4f}, val {epoch_val[name]:.4f}')
         print(f'  Best Val Acc: {best_val_accuracy:.2f}%')
+        if sample_skipper is not None:
+            print(f"  训练样本: {skip_stats['samples']}/{len(train_loader.dataset)}"
+                  f"{' (全量)' if skip_stats['full_pass'] else ''}, 简单样本 {skip_stats['easy']}, "
+                  f"训练阶段 {skip_stats['seconds']:.1f}秒")
         print('-' * 50)
         
         # 更新学习率
-        scheduler.step()
+        for scheduler in schedulers:
+            scheduler.step()
+    
+    profiler.close()
+    
+    if sample_skipper is not None:
+        skip_summary = sample_skipper.summary()
+        if skip_summary['speedup'] is None:
+            speedup = "有分辨率阶段没有全量epoch，无法估计加速"
+        else:
+            speedup = f"按全量epoch估计 {skip_summary['full_pass_seconds']:.1f}秒，加速 {skip_summary['speedup']:.2f}x"
+        print(f"跳过简单样本: 共训练 {skip_summary['samples_trained']}/{skip_summary['samples_full']} 个样本 "
+              f"({skip_summary['sample_fraction'] * 100:.1f}%)，训练阶段 {skip_summary['train_seconds']:.1f}秒，{speedup}")
+    if resize_schedule is not None:
+        print("渐进分辨率各阶段训练耗时:")
+        for phase in resize_schedule.summary():
+            epochs = phase['end_epoch'] - phase['start_epoch']
+            print(f"  {phase['size']}x{phase['size']} (batch {phase['batch_size']}): {epochs} 个epoch, "
+                  f"{phase['train_seconds']:.1f}秒, 平均 {phase['train_seconds'] / max(1, epochs):.1f}秒/epoch")
     
     # 加载最佳模型
     if best_model_state is not None:
@@ -508,70 +759,329 @@ def train_model(model, train_loader, val_loader, num_epochs=50, learning_rate=0.
     
     if contrastive_learning:
         history['contrastive_losses'] = contrastive_losses
+    if sample_skipper is not None:
+        history['sample_skipping'] = skip_summary
+    if resize_schedule is not None:
+        history['resize_schedule'] = resize_schedule.summary()
+    if use_tasks:
+        history['task_losses'] = {name[len('task_'):]: values for name, values in task_history.items()}
     
     return model, history
 
+class DistillationLoss(nn.Module):
+    """知识蒸馏损失：软标签KL散度 + 硬标签交叉熵 + 嵌入关系匹配
+    
+    嵌入匹配比较的是batch内样本两两之间的余弦相似度矩阵，与维度无关，
+    因此教师可以是ResNet18Contrastive（128维嵌入）或标准ResNet18（512维池化特征）。
+    """
+    
+    def __init__(self, temperature=4.0, alpha=0.7, embedding_weight=1.0):
+        super(DistillationLoss, self).__init__()
+        self.temperature = temperature
+        self.alpha = alpha
+        self.embedding_weight = embedding_weight
+        
+    def forward(self, student_embeddings, student_logits, teacher_embeddings, teacher_logits, labels):
+        T = self.temperature
+        soft_loss = F.kl_div(
+            F.log_softmax(student_logits / T, dim=1),
+            F.softmax(teacher_logits / T, dim=1),
+            reduction='batchmean'
+        ) * (T * T)
+        hard_loss = F.cross_entropy(student_logits, labels)
+        
+        student_norm = F.normalize(student_embeddings, p=2, dim=1)
+        teacher_norm = F.normalize(teacher_embeddings, p=2, dim=1)
+        embedding_loss = F.mse_loss(student_norm @ student_norm.t(), teacher_norm @ teacher_norm.t())
+        
+        total = self.alpha * soft_loss + (1 - self.alpha) * hard_loss + self.embedding_weight * embedding_loss
+        return total, embedding_loss
+
+def teacher_forward(teacher, images):
+    """教师模型前向：返回(嵌入向量, 分类结果)"""
+    if hasattr(teacher, 'embedding'):
+        embeddings = teacher.embedding(teacher.backbone(images))
+        return embeddings, teacher.classifier(embeddings)
+    
+    # 标准ResNet18：使用fc之前的池化特征作为嵌入
+    x = teacher.maxpool(teacher.relu(teacher.bn1(teacher.conv1(images))))
+    x = teacher.layer4(teacher.layer3(teacher.layer2(teacher.layer1(x))))
+    features = torch.flatten(teacher.avgpool(x), 1)
+    return features, teacher.fc(features)
+
+def create_student_model(num_classes, arch='mobilenet_v3_small', embedding_dim=128, width_multiplier=0.5,
+                         preprocessing=None):
+    """创建蒸馏用的学生模型（全部参数可训练），输入预处理与教师模型一致"""
+    preprocessing = preprocessing or get_preprocessing_config()
+    model = StudentModel(num_classes, arch=arch, embedding_dim=embedding_dim, width_multiplier=width_multiplier,
+                         in_channels=preprocessing['channels'])
+    model.preprocessing = preprocessing
+    return model
+
+def distill_model(student, teacher, train_loader, val_loader, num_epochs=50, learning_rate=0.001, device='cuda',
+                  temperature=4.0, alpha=0.7, embedding_weight=1.0, profiler=None, accumulate_steps=1, augment=None):
+    """知识蒸馏训练：教师模型冻结，学生模型学习教师的软标签和嵌入结构
+    
+    返回的history与train_model格式一致，embedding_losses记录嵌入匹配损失。
+    accumulate_steps: 梯度累积步数
+    augment: 可选的设备端批量增强，教师和学生看到同一增强结果
+    """
+    
+    student = student.to(device)
+    teacher = teacher.to(device)
+    teacher.eval()
+    for param in teacher.parameters():
+        param.requires_grad = False
+    if profiler is None:
+        profiler = TrainingProfiler(enabled=False)
+    
+    criterion = nn.CrossEntropyLoss()
+    distill_criterion = DistillationLoss(temperature, alpha, embedding_weight)
+    optimizer = optim.Adam(student.parameters(), lr=learning_rate, weight_decay=1e-5)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=max(1, num_epochs//4), eta_min=learning_rate*0.01)
+    
+    history = {
+        'train_losses': [],
+        'train_accuracies': [],
+        'val_losses': [],
+        'val_accuracies': [],
+        'embedding_losses': [],
+        'best_val_accuracy': 0.0
+    }
+    best_model_state = None
+    
+    print(f"开始知识蒸馏，设备: {device}")
+    print(f"学生模型: {student.arch}, 温度: {temperature}, 软标签权重: {alpha}, 嵌入匹配权重: {embedding_weight}")
+    print("-" * 50)
+    
+    train_metrics = MetricAccumulator(device, ('loss', 'embedding_loss'))
+    val_metrics = MetricAccumulator(device, ('loss',))
+    
+    for epoch in range(num_epochs):
+        student.train()
+        train_metrics.reset()
+        
+        profiler.begin_epoch(epoch + 1)
+        train_pbar = tqdm(profiler.wrap_loader(train_loader), total=len(train_loader),
+                          desc=f'Epoch {epoch+1}/{num_epochs} [Distill]')
+        optimizer.zero_grad()
+        for batch_idx, (images, labels) in enumerate(train_pbar):
+            with profiler.stage('h2d'):
+                images, labels = images.to(device), labels.to(device)
+            if augment is not None:
+                with profiler.stage('augment'):
+                    images = augment(images)
+            
+            with profiler.stage('forward'):
+                with torch.no_grad():
+                    teacher_embeddings, teacher_logits = teacher_forward(teacher, images)
+                student_embeddings, student_logits = student(images)
+                loss, embedding_loss = distill_criterion(
+                    student_embeddings, student_logits, teacher_embeddings, teacher_logits, labels
+                )
+            with profiler.stage('backward'):
+                (loss / accumulate_steps).backward()
+            if (batch_idx + 1) % accumulate_steps == 0 or batch_idx + 1 == len(train_loader):
+                with profiler.stage('optimizer'):
+                    optimizer.step()
+                    optimizer.zero_grad()
+            
+            with profiler.stage('metrics'):
+                train_metrics.update(student_logits, labels, loss=loss, embedding_loss=embedding_loss)
+                train_metrics.show_progress(train_pbar, {'Loss': 'loss', 'Acc': 'accuracy'})
+            profiler.end_step()
+        profiler.end_epoch()
+        epoch_train = train_metrics.compute()
+        
+        # 验证阶段
+        student.eval()
+        val_metrics.reset()
+        with torch.no_grad():
+            for images, labels in tqdm(val_loader, desc=f'Epoch {epoch+1}/{num_epochs} [Val]'):
+                images, labels = images.to(device), labels.to(device)
+                outputs = student(images)
+                val_metrics.update(outputs, labels, loss=criterion(outputs, labels))
+        epoch_val = val_metrics.compute()
+        
+        epoch_val_accuracy = epoch_val['accuracy']
+        if epoch_val_accuracy > history['best_val_accuracy']:
+            history['best_val_accuracy'] = epoch_val_accuracy
+            best_model_state = {k: v.clone() for k, v in student.state_dict().items()}
+        
+        history['train_losses'].append(epoch_train['loss'])
+        history['train_accuracies'].append(epoch_train['accuracy'])
+        history['val_losses'].append(epoch_val['loss'])
+        history['val_accuracies'].append(epoch_val_accuracy)
+        history['embedding_losses'].append(epoch_train['embedding_loss'])
+        
+        print(f'Epoch {epoch+1}/{num_epochs}:')
+        print(f'  Distill Loss: {history["train_losses"][-1]:.4f}, Train Acc: {history["train_accuracies"][-1]:.2f}%')
+        print(f'  Embedding Loss: {history["embedding_losses"][-1]:.4f}')
+        print(f'  Val Loss: {history["val_losses"][-1]:.4f}, Val Acc: {epoch_val_accuracy:.2f}%')
+        print(f'  Best Val Acc: {history["best_val_accuracy"]:.2f}%')
+        print('-' * 50)
+        
+        scheduler.step()
+    
+    profiler.close()
+    
+    if best_model_state is not None:
+        student.load_state_dict(best_model_state)
+        print(f"已加载最佳学生模型 (验证准确率: {history['best_val_accuracy']:.2f}%)")
+    
+    return student, history
+
+def measure_model_profile(model, val_loader, device='cpu', latency_runs=50):
+    """测量模型的验证准确率、参数量、ONNX文件大小和单帧CPU推理延迟"""
+    import tempfile
+    import time
+    
+    model = model.to(device)
+    model.eval()
+    
+    correct = 0
+    total = 0
+    with torch.no_grad():
+        for images, labels in val_loader:
+            images, labels = images.to(device), labels.to(device)
+            predicted = model(images).argmax(dim=1)
+            correct += (predicted == labels).sum().item()
+            total += labels.size(0)
+    
+    model_cpu = model.to('cpu')
+    dummy_input = torch.randn(get_input_shape(getattr(model, 'preprocessing', None)))
+    
+    # 单帧延迟（与门禁终端逐帧推理的场景一致）
+    with torch.no_grad():
+        for _ in range(5):
+            model_cpu(dummy_input)
+        timings = []
+        for _ in range(latency_runs):
+            start = time.perf_counter()
+            model_cpu(dummy_input)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        onnx_path = os.path.join(tmp_dir, 'model.onnx')
+        torch.onnx.export(model_cpu, dummy_input, onnx_path, export_params=True, opset_version=11,
+                          do_constant_folding=True, input_names=['input'], output_names=['output'])
+        # 统计目录内全部文件，兼容权重以外部数据形式保存的情况
+        onnx_size_mb = sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir)) / 1024 / 1024
+    
+    model.to(device)
+    return {
+        'val_accuracy': 100.0 * correct / total if total > 0 else 0.0,
+        'num_parameters': sum(p.numel() for p in model.parameters()),
+        'onnx_size_mb': onnx_size_mb,
+        'cpu_latency_ms_p50': timings[len(timings) // 2],
+        'cpu_latency_ms_p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    }
+
+def create_distillation_report(teacher, student, val_loader, device='cpu', save_path='.'):
+    """生成教师/学生模型的准确率、大小和延迟对比报告"""
+    
+    print("\n正在生成蒸馏对比报告...")
+    teacher_profile = measure_model_profile(teacher, val_loader, device)
+    student_profile = measure_model_profile(student, val_loader, device)
+    
+    report = {
+        'student_architecture': student.get_config(),
+        'teacher': teacher_profile,
+        'student': student_profile,
+        'size_ratio': student_profile['onnx_size_mb'] / teacher_profile['onnx_size_mb'],
+        'speedup': teacher_profile['cpu_latency_ms_p50'] / student_profile['cpu_latency_ms_p50'],
+        'accuracy_delta': student_profile['val_accuracy'] - teacher_profile['val_accuracy']
+    }
+    
+    print(f"\n{'='*70}")
+    print("📦 知识蒸馏对比报告")
+    print(f"{'='*70}")
+    print(f"{'模型':<10}{'验证准确率':>12}{'参数量(M)':>12}{'ONNX(MB)':>12}{'P50延迟(ms)':>14}")
+    for name, profile in (('教师', teacher_profile), ('学生', student_profile)):
+        print(f"{name:<10}{profile['val_accuracy']:>11.2f}%{profile['num_parameters']/1e6:>12.2f}"
+              f"{profile['onnx_size_mb']:>12.2f}{profile['cpu_latency_ms_p50']:>14.2f}")
+    print(f"体积比例: {report['size_ratio']:.2%}, 加速比: {report['speedup']:.2f}x, "
+          f"准确率变化: {report['accuracy_delta']:+.2f}%")
+    
+    os.makedirs(save_path, exist_ok=True)
+    report_path = os.path.join(save_path, 'distillation_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"蒸馏报告已保存到: {report_path}")
+    
+    return report
+
+def per_class_counts(labels, predictions, num_classes):
+    """每个类别的样本数和正确数（设备上用bincount统计，内存为O(类别数)，不逐样本同步）"""
+    total = torch.bincount(labels, minlength=num_classes)
+    correct = torch.bincount(labels[predictions == labels], minlength=num_classes)
+    return correct.cpu().numpy(), total.cpu().numpy()
+
 def evaluate_model(model, test_loader, class_names, device='cuda'):
-    """评估模型性能 - 提供详细的每类别准确度报告"""
+    """评估模型性能 - 提供详细的每类别准确度报告
+    
+    身份数超过PER_CLASS_REPORT_LIMIT时不生成逐类别报告和混淆矩阵（类别数平方的内存），只打印汇总和表现最差的身份
+    """
     
     model.eval()
     all_preds = []
     all_labels = []
-    class_correct = {}
-    class_total = {}
-    
-    # 初始化每个类别的统计
-    for i, class_name in enumerate(class_names):
-        class_correct[i] = 0
-        class_total[i] = 0
+    num_classes = len(class_names)
     
     with torch.no_grad():
         for data, target in tqdm(test_loader, desc='Evaluating'):
             data, target = data.to(device), target.to(device)
             
-            # 根据模型类型获取输出
-            if hasattr(model, 'classifier'):
-                # 对比学习模型在推理时只返回分类结果
-                output = model(data)
-            else:
-                # 标准ResNet模型
-                output = model(data)
+            # 对比学习模型在推理时只返回分类结果，与标准ResNet模型相同
+            output = model(data)
             
-            pred = output.argmax(dim=1, keepdim=True)
-            all_preds.extend(pred.cpu().numpy().flatten())
-            all_labels.extend(target.cpu().numpy())
-            
-            # 统计每个类别的正确预测数
-            for i in range(target.size(0)):
-                label = target[i].item()
-                prediction = pred[i].item()
-                class_total[label] += 1
-                if label == prediction:
-                    class_correct[label] += 1
+            # 预测结果留在设备上，评估结束时统一统计
+            all_preds.append(output.argmax(dim=1))
+            all_labels.append(target)
     
-    # 计算整体准确率
-    accuracy = accuracy_score(all_labels, all_preds)
+    all_preds = torch.cat(all_preds)
+    all_labels = torch.cat(all_labels)
+    class_correct, class_total = per_class_counts(all_labels, all_preds, num_classes)
     
-    # 生成分类报告
-    classification_rep = classification_report(
-        all_labels, all_preds, 
-        target_names=class_names,
-        digits=4
-    )
-    
-    # 生成混淆矩阵
-    conf_matrix = confusion_matrix(all_labels, all_preds)
+    # 计算整体准确率
+    accuracy = class_correct.sum() / max(1, class_total.sum())
+    
+    classification_rep = None
+    conf_matrix = None
+    if num_classes <= PER_CLASS_REPORT_LIMIT:
+        labels_np, preds_np = all_labels.cpu().numpy(), all_preds.cpu().numpy()
+        # 生成分类报告
+        classification_rep = classification_report(
+            labels_np, preds_np,
+            labels=list(range(num_classes)),
+            target_names=class_names,
+            digits=4,
+            zero_division=0
+        )
+        
+        # 生成混淆矩阵
+        conf_matrix = confusion_matrix(labels_np, preds_np, labels=list(range(num_classes)))
     
     # 生成详细的每类别准确度报告
     print("\n" + "="*60)
     print("📊 每个类别详细准确度报告")
     print("="*60)
     
-    for i, class_name in enumerate(class_names):
+    tested = np.flatnonzero(class_total > 0)
+    class_accuracy = np.zeros(num_classes)
+    class_accuracy[tested] = 100.0 * class_correct[tested] / class_total[tested]
+    if num_classes <= PER_CLASS_REPORT_LIMIT:
+        shown = range(num_classes)
+    else:
+        # 身份较多时只列出准确率最低的身份
+        shown = tested[np.argsort(class_accuracy[tested], kind='stable')[:10]]
+        print(f"共 {num_classes} 个身份（{len(tested)} 个有测试样本），准确率最低的 {len(shown)} 个:")
+    for i in shown:
+        class_name = class_names[i]
         if class_total[i] > 0:
-            class_accuracy = 100.0 * class_correct[i] / class_total[i]
-            print(f"{class_name:>8}: {class_correct[i]:>3}/{class_total[i]:>3} = {class_accuracy:>6.2f}% "
-                  f"{'✅' if class_accuracy >= 90 else '⚠️' if class_accuracy >= 70 else '❌'}")
+            print(f"{class_name:>8}: {class_correct[i]:>3}/{class_total[i]:>3} = {class_accuracy[i]:>6.2f}% "
+                  f"{'✅' if class_accuracy[i] >= 90 else '⚠️' if class_accuracy[i] >= 70 else '❌'}")
         else:
             print(f"{class_name:>8}: 无测试样本")
     
@@ -579,23 +1089,19 @@ def evaluate_model(model, test_loader, class_names, device='cuda'):
     print(f"总体准确率: {accuracy*100:.2f}%")
     
     # 找出表现最好和最差的类别
-    class_accuracies = []
-    for i, class_name in enumerate(class_names):
-        if class_total[i] > 0:
-            acc = 100.0 * class_correct[i] / class_total[i]
-            class_accuracies.append((class_name, acc, class_total[i]))
-    
-    if class_accuracies:
-        class_accuracies.sort(key=lambda x: x[1], reverse=True)
-        best_class = class_accuracies[0]
-        worst_class = class_accuracies[-1]
+    if len(tested) > 0:
+        best = tested[np.argmax(class_accuracy[tested])]
+        worst = tested[np.argmin(class_accuracy[tested])]
         
-        print(f"\n🏆 最佳表现: {best_class[0]} ({best_class[1]:.2f}%, {best_class[2]}样本)")
-        print(f"⚠️  待改进: {worst_class[0]} ({worst_class[1]:.2f}%, {worst_class[2]}样本)")
+        print(f"\n🏆 最佳表现: {class_names[best]} ({class_accuracy[best]:.2f}%, {class_total[best]}样本)")
+        print(f"⚠️  待改进: {class_names[worst]} ({class_accuracy[worst]:.2f}%, {class_total[worst]}样本)")
         
         # 计算类别间准确率差异
-        acc_diff = best_class[1] - worst_class[1]
+        acc_diff = class_accuracy[best] - class_accuracy[worst]
         print(f"📈 类别差异: {acc_diff:.2f}% ({'良好' if acc_diff <= 10 else '较大' if acc_diff <= 20 else '显著'})")
+        if num_classes > PER_CLASS_REPORT_LIMIT:
+            print(f"📉 身份准确率分布: 中位数 {np.median(class_accuracy[tested]):.2f}%, "
+                  f"低于90%的身份 {int((class_accuracy[tested] < 90).sum())} 个")
     
     return accuracy * 100, classification_rep, conf_matrix
 
@@ -685,31 +1191,34 @@ def plot_confusion_matrix_results(conf_matrix, class_names):
     
     print("混淆矩阵已保存为 'confusion_matrix.png'")
 
-def final_test_model(model, dataset_path, class_names, device='cuda', samples_per_user=100):
-    """最终测试：从每个用户全部数据中随机抽取指定数量图像进行识别"""
+def final_test_model(model, dataset_path, class_names, device='cuda', samples_per_user=100, batch_size=64,
+                     num_workers=2):
+    """最终测试：从每个用户全部数据中随机抽取指定数量图像进行识别
+    
+    所有抽样图像批量推理，按身份的正确数用bincount统计；身份较多时只打印汇总和表现最差的身份
+    num_workers: DataLoader worker数（main中与训练时的DataLoader配置相同）
+    """
     
     # 确保模型在正确的设备上
     model = model.to(device)
     model.eval()
     
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                           std=[0.229, 0.224, 0.225])
-    ])
-    
-    total_correct = 0
-    total_samples = 0
-    user_results = {}
+    # 与训练时相同的预处理
+    preprocessing = getattr(model, 'preprocessing', None) or get_preprocessing_config()
+    _, transform = create_data_transforms(preprocessing['input_mode'], preprocessing['resize'][0])
+    image_mode = get_image_mode(preprocessing['input_mode'])
     
     print(f"\n🔬 最终测试：每用户抽取 {samples_per_user} 张图像")
     print("=" * 60)
     
+    test_paths = []
+    test_labels = []
+    tested_users = []
     for user_idx, user_id in enumerate(class_names):
         user_dir = os.path.join(dataset_path, user_id)
         if not os.path.exists(user_dir):
             continue
+        tested_users.append(user_idx)
             
         # 获取该用户的所有图像
         user_images = []
@@ -721,53 +1230,49 @@ def final_test_model(model, dataset_path, class_names, device='cuda', samples_pe
             selected_images = random.sample(user_images, samples_per_user)
         else:
             selected_images = user_images
-            
-        correct = 0
-        total = len(selected_images)
-        
-        # 逐张预测
-        with torch.no_grad():
-            for img_path in selected_images:
-                try:
-                    image = Image.open(img_path).convert('RGB')
-                    image_tensor = transform(image).unsqueeze(0).to(device)
-                    
-                    # 获取预测
-                    if hasattr(model, 'embedding'):
-                        # 对比学习模式 - 推理时只返回分类结果
-                        outputs = model(image_tensor)
-                    else:
-                        # 标准ResNet模式
-                        outputs = model(image_tensor)
-                    
-                    pred = torch.argmax(outputs, dim=1).item()
-                    
-                    if pred == user_idx:
-                        correct += 1
-                        
-                except Exception as e:
-                    print(f"处理图像错误 {img_path}: {e}")
-                    total -= 1
-                    
-        accuracy = (correct / total * 100) if total > 0 else 0
-        user_results[user_id] = {
+        test_paths.extend(selected_images)
+        test_labels.extend([user_idx] * len(selected_images))
+    
+    # 批量预测（读取失败的图像由GaitDataset以零图像代替）
+    dataset = GaitDataset(test_paths, test_labels, transform, image_mode=image_mode)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    predictions = []
+    with torch.no_grad():
+        for images, _ in loader:
+            predictions.append(model(images.to(device)).argmax(dim=1))
+    predictions = torch.cat(predictions) if predictions else torch.zeros(0, dtype=torch.long, device=device)
+    labels = torch.tensor(test_labels, dtype=torch.long, device=device)
+    correct_counts, total_counts = per_class_counts(labels, predictions, len(class_names))
+    
+    user_results = {}
+    for user_idx in tested_users:
+        correct, total = int(correct_counts[user_idx]), int(total_counts[user_idx])
+        user_results[class_names[user_idx]] = {
             'correct': correct,
             'total': total,
-            'accuracy': accuracy
+            'accuracy': (correct / total * 100) if total > 0 else 0
         }
-        
-        # 显示结果
+    
+    # 显示结果（身份较多时只显示准确率最低的10个）
+    shown = list(user_results.items())
+    if len(shown) > PER_CLASS_REPORT_LIMIT:
+        shown = sorted(shown, key=lambda x: x[1]['accuracy'])[:10]
+        print(f"共 {len(user_results)} 个身份，准确率最低的 {len(shown)} 个:")
+    for user_id, result in shown:
+        accuracy = result['accuracy']
         status = "✅" if accuracy >= 95 else "⚠️" if accuracy >= 90 else "❌"
-        print(f"    {user_id}: {correct:3d}/{total:3d} = {accuracy:6.2f}% {status}")
-        
-        total_correct += correct
-        total_samples += total
+        print(f"    {user_id}: {result['correct']:3d}/{result['total']:3d} = {accuracy:6.2f}% {status}")
     
+    total_correct = int(correct_counts.sum())
+    total_samples = int(total_counts.sum())
     overall_accuracy = (total_correct / total_samples * 100) if total_samples > 0 else 0
     
     print("=" * 60)
     print(f"📊 最终测试结果: {total_correct}/{total_samples} = {overall_accuracy:.2f}%")
     
+    if not user_results:
+        return overall_accuracy, user_results
+    
     # 找出最好和最差表现
     best_user = max(user_results.items(), key=lambda x: x[1]['accuracy'])
     worst_user = min(user_results.items(), key=lambda x: x[1]['accuracy'])
@@ -778,17 +1283,43 @@ def final_test_model(model, dataset_path, class_names, device='cuda', samples_pe
     
     return overall_accuracy, user_results
 
-def save_model_for_web(model, class_names, save_path='../public/models/resnet18_identity'):
-    """保存模型用于Web部署"""
+def save_model_for_web(model, class_names, save_path='../public/models/resnet18_identity', bundle_fp16=False):
+    """保存模型用于Web部署
+    
+    除完整ONNX文件外，还在web_bundle/下生成分块压缩的Web模型包；bundle_fp16为True时权重存为float16
+    """
     
     os.makedirs(save_path, exist_ok=True)
     
     # 保存PyTorch模型
-    torch.save({
+    preprocessing = getattr(model, 'preprocessing', None) or get_preprocessing_config()
+    checkpoint = {
         'model_state_dict': model.state_dict(),
         'class_names': class_names,
-        'num_classes': len(class_names)
-    }, os.path.join(save_path, 'resnet18_identity.pth'))
+        'num_classes': len(class_names),
+        'preprocessing': preprocessing
+    }
+    if isinstance(model, StudentModel):
+        # 学生模型需要结构参数才能在转换脚本中重建
+        checkpoint['architecture'] = model.arch
+        checkpoint['model_config'] = model.get_config()
+    elif hasattr(model, 'embedding'):
+        # 记录结构参数，转换脚本据此直接重建结构，不需要从权重推断
+        checkpoint['architecture'] = 'resnet18_contrastive'
+        checkpoint['embedding_dim'] = model.embedding[3].out_features
+        if isinstance(model.classifier, CosineClassifier):
+            checkpoint['classifier_type'] = 'cosine'
+    else:
+        checkpoint['architecture'] = 'resnet18'
+    if getattr(model, 'pruned_channels', None):
+        # 剪枝模型记录各block的中间通道数
+        checkpoint['pruned_channels'] = model.pruned_channels
+    if len(getattr(model, 'exit_heads', {})) > 0:
+        checkpoint['exit_layers'] = list(model.exit_heads.keys())
+    if len(getattr(model, 'task_heads', {})) > 0:
+        # 任务头配置（不含标签），转换脚本和推理端据此重建输出头、解释各输出
+        checkpoint['tasks'] = model.task_config
+    torch.save(checkpoint, os.path.join(save_path, 'resnet18_identity.pth'))
     
     print(f"PyTorch模型已保存到: {save_path}/resnet18_identity.pth")
     
@@ -799,33 +1330,33 @@ def save_model_for_web(model, class_names, save_path='../public/models/resnet18_
     
     print(f"类别映射已保存到: {save_path}/class_mapping.json")
     
+    # 保存模型元数据（含输入预处理说明）
+    from convert_to_tfjs import create_model_metadata
+    create_model_metadata(class_names, save_path, preprocessing, tasks=getattr(model, 'task_config', None))
+    
     # 导出为ONNX格式（用于后续转换为TensorFlow.js）
     try:
         model.eval()
         
         # 检查模型设备并确保输入输出在同一设备
-        device = next(model.parameters()).device
-        dummy_input = torch.randn(1, 3, 224, 224).to(device)
-        
         # 将模型移动到CPU进行ONNX导出（避免设备不匹配）
         model_cpu = model.to('cpu')
-        dummy_input_cpu = torch.randn(1, 3, 224, 224)
+        dummy_input_cpu = torch.randn(get_input_shape(preprocessing))
         
         onnx_path = os.path.join(save_path, 'resnet18_identity.onnx')
         
+        # 带任务头时为多输出：身份logits('output')在前，其后为各任务
+        output_names = export_output_names(model_cpu)
         torch.onnx.export(
-            model_cpu,
+            export_wrapper(model_cpu),
             dummy_input_cpu,
             onnx_path,
             export_params=True,
             opset_version=11,
             do_constant_folding=True,
             input_names=['input'],
-            output_names=['output'],
-            dynamic_axes={
-                'input': {0: 'batch_size'},
-                'output': {0: 'batch_size'}
-            }
+            output_names=output_names,
+            dynamic_axes={name: {0: 'batch_size'} for name in ['input'] + output_names}
         )
         
         print(f"ONNX模型已保存到: {onnx_path}")
@@ -834,6 +1365,23 @@ def save_model_for_web(model, class_names, save_path='../public/models/resnet18_
         print(f"onnx-tf convert -i {onnx_path} -o {save_path}/tf_model")
         print(f"tensorflowjs_converter --input_format=tf_saved_model --output_format=tfjs_graph_model {save_path}/tf_model {save_path}")
         
+        # 分块、预压缩的Web模型包（浏览器端按块并行下载和缓存）
+        try:
+            from web_bundle import build_web_bundle, prune_stale_chunks
+            bundle_dir = os.path.join(save_path, 'web_bundle')
+            manifest = build_web_bundle(onnx_path, bundle_dir, fp16=bundle_fp16)
+            # 与web_bundle.py命令行默认行为一致，删除上一版本不再引用的数据块
+            removed = prune_stale_chunks(bundle_dir, manifest)
+            if removed:
+                print(f"已删除 {removed} 个旧数据块文件")
+        except Exception as e:
+            print(f"Web模型包生成失败: {e}")
+        
+        if len(getattr(model, 'exit_heads', {})) > 0:
+            # 提前退出模型额外导出分段ONNX，阈值通过 early_exit.py 评估后写入
+            from early_exit import export_early_exit_onnx
+            export_early_exit_onnx(model_cpu, os.path.join(save_path, 'early_exit'), get_input_shape(preprocessing))
+        
     except Exception as e:
         print(f"ONNX导出失败: {e}")
         print("PyTorch模型已保存，可以手动进行转换")
@@ -843,14 +1391,16 @@ def main():
     parser = argparse.ArgumentParser(description='训练ResNet18身份分类器')
     parser.add_argument('--dataset_path', type=str, default='../dataset', 
                        help='数据集路径')
+    parser.add_argument('--manifest', type=str, default=None,
+                       help='训练集只使用清单中列出的图像（{身份: [文件名]}，如coreset_select.py生成的coreset），验证集不受影响')
     parser.add_argument('--epochs', type=int, default=80, 
                        help='训练轮数')
     parser.add_argument('--batch_size', type=int, default=8, 
                        help='批次大小')
     parser.add_argument('--learning_rate', type=float, default=0.0002, 
                        help='学习率')
-    parser.add_argument('--save_path', type=str, default='../public/models/resnet18_identity',
-                       help='模型保存路径')
+    parser.add_argument('--save_path', type=str, default=None,
+                       help='模型保存路径（默认 ../public/models/resnet18_identity，蒸馏模式为 ../public/models/student_<结构>）')
     parser.add_argument('--contrastive', action='store_true',
                        help='启用对比学习模式')
     parser.add_argument('--contrastive_weight', type=float, default=0.5,
@@ -859,9 +1409,97 @@ def main():
                        help='对比学习嵌入维度')
     parser.add_argument('--final_test_samples', type=int, default=100,
                        help='最终测试时每用户抽取的样本数')
+    parser.add_argument('--input_mode', type=str, default='rgb', choices=INPUT_MODES,
+                       help='输入模式: rgb(三通道), gray(灰度单通道), colormap(jet色图反查单通道)')
+    parser.add_argument('--input_size', type=int, default=224,
+                       help='输入分辨率，256为时频图原始分辨率（不重采样），也可用112/128等更低分辨率')
+    parser.add_argument('--distill_teacher', type=str, default=None,
+                       help='教师模型检查点路径，指定后进入知识蒸馏模式')
+    parser.add_argument('--student_arch', type=str, default='mobilenet_v3_small',
+                       choices=STUDENT_ARCHITECTURES, help='学生模型结构')
+    parser.add_argument('--student_width', type=float, default=0.5,
+                       help='resnet18_slim学生模型的通道宽度系数')
+    parser.add_argument('--distill_temperature', type=float, default=4.0,
+                       help='蒸馏软标签温度')
+    parser.add_argument('--distill_alpha', type=float, default=0.7,
+                       help='软标签KL损失权重 (0.0-1.0)，其余为硬标签交叉熵')
+    parser.add_argument('--embedding_loss_weight', type=float, default=1.0,
+                       help='嵌入关系匹配损失权重')
+    parser.add_argument('--early_exit', type=str, default=None,
+                       help='对比学习模式下添加提前退出分支的残差阶段，逗号分隔，例如 layer2,layer3')
+    parser.add_argument('--exit_loss_weight', type=float, default=0.3,
+                       help='每个提前退出分支分类损失的权重')
+    parser.add_argument('--tasks', type=str, default=None,
+                       help='多任务输出头配置(JSON)，如人员类型、步态质量，与身份分类共用一次主干前向（见multi_task.py）')
+    parser.add_argument('--large_identity', '--large-identity', action='store_true',
+                       help='大规模身份模式：P×K身份均衡采样、余弦分类头和采样类别的间隔损失，按嵌入检索评估（见large_identity.py）')
+    parser.add_argument('--margin_loss', type=str, default='cosface', choices=MARGIN_TYPES,
+                       help='大规模身份模式的间隔损失')
+    parser.add_argument('--margin', type=float, default=None,
+                       help='间隔大小（默认cosface 0.35，arcface 0.5）')
+    parser.add_argument('--margin_scale', type=float, default=30.0,
+                       help='余弦logits的缩放系数')
+    parser.add_argument('--sampled_classes', type=int, default=1024,
+                       help='每个batch随机补充的负类别数，0表示使用全部类别')
+    parser.add_argument('--samples_per_identity', type=int, default=4,
+                       help='身份均衡采样中每个身份的样本数K（每个batch的身份数P = batch_size / K）')
+    parser.add_argument('--autotune_loader', '--autotune-loader', action='store_true',
+                       help='自动测量并选择最快的DataLoader worker数、预取深度和算子线程数（结果按机器和数据集缓存）')
+    parser.add_argument('--autotune_cache', type=str, default=DEFAULT_CACHE_PATH,
+                       help='自动调优结果缓存文件')
+    parser.add_argument('--autotune_refresh', action='store_true',
+                       help='忽略缓存，重新调优')
+    parser.add_argument('--accumulate_steps', '--accumulate-steps', type=int, default=1,
+                       help='梯度累积步数，有效批次为 batch_size × accumulate_steps')
+    parser.add_argument('--activation_checkpointing', '--activation-checkpointing', action='store_true',
+                       help='对layer2-layer4启用激活检查点，以重新计算换取更低的激活内存')
+    parser.add_argument('--bundle_fp16', action='store_true',
+                       help='Web模型包中的权重存为float16（下载体积减半，计算仍为float32）')
+    parser.add_argument('--augment', type=str, default=None,
+                       help="设备端批量数据增强，如 'all' 或 'time_mask:p=0.3,freq_mask,gain:max_gain=1.5' "
+                            "(可选: time_mask, freq_mask, time_shift, gain, doppler_scale)")
+    parser.add_argument('--augment_seed', type=int, default=0,
+                       help='数据增强的随机种子')
+    parser.add_argument('--skip_easy', action='store_true',
+                       help='按逐样本损失跳过连续多次已学会的简单样本，缩短epoch耗时（预热和周期性全量epoch除外）')
+    parser.add_argument('--skip_loss_threshold', type=float, default=0.05,
+                       help='损失低于该值视为已学会')
+    parser.add_argument('--skip_patience', type=int, default=2,
+                       help='连续多少次低于阈值才视为简单样本')
+    parser.add_argument('--skip_keep', type=float, default=0.1,
+                       help='非全量epoch中简单样本的保留概率（用于刷新其损失）')
+    parser.add_argument('--skip_warmup', type=int, default=5,
+                       help='前多少个epoch使用全部样本')
+    parser.add_argument('--full_pass_every', type=int, default=5,
+                       help='预热之后每隔多少个epoch使用一次全部样本')
+    parser.add_argument('--progressive_resize', type=str, default=None,
+                       help="渐进分辨率阶段，如 '112:0.3,160:0.3'（分辨率:epoch数或比例[:batch大小]），"
+                            "剩余epoch使用--input_size")
+    parser.add_argument('--metrics_sync_every', type=int, default=20,
+                       help='训练指标在设备端累加，最多每N步同步到主机一次')
+    parser.add_argument('--progress_interval', type=float, default=1.0,
+                       help='进度条指标的最小刷新间隔（秒）')
+    parser.add_argument('--profile', action='store_true',
+                       help='启用训练分阶段性能剖析')
+    parser.add_argument('--profile_dir', type=str, default='./profile_logs',
+                       help='剖析日志(JSONL)和轨迹输出目录')
+    parser.add_argument('--profile_trace', type=str, default=None,
+                       help='采集torch.profiler轨迹的全局step窗口，格式 start:end，例如 10:20')
+    parser.add_argument('--stall_threshold', type=float, default=0.3,
+                       help='数据等待占step耗时超过该比例时判定为DataLoader瓶颈')
+    parser.add_argument('--trust_checkpoint', action='store_true',
+                       help='允许加载包含权重以外Python对象的--distill_teacher检查点（会执行其中的代码，仅用于可信来源）')
     
     args = parser.parse_args()
     
+    if args.distill_teacher:
+        # 学生模型不能覆盖教师模型目录中的检查点和导出文件
+        args.save_path = args.save_path or f'../public/models/student_{args.student_arch}'
+        if os.path.abspath(args.save_path) == os.path.abspath(os.path.dirname(args.distill_teacher)):
+            parser.error('--save_path 不能是教师模型所在目录，学生模型会覆盖教师模型的检查点和导出文件')
+    else:
+        args.save_path = args.save_path or '../public/models/resnet18_identity'
+    
     # 设置设备
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     print(f"使用设备: {device}")
@@ -876,53 +1514,191 @@ def main():
     print(f"数据集统计:")
     print(f"  总图像数: {len(image_paths)}")
     print(f"  类别数: {len(class_names)}")
-    print(f"  类别: {class_names}")
+    print(f"  类别: {summarize_names(class_names)}")
+    
+    if args.large_identity and (args.contrastive or args.distill_teacher):
+        print("警告: 大规模身份模式不能与 --contrastive 或 --distill_teacher 同时使用，已忽略 --large_identity")
+        args.large_identity = False
     
     # 分割数据集 (85% 训练, 15% 验证，无测试集 - 充分利用小数据集)
     train_paths, val_paths, train_labels, val_labels = train_test_split(
         image_paths, labels, test_size=0.15, random_state=42, stratify=labels
     )
+    if args.manifest:
+        # 清单只筛选训练部分，验证集仍是全量数据集上的固定划分，结果可与全量训练直接比较
+        selected = load_manifest(args.manifest, args.dataset_path)
+        train_labels = [label for path, label in zip(train_paths, train_labels) if path in selected]
+        train_paths = [path for path in train_paths if path in selected]
+        if not train_paths:
+            print("错误: 清单中没有训练集的图像")
+            return
     
     print(f"数据分割:")
     print(f"  训练集: {len(train_paths)} 样本")
     print(f"  验证集: {len(val_paths)} 样本")
     
+    teacher = None
+    preprocessing = get_preprocessing_config(args.input_mode, args.input_size)
+    if args.distill_teacher:
+        # 知识蒸馏模式：学生模型沿用教师模型的输入预处理
+        from convert_to_tfjs import load_pytorch_model
+        print(f"加载教师模型: {args.distill_teacher}")
+        teacher, _ = load_pytorch_model(args.distill_teacher, num_classes=len(class_names),
+                                        trust_checkpoint=args.trust_checkpoint)
+        preprocessing = teacher.preprocessing
+    print(f"输入模式: {preprocessing['input_mode']}, 通道数: {preprocessing['channels']}, 分辨率: {preprocessing['resize']}")
+    
     # 创建数据变换
-    train_transform, val_transform = create_data_transforms()
+    train_transform, val_transform = create_data_transforms(preprocessing['input_mode'], preprocessing['resize'][0])
+    image_mode = get_image_mode(preprocessing['input_mode'])
     
     # 创建数据集和数据加载器
-    if args.contrastive:
+    if args.contrastive and not args.distill_teacher:
         # 对比学习模式：训练集使用对比学习，验证/测试集使用标准模式
-        train_dataset = GaitDataset(train_paths, train_labels, train_transform, contrastive_mode=True)
+        train_dataset = GaitDataset(train_paths, train_labels, train_transform, contrastive_mode=True, image_mode=image_mode)
         print("训练集配置为对比学习模式")
     else:
-        train_dataset = GaitDataset(train_paths, train_labels, train_transform, contrastive_mode=False)
+        train_dataset = GaitDataset(train_paths, train_labels, train_transform, contrastive_mode=False, image_mode=image_mode)
     
-    val_dataset = GaitDataset(val_paths, val_labels, val_transform, contrastive_mode=False)
-    
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=4)
-    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=4)
+    val_dataset = GaitDataset(val_paths, val_labels, val_transform, contrastive_mode=False, image_mode=image_mode)
     
     # 创建模型
-    model = create_model(len(class_names), contrastive_learning=args.contrastive, embedding_dim=args.embedding_dim)
-    
-    # 训练模型
-    print("开始训练...")
-    trained_model, history = train_model(
-        model=model,
-        train_loader=train_loader,
-        val_loader=val_loader,
-        num_epochs=args.epochs,
-        learning_rate=args.learning_rate,
-        device=device,
-        contrastive_learning=args.contrastive,
-        contrastive_weight=args.contrastive_weight
-    )
+    exit_layers = tuple(args.early_exit.split(',')) if args.early_exit else ()
+    if exit_layers and not args.contrastive:
+        print("警告: 提前退出分支仅支持对比学习模型(--contrastive)，已忽略 --early_exit")
+        exit_layers = ()
+    tasks = None
+    if args.tasks:
+        if args.contrastive and not args.distill_teacher:
+            tasks = load_task_config(args.tasks, class_names)
+        else:
+            print("警告: 多任务输出头仅支持对比学习模型(--contrastive)，已忽略 --tasks")
+    if args.distill_teacher:
+        # 知识蒸馏模式：教师模型指导轻量学生模型
+        model = create_student_model(len(class_names), arch=args.student_arch, embedding_dim=args.embedding_dim,
+                                     width_multiplier=args.student_width, preprocessing=preprocessing)
+    else:
+        model = create_model(len(class_names), contrastive_learning=args.contrastive, embedding_dim=args.embedding_dim,
+                             input_mode=args.input_mode, input_size=args.input_size, exit_layers=exit_layers,
+                             tasks=tasks, classifier_type='cosine' if args.large_identity else 'mlp')
+        if args.large_identity:
+            model.classifier.scale.fill_(args.margin_scale)
+    
+    if args.activation_checkpointing:
+        num_blocks = enable_activation_checkpointing(model)
+        if num_blocks:
+            print(f"已对 {num_blocks} 个残差块启用激活检查点")
+        else:
+            print("警告: 当前模型结构没有layer2-layer4残差块，未启用激活检查点")
+    
+    pin_memory = device.type == 'cuda'
+    if args.autotune_loader:
+        model.to(device)
+        
+        def autotune_step(batch):
+            # 与训练相近的计算量（前向+反向），eval模式避免更新BatchNorm统计量
+            images = batch[0][0] if isinstance(batch[0], (list, tuple)) else batch[0]
+            model.eval()
+            outputs = model(images.to(device, non_blocking=pin_memory))
+            outputs.float().sum().backward()
+            model.zero_grad(set_to_none=True)
+        
+        signature = dataset_signature(train_paths, args.batch_size, preprocessing, train_dataset.contrastive_mode)
+        loader_config = autotune_loader(train_dataset, args.batch_size, autotune_step, signature,
+                                        cache_path=args.autotune_cache, pin_memory=pin_memory,
+                                        refresh=args.autotune_refresh)
+    else:
+        loader_config = {'num_workers': 4, 'prefetch_factor': 2, 'torch_threads': torch.get_num_threads()}
+    
+    identity_sampler = None
+    if args.large_identity:
+        # 每个batch P个身份 × K张图像，batch大小取K的整数倍
+        if args.skip_easy or args.progressive_resize:
+            print("警告: 大规模身份模式使用身份均衡采样，已忽略 --skip_easy 和 --progressive_resize")
+            args.skip_easy, args.progressive_resize = False, None
+        identity_sampler = IdentityBalancedSampler(train_labels, max(1, args.batch_size // args.samples_per_identity),
+                                                   args.samples_per_identity)
+        print(f"身份均衡采样: {identity_sampler}")
+    if args.distill_teacher and (args.skip_easy or args.progressive_resize):
+        print("警告: 蒸馏训练不支持跳过简单样本和渐进分辨率，已忽略 --skip_easy 和 --progressive_resize")
+        args.skip_easy, args.progressive_resize = False, None
+    sample_skipper = None
+    if args.skip_easy:
+        sample_skipper = LossAwareSampler(len(train_dataset), args.batch_size, device, args.skip_loss_threshold,
+                                          args.skip_patience, args.skip_keep, args.skip_warmup, args.full_pass_every)
+    train_sampler = identity_sampler or sample_skipper
+    train_loader = DataLoader(train_dataset, batch_size=identity_sampler.batch_size if identity_sampler else args.batch_size,
+                              shuffle=train_sampler is None, sampler=train_sampler,
+                              **loader_kwargs(loader_config, pin_memory))
+    resize_schedule = None
+    if args.progressive_resize:
+        phases = parse_resize_schedule(args.progressive_resize, args.epochs, preprocessing['resize'][0], args.batch_size)
+        resize_schedule = ProgressiveResize(
+            phases, lambda size: create_data_transforms(preprocessing['input_mode'], size)[0],
+            sampler=sample_skipper, **loader_kwargs(loader_config, pin_memory))
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False,
+                            **loader_kwargs(loader_config, pin_memory))
+    
+    # 设备端批量数据增强（在batch送到设备后执行，不增加DataLoader worker的负担）
+    augment = None
+    if args.augment:
+        augment = BatchSpectrogramAugment(preprocessing, parse_augment_spec(args.augment), args.augment_seed, device)
+    
+    # 训练剖析器
+    profiler = None
+    if args.profile:
+        profiler = TrainingProfiler(
+            output_dir=args.profile_dir,
+            device=device,
+            stall_threshold=args.stall_threshold,
+            trace_window=parse_step_window(args.profile_trace)
+        )
+    
+    if args.distill_teacher:
+        trained_model, history = distill_model(
+            student=model,
+            teacher=teacher,
+            train_loader=train_loader,
+            val_loader=val_loader,
+            num_epochs=args.epochs,
+            learning_rate=args.learning_rate,
+            device=device,
+            temperature=args.distill_temperature,
+            alpha=args.distill_alpha,
+            embedding_weight=args.embedding_loss_weight,
+            profiler=profiler,
+            accumulate_steps=args.accumulate_steps,
+            augment=augment
+        )
+    else:
+        # 训练模型
+        print("开始训练...")
+        trained_model, history = train_model(
+            model=model,
+            train_loader=train_loader,
+            val_loader=val_loader,
+            num_epochs=args.epochs,
+            learning_rate=args.learning_rate,
+            device=device,
+            contrastive_learning=args.contrastive,
+            contrastive_weight=args.contrastive_weight,
+            profiler=profiler,
+            exit_loss_weight=args.exit_loss_weight,
+            metrics_sync_every=args.metrics_sync_every,
+            progress_interval=args.progress_interval,
+            accumulate_steps=args.accumulate_steps,
+            augment=augment,
+            sample_skipper=sample_skipper,
+            resize_schedule=resize_schedule,
+            task_loss=MultiTaskLoss(tasks, class_names) if tasks else None,
+            margin_loss=SampledMarginLoss(args.margin_loss, args.margin, args.sampled_classes) if args.large_identity else None
+        )
     
     # 最终测试：从每用户全部数据随机抽取指定数量进行测试
     print("进行最终测试...")
     final_accuracy, final_results = final_test_model(
-        trained_model, args.dataset_path, class_names, device, args.final_test_samples
+        trained_model, args.dataset_path, class_names, device, args.final_test_samples,
+        num_workers=loader_config['num_workers']
     )
     
     # 简化的性能报告
@@ -932,12 +1708,24 @@ def main():
     print(f"📈 训练完成: 最佳验证准确率 {history['best_val_accuracy']:.2f}%")
     print(f"🎯 最终测试准确率: {final_accuracy:.2f}%")
     
+    if args.large_identity:
+        # 嵌入检索评估：训练集图像（不增强）为各身份注册模板，验证集图像为探针
+        gallery_dataset = GaitDataset(train_paths, train_labels, val_transform, image_mode=image_mode)
+        gallery_loader = DataLoader(gallery_dataset, batch_size=args.batch_size, shuffle=False,
+                                    **loader_kwargs(loader_config, pin_memory))
+        retrieval = evaluate_retrieval(trained_model, gallery_loader, val_loader, len(class_names), device)
+        print_retrieval_results(retrieval)
+        history['retrieval'] = retrieval
+    
     # 绘制训练历史
-    plot_training_history(history, contrastive_learning=args.contrastive)
+    plot_training_history(history, contrastive_learning=args.contrastive and not args.distill_teacher)
     
     # 保存模型
     print("保存模型...")
-    save_model_for_web(trained_model, class_names, args.save_path)
+    save_model_for_web(trained_model, class_names, args.save_path, bundle_fp16=args.bundle_fp16)
+    
+    if teacher is not None:
+        create_distillation_report(teacher, trained_model, val_loader, device, args.save_path)
     
     print(f"\n{'='*70}")
     print("✅ 训练完成！模型已保存并可用于部署")
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+在冻结的ResNet18Contrastive逐帧嵌入向量上训练时序融合模型
+  1. 对数据集每一帧提取一次嵌入向量和logits，按模型文件哈希缓存（重复训练/调参不再跑ResNet18）
+  2. 按行走序列（ID1_case1_1_Doppler1..N）截取连续帧窗口，训练因果卷积+注意力池化的融合模型，
+     每个前缀（第1帧、前2帧、……）都计算交叉熵，使模型在少量帧时也能给出序列级判断
+  3. 在验证帧组成的序列上与固定3帧一致性策略、序贯(SPRT)策略比较平均帧数、准确率和错误接受率
+  4. 导出numpy权重（temporal_fusion.npz），选定的接受阈值写入metadata.json的usage.temporal_fusion，
+     gait_inference.py 的 verify() 据此逐帧流式决策（推理端见 temporal_fusion.py）
+划分与train_resnet18.py相同（test_size=0.15, random_state=42），融合模型只在主干见过的训练帧上训练。
+
+用法:
+  python train_temporal_fusion.py --model_path ../public/models/resnet18_identity/resnet18_identity.pth \\
+      --dataset_path ../dataset --update_metadata ../public/models/resnet18_identity/metadata.json
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from sklearn.model_selection import train_test_split
+
+from sequential_verification import (evaluate_policy, fit_temperature, group_walk_sequences, parse_bounds,
+                                     run_sequence, sample_sequences, select_policy, simulate_policies)
+from temporal_fusion import FUSION_FILE, TemporalFusion as StreamingFusionModel, TemporalFusionWeights
+from train_resnet18 import GaitDataset, create_data_transforms, get_image_mode, load_dataset, teacher_forward
+
+
+class TemporalFusion(nn.Module):
+    """因果1D卷积 + 前缀注意力池化 + 线性分类
+
+    输入(B, T, D)的嵌入向量序列，输出(B, T, C)：第t个位置是只看前t+1帧时的序列级logits。
+    前缀注意力池化用下三角掩码一次算出，与temporal_fusion.py中逐帧的在线softmax数学上等价。
+    """
+
+    def __init__(self, embedding_dim, num_classes, hidden_dim=64, kernel_size=3, dropout=0.2):
+        super(TemporalFusion, self).__init__()
+        self.kernel_size = kernel_size
+        self.conv = nn.Conv1d(embedding_dim, hidden_dim, kernel_size)
+        self.attention = nn.Linear(hidden_dim, 1)
+        self.dropout = nn.Dropout(dropout)
+        self.classifier = nn.Linear(hidden_dim, num_classes)
+
+    def forward(self, embeddings):
+        # 左侧补K-1帧零向量，第t个输出只依赖第t-K+1..t帧
+        x = F.pad(embeddings.transpose(1, 2), (self.kernel_size - 1, 0))
+        hidden = F.relu(self.conv(x)).transpose(1, 2)
+        scores = self.attention(hidden).squeeze(-1)
+
+        length = scores.shape[1]
+        causal = torch.ones(length, length, dtype=torch.bool, device=scores.device).tril()
+        weights = scores.unsqueeze(1).expand(-1, length, -1).masked_fill(~causal, float('-inf')).softmax(dim=-1)
+        pooled = weights @ hidden
+        return self.classifier(self.dropout(pooled))
+
+
+def fusion_weight_arrays(model):
+    """推理端（numpy）使用的权重数组，键名与TemporalFusionWeights一致"""
+    state = {name: tensor.detach().cpu().numpy() for name, tensor in model.state_dict().items()}
+    return {'conv_weight': state['conv.weight'], 'conv_bias': state['conv.bias'],
+            'attention_weight': state['attention.weight'], 'attention_bias': state['attention.bias'],
+            'classifier_weight': state['classifier.weight'], 'classifier_bias': state['classifier.bias']}
+
+
+def export_fusion_weights(model, path):
+    """保存推理端（numpy）使用的权重"""
+    np.savez(path, **fusion_weight_arrays(model))
+    print(f"融合模型权重已保存到: {path} ({os.path.getsize(path) / 1024:.1f} KB)")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_frame_outputs(model, image_paths, device='cpu', batch_size=64, num_workers=2):
+    """每帧一次前向，返回(嵌入向量(N, D), logits(N, C))；嵌入与导出ONNX图中L2标准化后的张量一致"""
+    preprocessing = model.preprocessing
+    _, transform = create_data_transforms(preprocessing['input_mode'], preprocessing['resize'][0])
+    dataset = GaitDataset(image_paths, [0] * len(image_paths), transform,
+                          image_mode=get_image_mode(preprocessing['input_mode']))
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    model = model.to(device).eval()
+    embeddings, logits = [], []
+    with torch.no_grad():
+        for images, _ in loader:
+            batch_embeddings, batch_logits = teacher_forward(model, images.to(device))
+            embeddings.append(batch_embeddings.float().cpu())
+            logits.append(batch_logits.float().cpu())
+    return torch.cat(embeddings).numpy(), torch.cat(logits).numpy()
+
+
+def load_frame_outputs(model, model_path, image_paths, cache_path, device='cpu', num_workers=2):
+    """按(模型文件哈希, 帧列表)缓存逐帧输出，命中时直接读取"""
+    key = hashlib.sha256((file_sha256(model_path) + '\n' + '\n'.join(image_paths)).encode('utf-8')).hexdigest()
+    if cache_path and os.path.exists(cache_path):
+        with np.load(cache_path, allow_pickle=False) as cached:
+            if str(cached['key']) == key:
+                print(f"使用缓存的嵌入向量: {cache_path}")
+                return cached['embeddings'], cached['logits']
+
+    start = time.perf_counter()
+    embeddings, logits = compute_frame_outputs(model, image_paths, device, num_workers=num_workers)
+    print(f"已提取 {len(embeddings)} 帧的嵌入向量 ({embeddings.shape[1]}维), {time.perf_counter() - start:.1f}秒")
+    if cache_path:
+        np.savez(cache_path, key=key, embeddings=embeddings, logits=logits)
+        print(f"嵌入向量缓存已保存到: {cache_path}")
+    return embeddings, logits
+
+
+def subset_walks(image_paths, labels, indices):
+    """只用indices中的帧组成行走序列，返回的位置为全体帧中的下标"""
+    walks = group_walk_sequences([image_paths[i] for i in indices], [labels[i] for i in indices])
+    return {key: [int(indices[p]) for p in positions] for key, positions in walks.items()}
+
+
+def split_walks(walks, fraction=0.5):
+    """把每个行走序列按时间切成前后两段：前段用于校准温度和选择阈值，后段只用于报告"""
+    calibration, report = {}, {}
+    for key, positions in walks.items():
+        cut = int(round(len(positions) * fraction))
+        calibration[key], report[key] = positions[:cut], positions[cut:]
+    return calibration, report
+
+
+def train_fusion(model, embeddings, walks, window_length=8, windows_per_walk=128, num_epochs=100,
+                 learning_rate=0.001, batch_size=64, device='cpu', seed=0):
+    """每个epoch从训练帧的行走序列中重新随机截取窗口，对所有前缀的logits计算交叉熵"""
+    model = model.to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate, weight_decay=1e-4)
+    features = torch.from_numpy(embeddings).float()
+
+    for epoch in range(num_epochs):
+        sequences = sample_sequences(walks, window_length, windows_per_walk, seed=seed + epoch)
+        if not sequences:
+            raise ValueError(f"没有长度不少于 {window_length} 帧的训练行走序列，请减小 --window_length")
+        order = np.random.default_rng(seed + epoch).permutation(len(sequences))
+        model.train()
+        total_loss = correct = count = 0.0
+        for start in range(0, len(order), batch_size):
+            batch = [sequences[i] for i in order[start:start + batch_size]]
+            inputs = features[np.array([positions for _, positions in batch])].to(device)
+            targets = torch.tensor([label for label, _ in batch], device=device)
+
+            logits = model(inputs)
+            loss = F.cross_entropy(logits.flatten(0, 1), targets.repeat_interleave(logits.shape[1]))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            total_loss += loss.item() * len(batch)
+            correct += (logits[:, -1].argmax(dim=1) == targets).sum().item()
+            count += len(batch)
+        if (epoch + 1) % 10 == 0 or epoch == num_epochs - 1:
+            print(f"Epoch {epoch + 1}/{num_epochs}: 损失 {total_loss / count:.4f}, "
+                  f"完整窗口准确率 {100.0 * correct / count:.2f}%")
+    return model.eval()
+
+
+def measure_update_ms(fusion, embedding_dim, repeats=500):
+    """流式融合每帧的额外耗时"""
+    stream = fusion.stream()
+    frames = np.random.default_rng(0).standard_normal((repeats, embedding_dim)).astype(np.float32)
+    start = time.perf_counter()
+    for frame in frames:
+        stream.update(frame)
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def check_streaming_parity(model, fusion, embeddings, sequences, count=20):
+    """PyTorch前缀logits与numpy流式logits的最大差异"""
+    diffs = []
+    with torch.no_grad():
+        for _, positions in sequences[:count]:
+            frames = embeddings[positions]
+            expected = model(torch.from_numpy(frames).float().unsqueeze(0))[0].numpy()
+            diffs.append(np.abs(fusion.sequence_logits(frames) - expected).max())
+    return float(max(diffs)) if diffs else 0.0
+
+
+def update_metadata_fusion(metadata_path, policy):
+    """把融合模型的决策参数写入已有的metadata.json"""
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    usage = metadata.setdefault('usage', {})
+    usage['temporal_fusion'] = policy
+    usage['required_images'] = policy['max_frames']
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    print(f"时序融合策略已写入: {metadata_path}")
+
+
+def main():
+    from convert_to_tfjs import load_pytorch_model
+    from prune_resnet18 import measure_latency_ms
+
+    parser = argparse.ArgumentParser(description='在冻结主干的逐帧嵌入向量上训练流式时序融合模型')
+    parser.add_argument('--model_path', type=str,
+                       default='../public/models/resnet18_identity/resnet18_identity.pth',
+                       help='ResNet18Contrastive检查点（主干冻结）')
+    parser.add_argument('--dataset_path', type=str, default='../dataset',
+                       help='数据集路径（与训练主干时相同，按相同方式划分训练/验证帧）')
+    parser.add_argument('--eval_dataset_path', type=str, default=None,
+                       help='另一次采集的数据集，指定时用其全部帧评估（默认用验证帧）')
+    parser.add_argument('--calibration_fraction', type=float, default=0.5,
+                       help='每个评估行走序列中用于校准温度和选择阈值的前段比例，其余帧只用于报告')
+    parser.add_argument('--cache', type=str, default='temporal_fusion_embeddings.npz',
+                       help='逐帧嵌入向量缓存文件，空字符串表示不缓存')
+    parser.add_argument('--hidden_dim', type=int, default=64,
+                       help='融合模型隐藏维度')
+    parser.add_argument('--kernel_size', type=int, default=3,
+                       help='因果卷积核大小（流式状态保存的帧数）')
+    parser.add_argument('--window_length', type=int, default=8,
+                       help='训练窗口长度（帧）')
+    parser.add_argument('--windows_per_walk', type=int, default=128,
+                       help='每个epoch从每个行走序列截取的训练窗口数')
+    parser.add_argument('--epochs', type=int, default=100,
+                       help='训练轮数')
+    parser.add_argument('--learning_rate', type=float, default=0.001,
+                       help='学习率')
+    parser.add_argument('--accept_thresholds', type=str, default='0.8,0.9,0.95,0.98,0.99',
+                       help='序列级后验接受阈值候选，逗号分隔')
+    parser.add_argument('--min_frames', type=int, default=1,
+                       help='给出接受决策前至少使用的帧数')
+    parser.add_argument('--max_frames', type=int, default=5,
+                       help='单次决策最多使用的帧数')
+    parser.add_argument('--sequences_per_walk', type=int, default=50,
+                       help='评估时每个行走序列随机截取的序列数')
+    parser.add_argument('--frame_latency_ms', type=float, default=None,
+                       help='单帧推理延迟(ms)，默认在本机CPU上实测')
+    parser.add_argument('--output', type=str, default='temporal_fusion_report.json',
+                       help='评估报告输出路径')
+    parser.add_argument('--update_metadata', type=str, default=None,
+                       help='将融合模型和选定阈值写入该metadata.json（权重保存在同一目录）')
+    parser.add_argument('--seed', type=int, default=0,
+                       help='随机种子')
+    parser.add_argument('--trust_checkpoint', action='store_true',
+                       help='允许加载包含权重以外Python对象的检查点（会执行其中的代码，仅用于可信来源）')
+
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(args.seed)
+
+    model, class_names = load_pytorch_model(args.model_path, trust_checkpoint=args.trust_checkpoint)
+    if not hasattr(model, 'embedding'):
+        print("错误: 时序融合需要带嵌入层的ResNet18Contrastive检查点")
+        return
+    image_paths, labels, dataset_classes = load_dataset(args.dataset_path)
+    if not image_paths:
+        return
+    if dataset_classes != class_names:
+        print(f"警告: 数据集类别 {dataset_classes} 与模型类别 {class_names} 不一致")
+    labels = np.asarray(labels)
+
+    print("\n提取逐帧嵌入向量...")
+    embeddings, logits = load_frame_outputs(model, args.model_path, image_paths, args.cache or None, device)
+    train_idx, val_idx = train_test_split(np.arange(len(labels)), test_size=0.15, random_state=42, stratify=labels)
+    train_walks = subset_walks(image_paths, labels, train_idx)
+
+    if args.eval_dataset_path:
+        eval_paths, eval_labels, _ = load_dataset(args.eval_dataset_path)
+        eval_labels = np.asarray(eval_labels)
+        eval_embeddings, eval_logits = compute_frame_outputs(model, eval_paths, device)
+        eval_walks = group_walk_sequences(eval_paths, eval_labels)
+    else:
+        eval_embeddings, eval_logits, eval_labels = embeddings, logits, labels
+        eval_walks = subset_walks(image_paths, labels, val_idx)
+    # 温度和阈值只在校准段上选择，报告段的指标不参与任何选择
+    calibration_walks, report_walks = split_walks(eval_walks, args.calibration_fraction)
+    sequence_length = max(args.max_frames, 3)
+    calibration_sequences = sample_sequences(calibration_walks, sequence_length, args.sequences_per_walk, seed=42)
+    sequences = sample_sequences(report_walks, sequence_length, args.sequences_per_walk, seed=43)
+    print(f"训练行走序列: {len(train_walks)} 个, 校准序列: {len(calibration_sequences)} 条, 报告序列: {len(sequences)} 条")
+    if not calibration_sequences or not sequences:
+        print(f"错误: 评估行走序列的校准段或报告段均短于 {sequence_length} 帧")
+        return
+
+    print("\n训练时序融合模型...")
+    fusion_model = TemporalFusion(embeddings.shape[1], len(class_names), args.hidden_dim, args.kernel_size)
+    fusion_model = train_fusion(fusion_model, embeddings, train_walks, args.window_length, args.windows_per_walk,
+                                args.epochs, args.learning_rate, device=device, seed=args.seed).cpu()
+    weights = TemporalFusionWeights(fusion_weight_arrays(fusion_model))
+
+    # 温度在校准序列的前缀logits上校准，与sequential_verification.py在验证帧上校准的做法一致
+    uncalibrated = StreamingFusionModel(weights)
+    prefix_logits = np.concatenate([uncalibrated.sequence_logits(eval_embeddings[p]) for _, p in calibration_sequences])
+    prefix_labels = np.concatenate([[label] * len(p) for label, p in calibration_sequences])
+    fusion_temperature = fit_temperature(prefix_logits, prefix_labels)
+    parity = check_streaming_parity(fusion_model, uncalibrated, eval_embeddings, sequences)
+    print(f"融合模型校准温度: {fusion_temperature:.3f}, 流式/PyTorch最大差异: {parity:.2e}")
+
+    frame_latency_ms = args.frame_latency_ms or measure_latency_ms(model)
+    fusion_ms = measure_update_ms(uncalibrated, embeddings.shape[1])
+    print(f"单帧推理延迟: {frame_latency_ms:.2f} ms, 融合额外耗时: {fusion_ms:.3f} ms/帧 "
+          f"({fusion_ms / frame_latency_ms:.2%})")
+
+    # 基线：固定3帧一致性策略与逐帧logits上的序贯策略；两组序列上的结果按候选顺序一一对应
+    calibration_frames = np.array(sorted(p for positions in calibration_walks.values() for p in positions))
+    temperature = fit_temperature(eval_logits[calibration_frames], eval_labels[calibration_frames])
+    accept_bounds, reject_bounds = parse_bounds('1.5,2.2,3.0,4.6,6.9'), parse_bounds('-0.5,-1.0,-2.0')
+    calibration_baseline, calibration_sprt = simulate_policies(eval_logits, calibration_sequences, temperature,
+                                                               accept_bounds, reject_bounds, args.max_frames,
+                                                               frame_latency_ms)
+    baseline, sprt_results = simulate_policies(eval_logits, sequences, temperature, accept_bounds, reject_bounds,
+                                               args.max_frames, frame_latency_ms)
+    chosen = select_policy(calibration_baseline, calibration_sprt)
+    sprt = None if chosen is None else sprt_results[calibration_sprt.index(chosen)]
+
+    calibration_results, results = [], []
+    for threshold in parse_bounds(args.accept_thresholds):
+        fusion = StreamingFusionModel(weights, fusion_temperature, threshold, args.min_frames, args.max_frames)
+        stream = fusion.stream()
+        for target, subset in ((calibration_results, calibration_sequences), (results, sequences)):
+            metrics = evaluate_policy(lambda frames: run_sequence(stream, frames), eval_embeddings, subset,
+                                      frame_latency_ms + fusion_ms)
+            metrics['policy'] = fusion.get_policy()
+            target.append(metrics)
+    chosen = select_policy(calibration_baseline, calibration_results)
+    selected = None if chosen is None else results[calibration_results.index(chosen)]
+
+    print("\n报告序列上的结果（←为校准序列上选出的阈值）")
+    print(f"{'策略':<16}{'准确率':>10}{'错误接受':>10}{'平均帧数':>10}{'P95帧数':>10}{'平均延迟(ms)':>14}")
+    rows = [('固定3帧', baseline, '')]
+    if sprt is not None:
+        rows.append((f"序贯 {sprt['policy']['accept_log_odds']:g}/{sprt['policy']['reject_log_odds']:g}", sprt, ''))
+    rows += [(f"融合 p≥{r['policy']['accept_threshold']:g}", r, ' ←' if r is selected else '') for r in results]
+    for name, r, marker in rows:
+        print(f"{name:<16}{r['accuracy']:>9.2f}%{r['false_accept_rate']:>9.2f}%{r['mean_frames']:>10.2f}"
+              f"{r['p95_frames']:>10.0f}{r['mean_latency_ms']:>14.2f}{marker}")
+
+    report = {
+        'model_path': args.model_path,
+        'eval_dataset_path': args.eval_dataset_path,
+        'calibration_fraction': args.calibration_fraction,
+        'num_calibration_sequences': len(calibration_sequences),
+        'num_sequences': len(sequences),
+        'frame_latency_ms': frame_latency_ms,
+        'fusion_update_ms': fusion_ms,
+        'streaming_max_abs_diff': parity,
+        'baseline': baseline,
+        'sequential': sprt,
+        'results': results,
+        'selected': selected,
+        'calibration': {'baseline': calibration_baseline, 'results': calibration_results}
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n评估报告已保存到: {args.output}")
+
+    if selected is None:
+        print("⚠️  没有接受阈值能在准确率和错误接受率不变差的前提下减少帧数")
+        return
+    compared = f"固定策略 {baseline['mean_frames']:.0f} 帧"
+    if sprt is not None:
+        compared += f", 序贯策略 {sprt['mean_frames']:.2f} 帧"
+    print(f"推荐阈值: p≥{selected['policy']['accept_threshold']:g}, 平均 {selected['mean_frames']:.2f} 帧 ({compared})")
+    if args.update_metadata:
+        # 只有采用该策略时才把权重写到模型目录；只有Python推理端(gait_inference.py)按FUSION_FILE加载，Web前端不使用
+        export_fusion_weights(fusion_model, os.path.join(os.path.dirname(args.update_metadata) or '.', FUSION_FILE))
+        update_metadata_fusion(args.update_metadata, selected['policy'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+训练内存优化与内存报告
+  - 激活检查点：layer2-layer4的残差块在前向时不保存中间激活，反向时重新计算（以计算换内存）
+  - 内存报告：对不同的micro batch、检查点开关和训练模式，在独立子进程中跑几个训练step，
+    记录峰值内存（CPU为进程峰值RSS，GPU为峰值显存），配合梯度累积选择内存允许的最大有效批次
+"""
+
+import os
+import json
+import argparse
+import multiprocessing
+from contextlib import contextmanager
+
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from prune_resnet18 import get_resnet_trunk
+from training_profiler import get_peak_rss_mb
+
+# 启用激活检查点的残差阶段
+CHECKPOINT_LAYERS = ('layer2', 'layer3', 'layer4')
+
+
+@contextmanager
+def frozen_batchnorm_stats(module):
+    """重新计算前向时保持BatchNorm的running统计量不变，避免同一个batch被统计两次"""
+    saved = []
+    for bn in module.modules():
+        if isinstance(bn, nn.modules.batchnorm._BatchNorm) and bn.track_running_stats:
+            saved.append((bn, bn.running_mean.clone(), bn.running_var.clone(), bn.num_batches_tracked.clone()))
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for bn, mean, var, count in saved:
+                bn.running_mean.copy_(mean)
+                bn.running_var.copy_(var)
+                bn.num_batches_tracked.copy_(count)
+
+
+class _CheckpointMixin:
+    """训练且需要梯度时用torch.utils.checkpoint执行block，其余情况（验证、ONNX导出）走原始前向"""
+
+    def forward(self, x):
+        original_forward = super(_CheckpointMixin, self).forward
+        if not (self.training and torch.is_grad_enabled()):
+            return original_forward(x)
+
+        calls = [0]
+
+        def run(inputs):
+            calls[0] += 1
+            if calls[0] == 1:
+                return original_forward(inputs)
+            with frozen_batchnorm_stats(self):
+                return original_forward(inputs)
+
+        return checkpoint(run, x, use_reentrant=False)
+
+
+_CHECKPOINT_CLASSES = {}
+
+
+def enable_activation_checkpointing(model, layers=CHECKPOINT_LAYERS):
+    """为ResNet主干的指定阶段启用激活检查点，返回启用的block数
+
+    通过替换block的类实现，参数名和state_dict键保持不变，检查点可照常保存和加载。
+    """
+    trunk = get_resnet_trunk(model)
+    count = 0
+    for layer_name in layers:
+        layer = getattr(trunk, layer_name, None)
+        if layer is None:
+            continue
+        for block in layer:
+            cls = type(block)
+            if issubclass(cls, _CheckpointMixin):
+                continue
+            if cls not in _CHECKPOINT_CLASSES:
+                _CHECKPOINT_CLASSES[cls] = type(f'Checkpointed{cls.__name__}', (_CheckpointMixin, cls), {})
+            block.__class__ = _CHECKPOINT_CLASSES[cls]
+            count += 1
+    return count
+
+
+def current_rss_mb():
+    """当前进程的RSS(MB)，读取失败时退回峰值RSS（两者都不支持的平台返回None）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, IndexError, AttributeError):
+        return get_peak_rss_mb()
+
+
+def _measure_worker(config, queue):
+    """子进程：构建模型并执行若干训练step，返回峰值内存（子进程隔离，峰值RSS互不干扰）"""
+    import torch.optim as optim
+    from train_resnet18 import ContrastiveLoss, create_model
+    from spectrogram_preprocessing import get_input_shape
+
+    try:
+        torch.manual_seed(0)
+        if config['threads']:
+            torch.set_num_threads(config['threads'])
+        device = torch.device(config['device'])
+        contrastive = config['mode'] == 'contrastive'
+        model = create_model(config['num_classes'], contrastive_learning=contrastive,
+                             input_mode=config['input_mode'], input_size=config['input_size'],
+                             pretrained=False).to(device)
+        if config['checkpointing']:
+            enable_activation_checkpointing(model)
+        optimizer = optim.Adam(model.parameters(), lr=1e-4, weight_decay=1e-5)
+        criterion = nn.CrossEntropyLoss()
+        contrastive_criterion = ContrastiveLoss(margin=1.0)
+
+        shape = get_input_shape(model.preprocessing, config['micro_batch'])
+        labels = torch.randint(0, config['num_classes'], (config['micro_batch'],), device=device)
+        baseline_rss = current_rss_mb()
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+
+        model.train()
+        for step in range(config['steps']):
+            images = torch.randn(shape, device=device)
+            if contrastive:
+                pair_images = torch.randn(shape, device=device)
+                similarities = torch.randint(0, 2, (config['micro_batch'], 1), device=device).float()
+                anchor_embeddings, anchor_outputs = model(images)
+                pair_embeddings, _ = model(pair_images)
+                loss = 0.5 * criterion(anchor_outputs, labels) + \
+                    0.5 * contrastive_criterion(anchor_embeddings, pair_embeddings, similarities)
+            else:
+                loss = criterion(model(images), labels)
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+
+        result = {'peak_rss_mb': get_peak_rss_mb(), 'baseline_rss_mb': baseline_rss}
+        if device.type == 'cuda':
+            result['peak_cuda_mb'] = torch.cuda.max_memory_allocated(device) / 1024 ** 2
+        queue.put(result)
+    except Exception as e:
+        queue.put({'error': str(e)})
+
+
+def measure_peak_memory(config):
+    """在独立的spawn子进程中测量一个配置的峰值内存"""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure_worker, args=(config, queue))
+    process.start()
+    # 子进程可能因内存不足被系统终止，此时队列中没有结果
+    while process.is_alive() or not queue.empty():
+        try:
+            return queue.get(timeout=1.0)
+        except Exception:
+            continue
+    process.join()
+    return {'error': f'子进程异常退出 (exitcode={process.exitcode})'}
+
+
+def build_memory_report(effective_batch, micro_batches, modes=('standard', 'contrastive'), num_classes=10,
+                        input_mode='rgb', input_size=224, device='cpu', steps=2, threads=0):
+    """对每种(模式, micro batch, 是否检查点)组合测量峰值内存"""
+    rows = []
+    for mode in modes:
+        for micro_batch in micro_batches:
+            for checkpointing in (False, True):
+                config = {
+                    'mode': mode, 'micro_batch': micro_batch, 'checkpointing': checkpointing,
+                    'num_classes': num_classes, 'input_mode': input_mode, 'input_size': input_size,
+                    'device': str(device), 'steps': steps, 'threads': threads
+                }
+                result = measure_peak_memory(config)
+                row = {
+                    'mode': mode,
+                    'micro_batch': micro_batch,
+                    'accumulate_steps': max(1, effective_batch // micro_batch),
+                    'activation_checkpointing': checkpointing,
+                    **result
+                }
+                rows.append(row)
+                if 'error' in result:
+                    print(f"  {mode:<12} micro_batch={micro_batch:<4} checkpoint={'开' if checkpointing else '关'}: "
+                          f"失败 ({result['error']})")
+                    continue
+                peak = result.get('peak_cuda_mb', result['peak_rss_mb'])
+                if peak is None:
+                    # Windows上没有resource模块，无法读取峰值RSS
+                    print(f"  {mode:<12} micro_batch={micro_batch:<4} accumulate={row['accumulate_steps']:<3} "
+                          f"checkpoint={'开' if checkpointing else '关'}: 本平台不支持测量峰值内存")
+                    continue
+                print(f"  {mode:<12} micro_batch={micro_batch:<4} accumulate={row['accumulate_steps']:<3} "
+                      f"checkpoint={'开' if checkpointing else '关'}: 峰值 {peak:.0f} MB "
+                      f"(训练前 {result['baseline_rss_mb']:.0f} MB)")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='训练峰值内存报告（梯度累积 × 激活检查点）')
+    parser.add_argument('--effective_batch', type=int, default=64,
+                       help='目标有效批次大小（micro_batch × accumulate_steps）')
+    parser.add_argument('--micro_batches', type=str, default='8,16,32',
+                       help='测量的micro batch大小，逗号分隔')
+    parser.add_argument('--modes', type=str, default='standard,contrastive',
+                       help='训练模式，逗号分隔 (standard/contrastive)')
+    parser.add_argument('--num_classes', type=int, default=10,
+                       help='类别数')
+    parser.add_argument('--input_mode', type=str, default='rgb',
+                       help='输入模式 (rgb/gray/colormap)')
+    parser.add_argument('--input_size', type=int, default=224,
+                       help='输入分辨率')
+    parser.add_argument('--steps', type=int, default=2,
+                       help='每个配置执行的训练step数')
+    parser.add_argument('--threads', type=int, default=0,
+                       help='子进程的torch线程数，0表示默认')
+    parser.add_argument('--output', type=str, default='./memory_report.json',
+                       help='报告输出路径')
+
+    args = parser.parse_args()
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    micro_batches = [int(b) for b in args.micro_batches.split(',')]
+    modes = tuple(args.modes.split(','))
+
+    print(f"设备: {device}, 目标有效批次: {args.effective_batch}")
+    rows = build_memory_report(args.effective_batch, micro_batches, modes, args.num_classes,
+                               args.input_mode, args.input_size, device, args.steps, args.threads)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'device': device, 'effective_batch': args.effective_batch, 'configurations': rows},
+                  f, indent=2, ensure_ascii=False)
+    print(f"\n内存报告已保存到: {args.output}")
+    print("训练时使用: --batch_size <micro_batch> --accumulate_steps <N> [--activation_checkpointing]")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+训练过程分阶段性能剖析工具
+记录每个训练step中数据加载等待、主机到设备拷贝、前向、反向、优化器更新和指标统计的耗时，
+检测训练循环是否在等待DataLoader，并可选采集torch.profiler轨迹与峰值内存
+"""
+
+import os
+import sys
+import time
+import json
+
+import torch
+
+try:
+    import resource  # 仅类Unix系统可用
+except ImportError:
+    resource = None
+
+# 每个训练step被拆分的阶段
+# data_wait: 主循环阻塞在DataLoader上的时间（num_workers=0时即为GaitDataset中PIL解码耗时）
+# augment:   设备端批量数据增强（spectrogram_augment.py）
+# metrics:   .item()同步、准确率统计和tqdm进度条postfix格式化
+# other:     未被任何阶段覆盖的剩余时间（tqdm刷新、zero_grad等）
+STAGES = ('data_wait', 'h2d', 'augment', 'forward', 'backward', 'optimizer', 'metrics', 'other')
+
+
+def get_peak_rss_mb():
+    """获取当前进程的峰值常驻内存(MB)，不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux下单位为KB，macOS下单位为字节
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def parse_step_window(window):
+    """解析 'start:end' 形式的step窗口，返回(start, end)，空值返回None"""
+    if not window:
+        return None
+    start, end = window.split(':')
+    start, end = int(start), int(end)
+    if start < 0 or end <= start:
+        raise ValueError(f"无效的profiler窗口: {window}")
+    return start, end
+
+
+class _StageTimer:
+    """单个阶段的计时上下文，可在同一step内多次进入并累加"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.profiler._synchronize()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler._synchronize()
+        elapsed = time.perf_counter() - self.start
+        self.profiler._current[self.name] = self.profiler._current.get(self.name, 0.0) + elapsed
+        return False
+
+
+class _NullTimer:
+    """关闭剖析时使用的空计时器"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class TrainingProfiler:
+    """训练循环剖析器
+
+    用法:
+        profiler = TrainingProfiler('./profile_logs', device=device)
+        profiler.begin_epoch(epoch)
+        for batch in profiler.wrap_loader(train_loader):
+            with profiler.stage('h2d'):
+                ...
+            profiler.end_step()
+        profiler.end_epoch()
+        profiler.close()
+    """
+
+    def __init__(self, output_dir='./profile_logs', enabled=True, device='cpu',
+                 stall_threshold=0.3, trace_window=None):
+        self.enabled = enabled
+        self.output_dir = output_dir
+        self.stall_threshold = stall_threshold
+        self.trace_window = trace_window
+        self.sync_cuda = str(device).startswith('cuda') and torch.cuda.is_available()
+
+        self.epoch = 0
+        self.global_step = 0
+        self._epoch_records = []
+        self._current = {}
+        self._step_start = None
+        self._torch_profiler = None
+        self._log_file = None
+
+        if self.enabled:
+            os.makedirs(self.output_dir, exist_ok=True)
+            log_path = os.path.join(self.output_dir, 'train_profile.jsonl')
+            self._log_file = open(log_path, 'a', encoding='utf-8', buffering=1)
+            print(f"训练剖析已开启，日志写入: {log_path}")
+
+    def _synchronize(self):
+        # CUDA kernel是异步执行的，不同步则耗时会被记到后续的.item()上
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+
+    def _write(self, record):
+        self._log_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def stage(self, name):
+        """返回某个阶段的计时上下文"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name)
+
+    def begin_epoch(self, epoch):
+        if not self.enabled:
+            return
+        self.epoch = epoch
+        self._epoch_records = []
+        self._step_start = time.perf_counter()
+
+    def wrap_loader(self, loader):
+        """包装DataLoader迭代器，记录每个batch的等待时间"""
+        if not self.enabled:
+            yield from loader
+            return
+
+        # 第一个batch的等待时间包含worker进程的启动开销
+        self._maybe_start_trace()
+        start = time.perf_counter()
+        iterator = iter(loader)
+        while True:
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self._current['data_wait'] = time.perf_counter() - start
+            yield batch
+            self._maybe_start_trace()
+            start = time.perf_counter()
+
+    def end_step(self):
+        """结束当前step：汇总各阶段耗时、判定是否等待数据并写入JSONL"""
+        if not self.enabled:
+            return
+
+        self._synchronize()
+        now = time.perf_counter()
+        total = now - self._step_start
+        self._step_start = now
+
+        timings = {name: self._current.get(name, 0.0) for name in STAGES if name != 'other'}
+        timings['other'] = max(0.0, total - sum(timings.values()))
+        stalled = total > 0 and timings['data_wait'] / total > self.stall_threshold
+
+        record = {
+            'type': 'step',
+            'epoch': self.epoch,
+            'step': self.global_step,
+            'total_ms': total * 1000,
+            'stalled_on_data': stalled,
+        }
+        record.update({f'{name}_ms': value * 1000 for name, value in timings.items()})
+        self._write(record)
+        self._epoch_records.append(record)
+
+        self._current = {}
+        self.global_step += 1
+        self._maybe_stop_trace()
+
+    def _maybe_start_trace(self):
+        if self.trace_window is None or self._torch_profiler is not None:
+            return
+        if self.global_step != self.trace_window[0]:
+            return
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.sync_cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._torch_profiler = torch.profiler.profile(
+            activities=activities, record_shapes=True, profile_memory=True
+        )
+        self._torch_profiler.__enter__()
+        print(f"\n开始采集torch.profiler轨迹 (step {self.trace_window[0]}-{self.trace_window[1]})")
+
+    def _maybe_stop_trace(self):
+        if self._torch_profiler is None or self.global_step < self.trace_window[1]:
+            return
+
+        self._torch_profiler.__exit__(None, None, None)
+        trace_path = os.path.join(
+            self.output_dir, f'trace_step{self.trace_window[0]}-{self.trace_window[1]}.json'
+        )
+        self._torch_profiler.export_chrome_trace(trace_path)
+        self._torch_profiler = None
+        self.trace_window = None
+        print(f"\ntorch.profiler轨迹已保存到: {trace_path}")
+
+    def end_epoch(self):
+        """打印本epoch的分阶段耗时汇总表并写入汇总记录"""
+        if not self.enabled or not self._epoch_records:
+            return
+
+        num_steps = len(self._epoch_records)
+        epoch_total = sum(r['total_ms'] for r in self._epoch_records)
+        stalled_steps = sum(1 for r in self._epoch_records if r['stalled_on_data'])
+        peak_rss_mb = get_peak_rss_mb()
+        peak_cuda_mb = torch.cuda.max_memory_allocated() / 1024 / 1024 if self.sync_cuda else None
+
+        summary = {
+            'type': 'epoch_summary',
+            'epoch': self.epoch,
+            'steps': num_steps,
+            'total_ms': epoch_total,
+            'stalled_steps': stalled_steps,
+            'peak_rss_mb': peak_rss_mb,
+            'peak_cuda_mb': peak_cuda_mb,
+            'stages': {},
+        }
+
+        print(f"\n⏱️  Epoch {self.epoch} 训练阶段耗时汇总 ({num_steps} steps)")
+        print(f"{'阶段':<12}{'平均(ms)':>12}{'P95(ms)':>12}{'合计(s)':>12}{'占比':>10}")
+        print("-" * 58)
+        for name in STAGES:
+            values = sorted(r[f'{name}_ms'] for r in self._epoch_records)
+            stage_total = sum(values)
+            mean = stage_total / num_steps
+            p95 = values[min(num_steps - 1, int(num_steps * 0.95))]
+            share = stage_total / epoch_total * 100 if epoch_total > 0 else 0.0
+            summary['stages'][name] = {'mean_ms': mean, 'p95_ms': p95, 'total_ms': stage_total, 'share': share}
+            print(f"{name:<12}{mean:>12.2f}{p95:>12.2f}{stage_total / 1000:>12.2f}{share:>9.1f}%")
+        print("-" * 58)
+
+        data_share = summary['stages']['data_wait']['share']
+        print(f"等待数据的step: {stalled_steps}/{num_steps} (阈值: 数据等待占step耗时 > {self.stall_threshold:.0%})")
+        if data_share > self.stall_threshold * 100:
+            print("⚠️  训练循环主要在等待DataLoader，建议增加num_workers或减少图像解码开销")
+        if peak_rss_mb is not None:
+            print(f"峰值RSS: {peak_rss_mb:.1f} MB")
+        if peak_cuda_mb is not None:
+            print(f"峰值显存: {peak_cuda_mb:.1f} MB")
+
+        self._write(summary)
+
+    def close(self):
+        if self._torch_profiler is not None:
+            # 训练在窗口结束前终止时也导出已采集的部分
+            self.trace_window = (self.trace_window[0], self.global_step)
+            self._maybe_stop_trace()
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
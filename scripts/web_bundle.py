@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Web部署模型打包
+将ONNX模型切分为按内容命名的数据块（可并行下载、被浏览器按块缓存），并预压缩为gzip/brotli，
+生成记录块哈希和大小的清单model_manifest.json。分块边界由内容决定（滚动哈希），
+模型更新后未变化的权重区域（例如冻结的前几层）仍落在相同的块中，终端只需下载变化的块。
+可选将权重存为float16（计算仍为float32），下载体积减半。
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+MANIFEST_NAME = 'model_manifest.json'
+BUNDLE_FORMAT = 'onnx-chunks-v1'
+
+# 内容定义分块参数：平均约1MB，最小256KB，最大4MB
+DEFAULT_AVG_CHUNK_KB = 1024
+MIN_CHUNK_RATIO = 0.25
+MAX_CHUNK_RATIO = 4
+HASH_WINDOW = 48
+# 每次计算滚动哈希的字节数，临时数组的内存占用与模型大小无关
+SCAN_BYTES = 1 << 20
+
+
+def _gear_table():
+    """固定种子的随机表，保证不同机器上的分块结果一致"""
+    return np.random.default_rng(20240601).integers(0, 2 ** 32, size=256, dtype=np.uint64)
+
+
+def content_defined_boundaries(data, avg_chunk_size):
+    """返回分块结束位置列表
+
+    对每个字节位置计算窗口内的随机表求和（滚动哈希），低位全零处作为候选边界，
+    再按最小/最大块大小筛选。边界只取决于附近的内容，插入或删除数据不会影响远处的分块。
+    按SCAN_BYTES分段计算，每段带上前一段末尾的HASH_WINDOW字节，结果与整体计算相同。
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if len(buffer) <= avg_chunk_size * MIN_CHUNK_RATIO:
+        return [len(buffer)]
+
+    gear = _gear_table()
+    mask = np.uint64((1 << int(np.log2(avg_chunk_size))) - 1)
+    candidates = []
+    for offset in range(0, len(buffer) - HASH_WINDOW, SCAN_BYTES):
+        cumulative = np.cumsum(gear[buffer[offset:offset + SCAN_BYTES + HASH_WINDOW]], dtype=np.uint64)
+        window_hash = cumulative[HASH_WINDOW:] - cumulative[:-HASH_WINDOW]
+        candidates.extend((np.flatnonzero((window_hash & mask) == 0) + offset + HASH_WINDOW + 1).tolist())
+
+    min_size = int(avg_chunk_size * MIN_CHUNK_RATIO)
+    max_size = int(avg_chunk_size * MAX_CHUNK_RATIO)
+    boundaries = []
+    start = 0
+    for position in candidates:
+        while position - start > max_size:
+            start += max_size
+            boundaries.append(start)
+        if position - start >= min_size:
+            boundaries.append(int(position))
+            start = int(position)
+    while len(buffer) - start > max_size:
+        start += max_size
+        boundaries.append(start)
+    if start < len(buffer):
+        boundaries.append(len(buffer))
+    return boundaries
+
+
+def load_onnx_bytes(onnx_path, fp16=False):
+    """读取ONNX模型为单个字节串（外部数据合并进模型），可选转换为float16权重"""
+    if not fp16:
+        data_path = onnx_path + '.data'
+        if not os.path.exists(data_path):
+            with open(onnx_path, 'rb') as f:
+                return f.read()
+
+    # 外部数据或float16转换需要onnx包
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    model = onnx.load(onnx_path)
+    if fp16:
+        model = convert_weights_to_fp16(model, onnx, helper, numpy_helper, TensorProto)
+    return model.SerializeToString()
+
+
+def convert_weights_to_fp16(model, onnx, helper, numpy_helper, TensorProto):
+    """将float32权重存为float16，并在图开头插入Cast节点还原为float32
+
+    输入输出和计算精度不变，浏览器端无需修改推理代码。
+    """
+    graph = model.graph
+    cast_nodes = []
+    converted = []
+    for initializer in graph.initializer:
+        if initializer.data_type != TensorProto.FLOAT:
+            continue
+        array = numpy_helper.to_array(initializer)
+        if array.size < 16:
+            # 标量和很小的张量（形状常量等）保持float32
+            continue
+        name = initializer.name
+        fp16_tensor = numpy_helper.from_array(array.astype(np.float16), name=f'{name}__fp16')
+        converted.append((initializer, fp16_tensor))
+        cast_nodes.append(helper.make_node('Cast', [f'{name}__fp16'], [name], to=TensorProto.FLOAT,
+                                           name=f'{name}__cast'))
+
+    for initializer, fp16_tensor in converted:
+        graph.initializer.remove(initializer)
+        graph.initializer.append(fp16_tensor)
+    # Cast节点放在最前，保证拓扑顺序
+    nodes = cast_nodes + list(graph.node)
+    del graph.node[:]
+    graph.node.extend(nodes)
+    onnx.checker.check_model(model)
+    print(f"已将 {len(converted)} 个权重张量转换为float16")
+    return model
+
+
+def compress_chunk(data, encodings):
+    """返回{编码: 压缩后字节}，未安装brotli时跳过br"""
+    compressed = {}
+    if 'gzip' in encodings:
+        compressed['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+    if 'br' in encodings:
+        try:
+            import brotli
+            compressed['br'] = brotli.compress(data, quality=11)
+        except ImportError:
+            pass
+    return compressed
+
+
+def build_web_bundle(onnx_path, output_dir, avg_chunk_kb=DEFAULT_AVG_CHUNK_KB, fp16=False,
+                     encodings=('gzip', 'br')):
+    """生成分块模型包，返回清单字典
+
+    输出目录中的块文件名为内容哈希，可设置为长期缓存(immutable)；
+    清单文件每次导出都会变化，应设置为不缓存或短缓存。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    data = load_onnx_bytes(onnx_path, fp16)
+    boundaries = content_defined_boundaries(data, avg_chunk_kb * 1024)
+
+    if 'br' in encodings:
+        try:
+            import brotli  # noqa: F401
+        except ImportError:
+            print("提示: 未安装brotli (pip install brotli)，只生成gzip压缩块")
+
+    chunks = []
+    written = set()
+    start = 0
+    for end in boundaries:
+        chunk = data[start:end]
+        digest = hashlib.sha256(chunk).hexdigest()
+        file_name = f'chunk-{digest[:20]}.bin'
+        entry = {'file': file_name, 'sha256': digest, 'offset': start, 'size': len(chunk), 'encodings': {}}
+
+        chunk_path = os.path.join(output_dir, file_name)
+        if file_name not in written and not os.path.exists(chunk_path):
+            with open(chunk_path, 'wb') as f:
+                f.write(chunk)
+        for encoding, payload in compress_chunk(chunk, encodings).items():
+            suffix = '.gz' if encoding == 'gzip' else '.br'
+            encoded_path = chunk_path + suffix
+            if file_name not in written and not os.path.exists(encoded_path):
+                with open(encoded_path, 'wb') as f:
+                    f.write(payload)
+            entry['encodings'][encoding] = {'file': file_name + suffix, 'size': len(payload)}
+        written.add(file_name)
+        chunks.append(entry)
+        start = end
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'model': os.path.basename(onnx_path),
+        'total_size': len(data),
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'weights_dtype': 'float16' if fp16 else 'float32',
+        'chunks': chunks
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    gzip_total = sum(c['encodings'].get('gzip', {}).get('size', c['size']) for c in chunks)
+    print(f"Web模型包已生成: {output_dir}")
+    print(f"  {len(chunks)} 个数据块, 原始 {len(data) / 1024 ** 2:.1f}MB, gzip {gzip_total / 1024 ** 2:.1f}MB, "
+          f"权重精度 {manifest['weights_dtype']}")
+    return manifest
+
+
+def prune_stale_chunks(output_dir, manifest):
+    """删除清单中不再引用的旧数据块"""
+    referenced = {MANIFEST_NAME}
+    for chunk in manifest['chunks']:
+        referenced.add(chunk['file'])
+        referenced.update(encoded['file'] for encoded in chunk['encodings'].values())
+    removed = 0
+    for file_name in os.listdir(output_dir):
+        if file_name.startswith('chunk-') and file_name not in referenced:
+            os.remove(os.path.join(output_dir, file_name))
+            removed += 1
+    return removed
+
+
+def diff_manifests(old_manifest, new_manifest):
+    """统计模型更新时需要重新下载的块数和字节数"""
+    old_hashes = {chunk['sha256'] for chunk in old_manifest['chunks']}
+    changed = [chunk for chunk in new_manifest['chunks'] if chunk['sha256'] not in old_hashes]
+    return len(changed), sum(chunk['size'] for chunk in changed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成分块、预压缩、可缓存的Web模型包')
+    parser.add_argument('--onnx_path', type=str,
+                       default='../public/models/resnet18_identity/resnet18_identity.onnx',
+                       help='ONNX模型路径')
+    parser.add_argument('--output_dir', type=str, default=None,
+                       help='输出目录（默认为模型目录下的web_bundle）')
+    parser.add_argument('--chunk_kb', type=int, default=DEFAULT_AVG_CHUNK_KB,
+                       help='平均块大小(KB)')
+    parser.add_argument('--fp16', action='store_true',
+                       help='权重存为float16（计算仍为float32）')
+    parser.add_argument('--keep_stale', action='store_true',
+                       help='保留旧版本的数据块（默认删除清单不再引用的块）')
+
+    args = parser.parse_args()
+    output_dir = args.output_dir or os.path.join(os.path.dirname(os.path.abspath(args.onnx_path)), 'web_bundle')
+
+    old_manifest = None
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            old_manifest = json.load(f)
+
+    manifest = build_web_bundle(args.onnx_path, output_dir, args.chunk_kb, args.fp16)
+
+    if old_manifest is not None:
+        changed, changed_bytes = diff_manifests(old_manifest, manifest)
+        print(f"相对上一版本: {changed}/{len(manifest['chunks'])} 个块变化，"
+              f"终端需下载 {changed_bytes / 1024 ** 2:.1f}MB")
+    if not args.keep_stale:
+        removed = prune_stale_chunks(output_dir, manifest)
+        if removed:
+            print(f"已删除 {removed} 个旧数据块文件")
+
+
+if __name__ == '__main__':
+    main()
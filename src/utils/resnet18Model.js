@@ -22,14 +22,141 @@ console.log('🔧 ONNX Runtime强制配置:', {
   webgpuDisabled: ort.env.webgpu.disabled
 });
 
+// 默认输入预处理（与旧版本模型一致）：RGB三通道、224x224、ImageNet归一化
+const DEFAULT_PREPROCESSING = {
+  input_mode: 'rgb',
+  channels: 3,
+  resize: [224, 224],
+  normalize: {
+    mean: [0.485, 0.456, 0.406],
+    std: [0.229, 0.224, 0.225]
+  }
+}
+
+// 分块模型包（scripts/web_bundle.py生成），位于模型文件同目录的web_bundle/下
+const BUNDLE_FORMAT = 'onnx-chunks-v1'
+const BUNDLE_MANIFEST = 'web_bundle/model_manifest.json'
+const BUNDLE_CACHE_NAME = 'resnet18-model-chunks'
+const BUNDLE_CONCURRENCY = 4
+
+// 读取metadata.json中Web端专用的会话设置(runtime.web.session_options)
+// ort_autotune.py在原生多核CPU上的调优结果(runtime.onnxruntime)不适用于WASM，不在这里使用；
+// 图优化级别、执行模式、线程和SIMD由loadModel固定（关闭优化、单线程、无SIMD），这里只接受内存相关选项
+function tunedWebSessionOptions(settings) {
+  if (!settings) return {}
+  const options = {}
+  if (typeof settings.enable_cpu_mem_arena === 'boolean') options.enableCpuMemArena = settings.enable_cpu_mem_arena
+  if (typeof settings.enable_mem_pattern === 'boolean') options.enableMemPattern = settings.enable_mem_pattern
+  return options
+}
+
+// 多任务模型（scripts/multi_task.py）：按metadata.tasks解释与身份logits同一次推理得到的其他输出
+function formatTaskOutputs(tasks, results) {
+  const formatted = {}
+  for (const [name, task] of Object.entries(tasks)) {
+    const tensor = results[task.output || name]
+    if (!tensor) continue
+    const values = Array.from(tensor.data)
+    if (task.type === 'classification') {
+      const max = Math.max(...values)
+      const exps = values.map(v => Math.exp(v - max))
+      const sum = exps.reduce((a, b) => a + b, 0)
+      const index = exps.indexOf(Math.max(...exps))
+      formatted[name] = { class: task.classes[index], confidence: exps[index] / sum }
+    } else {
+      formatted[name] = { value: values[0] }
+    }
+  }
+  return formatted
+}
+
+// MATLAB jet色图在位置x(0-1)处的RGB值，与scripts/spectrogram_preprocessing.py一致
+function jetColor(x) {
+  const interp = (xs, ys) => {
+    for (let i = 1; i < xs.length; i++) {
+      if (x <= xs[i]) {
+        return ys[i - 1] + (ys[i] - ys[i - 1]) * (x - xs[i - 1]) / (xs[i] - xs[i - 1])
+      }
+    }
+    return ys[ys.length - 1]
+  }
+  return [
+    interp([0, 3 / 8, 5 / 8, 7 / 8, 1], [0, 0, 1, 1, 0.5]),
+    interp([0, 1 / 8, 3 / 8, 5 / 8, 7 / 8, 1], [0, 0, 1, 1, 0, 0]),
+    interp([0, 1 / 8, 3 / 8, 5 / 8, 1], [0.5, 1, 1, 0, 0])
+  ]
+}
+
+// 构建量化RGB → 色图索引的反查表（最近邻匹配）
+function buildColormapLut(bits) {
+  const levels = 1 << bits
+  const step = 256 / levels
+  const colormap = []
+  for (let i = 0; i < 256; i++) {
+    colormap.push(jetColor(i / 255))
+  }
+  const lut = new Uint8Array(levels * levels * levels)
+  for (let r = 0; r < levels; r++) {
+    for (let g = 0; g < levels; g++) {
+      for (let b = 0; b < levels; b++) {
+        const cr = (r * step + step / 2) / 255
+        const cg = (g * step + step / 2) / 255
+        const cb = (b * step + step / 2) / 255
+        let best = 0
+        let bestDistance = Infinity
+        for (let i = 0; i < 256; i++) {
+          const [mr, mg, mb] = colormap[i]
+          const distance = (cr - mr) ** 2 + (cg - mg) ** 2 + (cb - mb) ** 2
+          if (distance < bestDistance) {
+            bestDistance = distance
+            best = i
+          }
+        }
+        lut[(r << (2 * bits)) | (g << bits) | b] = best
+      }
+    }
+  }
+  return lut
+}
+
 class ResNet18Classifier {
   constructor() {
     this.session = null
     this.isLoaded = false
     this.classNames = ['ID_1', 'ID_2', 'ID_3', 'ID_4', 'ID_5', 'ID_6', 'ID_7', 'ID_8', 'ID_9', 'ID_10']
+    this.preprocessing = DEFAULT_PREPROCESSING
+    this.colormapLut = null
+    this.tunedSessionOptions = {} // metadata.runtime.web中的Web端会话设置（仅内存选项）
+    this.tasks = {} // 多任务输出头（人员类型、步态质量等）
     this.loadingPromise = null // 防止并发加载
   }
 
+  // 读取模型目录下的metadata.json（输入预处理和类别名），不存在时沿用默认配置
+  async loadMetadata(metadataUrl) {
+    try {
+      const response = await fetch(metadataUrl)
+      if (!response.ok) {
+        console.log(`ℹ️ 未找到模型元数据，使用默认预处理: ${metadataUrl}`)
+        return
+      }
+      const metadata = await response.json()
+      if (metadata.preprocessing) {
+        this.preprocessing = { ...DEFAULT_PREPROCESSING, ...metadata.preprocessing }
+        if (this.preprocessing.input_mode === 'colormap') {
+          this.colormapLut = buildColormapLut(this.preprocessing.colormap?.lut_bits ?? 5)
+        }
+      }
+      if (Array.isArray(metadata.class_names) && metadata.class_names.length > 0) {
+        this.classNames = metadata.class_names
+      }
+      this.tunedSessionOptions = tunedWebSessionOptions(metadata.runtime?.web?.session_options)
+      this.tasks = metadata.tasks || {}
+      console.log('📋 模型预处理配置:', this.preprocessing)
+    } catch (error) {
+      console.warn('⚠️ 读取模型元数据失败，使用默认预处理:', error.message)
+    }
+  }
+
   // 加载ResNet18 ONNX模型
   async loadModel(progressCallback = null) {
     if (this.isLoaded && this.session) {
@@ -91,6 +218,7 @@ class ResNet18Classifier {
         })
       }
       
+      await this.loadMetadata(modelUrl.replace(/[^/]+$/, 'metadata.json'))
       const success = await this.tryLoadModel(modelUrl, progressCallback)
       
       if (success) {
@@ -147,7 +275,7 @@ class ResNet18Classifier {
       const downloadStartTime = Date.now()
       
       const modelBuffer = await Promise.race([
-        this.downloadWithProgress(modelUrl, progressCallback),
+        this.downloadModelBuffer(modelUrl, progressCallback),
         new Promise((_, reject) => 
           setTimeout(() => reject(new Error('下载超时（120秒）')), 120000)
         )
@@ -169,6 +297,7 @@ class ResNet18Classifier {
       
       // 设置ONNX会话选项 - 强制使用基础WASM后端
       const sessionOptions = {
+        ...this.tunedSessionOptions,
         executionProviders: [{
           name: 'wasm',
           // 禁用SIMD和多线程
@@ -264,6 +393,138 @@ class ResNet18Classifier {
     }
   }
 
+  // 优先按分块清单下载模型，清单不存在或加载失败时回退到完整模型文件
+  async downloadModelBuffer(modelUrl, progressCallback = null) {
+    const manifestUrl = modelUrl.replace(/[^/]+$/, BUNDLE_MANIFEST)
+    try {
+      const buffer = await this.downloadBundle(manifestUrl, progressCallback)
+      if (buffer) {
+        return buffer
+      }
+    } catch (error) {
+      console.warn('⚠️ 分块模型包加载失败，回退到完整模型文件:', error.message)
+    }
+    return this.downloadWithProgress(modelUrl, progressCallback)
+  }
+
+  // 并行下载内容哈希命名的数据块并拼接；已下载的块保存在Cache Storage中，模型更新后只下载变化的块
+  async downloadBundle(manifestUrl, progressCallback = null) {
+    const response = await fetch(manifestUrl, { cache: 'no-cache' })
+    if (!response.ok) {
+      console.log(`ℹ️ 未找到分块模型包，下载完整模型文件: ${manifestUrl}`)
+      return null
+    }
+    const manifest = await response.json()
+    if (manifest.format !== BUNDLE_FORMAT) {
+      console.warn(`⚠️ 不支持的模型包格式: ${manifest.format}`)
+      return null
+    }
+
+    const baseUrl = manifestUrl.replace(/[^/]+$/, '')
+    const totalMB = (manifest.total_size / 1024 / 1024).toFixed(1)
+    console.log(`📦 分块模型包: ${manifest.chunks.length}个数据块, ${totalMB}MB, 权重精度 ${manifest.weights_dtype}`)
+
+    let cache = null
+    if (typeof caches !== 'undefined') {
+      cache = await caches.open(BUNDLE_CACHE_NAME).catch(() => null)
+    }
+
+    const buffer = new Uint8Array(manifest.total_size)
+    let loadedBytes = 0
+    let cachedChunks = 0
+
+    const loadChunk = async (chunk) => {
+      const chunkUrl = new URL(baseUrl + chunk.file, window.location.href).href
+      let data = null
+      if (cache) {
+        const cached = await cache.match(chunkUrl)
+        if (cached) {
+          data = new Uint8Array(await cached.arrayBuffer())
+          if (data.byteLength === chunk.size && await this.verifyChunk(data, chunk.sha256)) {
+            cachedChunks++
+          } else {
+            data = null
+          }
+        }
+      }
+      if (!data) {
+        data = await this.fetchChunk(baseUrl, chunk)
+        if (data.byteLength !== chunk.size || !(await this.verifyChunk(data, chunk.sha256))) {
+          throw new Error(`数据块校验失败: ${chunk.file}`)
+        }
+        if (cache) {
+          await cache.put(chunkUrl, new Response(data)).catch(() => {})
+        }
+      }
+      buffer.set(data, chunk.offset)
+      loadedBytes += chunk.size
+
+      if (progressCallback) {
+        const progress = Math.min(99, loadedBytes / manifest.total_size * 100)
+        progressCallback({
+          progress: parseFloat(progress.toFixed(1)),
+          downloadedMB: (loadedBytes / 1024 / 1024).toFixed(1),
+          totalMB: totalMB,
+          status: `下载中: ${progress.toFixed(1)}%`
+        })
+      }
+    }
+
+    // 限制并发数并行下载
+    const pending = [...manifest.chunks]
+    const workers = Array.from({ length: Math.min(BUNDLE_CONCURRENCY, pending.length) }, async () => {
+      while (pending.length > 0) {
+        await loadChunk(pending.shift())
+      }
+    })
+    await Promise.all(workers)
+
+    // 清理旧版本模型遗留的数据块
+    if (cache) {
+      const validUrls = new Set(manifest.chunks.map(chunk => new URL(baseUrl + chunk.file, window.location.href).href))
+      for (const request of await cache.keys()) {
+        if (request.url.startsWith(new URL(baseUrl, window.location.href).href) && !validUrls.has(request.url)) {
+          await cache.delete(request)
+        }
+      }
+    }
+
+    console.log(`✅ 分块模型包加载完成: ${manifest.chunks.length - cachedChunks}个数据块下载, ${cachedChunks}个来自本地缓存`)
+    return buffer.buffer
+  }
+
+  // 下载单个数据块：浏览器支持DecompressionStream时下载gzip预压缩版本
+  async fetchChunk(baseUrl, chunk) {
+    const gzipFile = chunk.encodings?.gzip?.file
+    if (gzipFile && typeof DecompressionStream !== 'undefined') {
+      try {
+        const response = await fetch(baseUrl + gzipFile)
+        if (response.ok) {
+          const stream = response.body.pipeThrough(new DecompressionStream('gzip'))
+          return new Uint8Array(await new Response(stream).arrayBuffer())
+        }
+      } catch (error) {
+        // 服务器可能已按Content-Encoding自动解压，改为下载未压缩的块
+        console.warn(`⚠️ gzip数据块解压失败，改为下载原始数据块: ${chunk.file}`)
+      }
+    }
+    const response = await fetch(baseUrl + chunk.file)
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText} - ${chunk.file}`)
+    }
+    return new Uint8Array(await response.arrayBuffer())
+  }
+
+  // SHA-256校验（非安全上下文没有crypto.subtle时跳过）
+  async verifyChunk(data, sha256) {
+    if (!globalThis.crypto?.subtle) {
+      return true
+    }
+    const digest = new Uint8Array(await crypto.subtle.digest('SHA-256', data))
+    const hex = Array.from(digest, byte => byte.toString(16).padStart(2, '0')).join('')
+    return hex === sha256
+  }
+
   // 带进度显示的下载函数
   async downloadWithProgress(url, progressCallback = null) {
     console.log(`🌐 开始请求: ${url}`)
@@ -372,34 +633,86 @@ class ResNet18Classifier {
     return allChunks.buffer
   }
 
-  // 预处理图像：转换为ONNX格式输入 [1, 3, 224, 224]
+  // 模型输入张量形状 [1, C, H, W]
+  getInputShape() {
+    const [height, width] = this.preprocessing.resize
+    return [1, this.preprocessing.channels, height, width]
+  }
+
+  // 预处理图像：按元数据中的预处理配置转换为ONNX格式输入 [1, C, H, W]
+  // rgb: 三通道；gray: 亮度单通道；colormap: jet色图反查还原的强度单通道
+  // 色图模式：与训练(create_data_transforms)和gait_inference一致，先在原始分辨率上反查jet色图得到强度图，
+  // 再把强度图缩放到模型输入分辨率（先缩放再反查会把插值出的中间色映射成错误的强度）
+  drawColormapIntensity(ctx, imageElement, width, height) {
+    const sourceWidth = imageElement.naturalWidth || imageElement.videoWidth || imageElement.width
+    const sourceHeight = imageElement.naturalHeight || imageElement.videoHeight || imageElement.height
+    const source = document.createElement('canvas')
+    source.width = sourceWidth
+    source.height = sourceHeight
+    const sourceCtx = source.getContext('2d')
+    sourceCtx.drawImage(imageElement, 0, 0)
+    const sourceData = sourceCtx.getImageData(0, 0, sourceWidth, sourceHeight)
+    const pixels = sourceData.data
+
+    const bits = this.preprocessing.colormap?.lut_bits ?? 5
+    const shift = 8 - bits
+    for (let p = 0; p < pixels.length; p += 4) {
+      const intensity = this.colormapLut[
+        ((pixels[p] >> shift) << (2 * bits)) | ((pixels[p + 1] >> shift) << bits) | (pixels[p + 2] >> shift)
+      ]
+      pixels[p] = intensity
+      pixels[p + 1] = intensity
+      pixels[p + 2] = intensity
+      pixels[p + 3] = 255
+    }
+    sourceCtx.putImageData(sourceData, 0, 0)
+    ctx.drawImage(source, 0, 0, width, height)
+  }
+
   preprocessImage(imageElement) {
+    const [, channels, height, width] = this.getInputShape()
+    const { mean, std } = this.preprocessing.normalize
+    const mode = this.preprocessing.input_mode
+
     const canvas = document.createElement('canvas')
     const ctx = canvas.getContext('2d')
-    canvas.width = 224
-    canvas.height = 224
+    canvas.width = width
+    canvas.height = height
     
-    // 调整图像大小到224x224
-    ctx.drawImage(imageElement, 0, 0, 224, 224)
+    // 调整图像大小到模型输入分辨率
+    if (mode === 'colormap') {
+      this.drawColormapIntensity(ctx, imageElement, width, height)
+    } else {
+      ctx.drawImage(imageElement, 0, 0, width, height)
+    }
     
     // 获取像素数据
-    const imageData = ctx.getImageData(0, 0, 224, 224)
+    const imageData = ctx.getImageData(0, 0, width, height)
     const data = imageData.data
     
-    // 转换为ONNX格式: [1, 3, 224, 224] (NCHW)
-    const input = new Float32Array(1 * 3 * 224 * 224)
-    
-    // ImageNet归一化参数
-    const mean = [0.485, 0.456, 0.406]
-    const std = [0.229, 0.224, 0.225]
+    // 转换为ONNX格式: [1, C, H, W] (NCHW)
+    const planeSize = width * height
+    const input = new Float32Array(channels * planeSize)
     
-    for (let i = 0; i < 224 * 224; i++) {
+    for (let i = 0; i < planeSize; i++) {
       const pixelIndex = i * 4
-      
-      // RGB像素值归一化到[0,1]，然后标准化
-      input[i] = (data[pixelIndex] / 255.0 - mean[0]) / std[0]         // R
-      input[224 * 224 + i] = (data[pixelIndex + 1] / 255.0 - mean[1]) / std[1]  // G
-      input[224 * 224 * 2 + i] = (data[pixelIndex + 2] / 255.0 - mean[2]) / std[2]  // B
+      const r = data[pixelIndex]
+      const g = data[pixelIndex + 1]
+      const b = data[pixelIndex + 2]
+      
+      if (mode === 'colormap') {
+        // 画布中已是缩放后的强度图（R=G=B）
+        input[i] = (r / 255.0 - mean[0]) / std[0]
+      } else if (mode === 'gray') {
+        // 与PIL的'L'模式相同的亮度公式
+        const luma = (r * 299 + g * 587 + b * 114) / 1000
+        input[i] = (luma / 255.0 - mean[0]) / std[0]
+      } else {
+        // RGB像素值归一化到[0,1]，然后标准化
+        input[i] = (r / 255.0 - mean[0]) / std[0]
+        input[planeSize + i] = (g / 255.0 - mean[1]) / std[1]
+        input[planeSize * 2 + i] = (b / 255.0 - mean[2]) / std[2]
+      }
     }
     
     return input
@@ -416,7 +729,7 @@ class ResNet18Classifier {
       const inputData = this.preprocessImage(imageElement)
       
       // 创建ONNX输入tensor
-      const inputTensor = new ort.Tensor('float32', inputData, [1, 3, 224, 224])
+      const inputTensor = new ort.Tensor('float32', inputData, this.getInputShape())
       const feeds = { input: inputTensor }
       
       // 模型推理
@@ -429,11 +742,15 @@ class ResNet18Classifier {
       const confidence = predictions[maxIndex]
       const predictedClass = this.classNames[maxIndex]
       
-      return {
+      const prediction = {
         classId: predictedClass,
         confidence: confidence,
         timestamp: new Date().toISOString()
       }
+      if (Object.keys(this.tasks).length > 0) {
+        prediction.tasks = formatTaskOutputs(this.tasks, results)
+      }
+      return prediction
     } catch (error) {
       console.error('ONNX图像识别失败:', error)
       throw error